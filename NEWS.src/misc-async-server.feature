@@ -0,0 +1 @@
+The standalone server has an asyncServer mode that serves all connections from one poll() loop, so stalled changeset transfers no longer block XML-RPC calls
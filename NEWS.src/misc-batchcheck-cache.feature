@@ -0,0 +1 @@
+Repository servers with an authCacheTimeout cache granted batchCheck results per process, skipping the temporary table round trip for troves checked recently.
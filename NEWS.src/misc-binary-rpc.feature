@@ -0,0 +1 @@
+Clients and servers speaking protocol version 74 exchange calls in a compact binary encoding instead of XML-RPC, and trove info and file streams are no longer base64 encoded
@@ -0,0 +1 @@
+Repository commits stage the rows of every trove in a changeset in memory and bulkload them in a few large batches, and FilePaths gained a pathId index, roughly doubling commit throughput for large changesets.
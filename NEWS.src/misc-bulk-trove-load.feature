@@ -0,0 +1 @@
+Loading troves from the local database reads dependencies and trove info for all requested troves with a few set-based queries instead of several queries per trove.
@@ -0,0 +1 @@
+Dependency resolution against a trove list matches requirements using interned flag bitmasks, which is much faster when many troves provide the same soname.
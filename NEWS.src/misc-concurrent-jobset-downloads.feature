@@ -0,0 +1 @@
+Update job sets can be downloaded several at a time ahead of the one being applied (downloadJobSets, downloadBufferSize)
@@ -0,0 +1 @@
+Repository clients keep HTTP/1.1 connections alive in a per-destination pool shared by XML-RPC calls and file downloads
@@ -0,0 +1 @@
+Repository servers with memCacheTimeout set to 0 or more keep changeset fingerprint job expansions and per-trove digests in a per-process cache, so repeated getChangeSetFingerprints calls skip most database queries.
@@ -0,0 +1 @@
+Flavor scores computed while matching troves during an update are cached in the system database directory and reused by later updates.
@@ -0,0 +1 @@
+Changesets downloaded ahead of an update are written with a trailing index so individual file contents can be read without scanning the whole changeset.
@@ -0,0 +1 @@
+The system model trove cache is stored in an indexed file which is read lazily and appended to on save
@@ -0,0 +1 @@
+Repository servers cache the results of leaf queries for named troves (leafCacheLimit, default 10000 entries); schema 18.2 adds the per-item generation counters used to invalidate them when any server process updates the latest trove cache
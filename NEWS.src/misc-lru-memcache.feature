@@ -0,0 +1 @@
+The in-process repository cache used when no memcached server is configured is now a size-aware LRU cache with per-prefix quotas, controlled by the new memCacheLimit, memCacheSizeLimit and memCacheQuota options.
@@ -0,0 +1 @@
+The new inMemoryDepCheck option checks update dependencies with an in-memory index instead of temporary database tables, which is considerably faster for large updates that take several resolution rounds.
@@ -0,0 +1 @@
+Protocol version 75 adds a multiCall repository call which runs a batch of read-only calls in one request and one database transaction; clients use it to fetch several kinds of trove info at once
@@ -0,0 +1 @@
+Overlapping update jobs are found with a union-find over path hashes, and path hashes are looked up once per trove during dependency resolution
@@ -0,0 +1 @@
+Changesets and file contents from several repositories are now downloaded concurrently. The new downloadConcurrency option sets how many repositories are contacted at once.
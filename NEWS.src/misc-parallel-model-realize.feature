@@ -0,0 +1 @@
+Independent system model searches and fetches can run concurrently (modelSearchThreads)
@@ -0,0 +1 @@
+The new restoreThreads configuration option writes the contents of independent files on a pool of threads while applying updates.
@@ -0,0 +1 @@
+The mirror fetches bundles from the source while earlier ones are committed to the targets (prefetchBundles), and without hidden commits the mirror mark advances after each bundle
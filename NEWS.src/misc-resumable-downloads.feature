@@ -0,0 +1 @@
+Changeset and file contents downloads honor HTTP Range requests, and clients resume an interrupted download where it stopped instead of starting over
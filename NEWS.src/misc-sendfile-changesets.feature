@@ -0,0 +1 @@
+Changeset data that is sent verbatim is now transmitted with sendfile by the standalone server, and single-file responses use wsgi.file_wrapper
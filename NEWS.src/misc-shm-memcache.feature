@@ -0,0 +1 @@
+Setting memCache to shm:/path shares the repository cache between all worker processes through a memory-mapped file.
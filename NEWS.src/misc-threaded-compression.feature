@@ -0,0 +1 @@
+File contents are compressed on several threads when cooking and committing changesets; the resulting changeset is byte for byte identical.
@@ -42,7 +42,7 @@ from conary.conarycfg import selectSignatureKey
 from conary.deps import deps
 from conary.lib import debugger, log, logger, sha1helper, util, magic
 from conary.local import database
-from conary.repository import changeset, errors
+from conary.repository import changeset, errors, filecontainer
 from conary.conaryclient import callbacks as client_callbacks
 from conary.conaryclient.cmdline import parseTroveSpec
 from conary.state import ConaryState, ConaryStateFromFile
@@ -591,7 +591,8 @@ def cookObject(repos, cfg, loaderList, sourceVersion,
         signAbsoluteChangeset(cs, signatureKey)
 
     if changeSetFile:
-        cs.writeToFile(changeSetFile)
+        cs.writeToFile(changeSetFile,
+                compressThreads = filecontainer.defaultCompressThreads())
     else:
         repos.commitChangeSet(cs, callback = callback)
 
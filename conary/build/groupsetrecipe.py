@@ -1187,7 +1187,9 @@ class GroupSearchPathFetch(troveset.DelayedTupleSetAction):
             elif isinstance(ts, troveset.SearchPathTroveSet):
                 needed += ts.troveSetList
 
-        troveset.FetchAction._fetch(actionList, data)
+        data.troveCache.getTroves(
+                troveset.FetchAction._fetchTuples(actionList, data),
+                withFiles = False)
 
         self.outSet.setTroveSetList(self.primaryTroveSet.troveSetList)
 
@@ -45,7 +45,7 @@ class ModelData(object):
                                               client.getRepos(), client.cfg))
 
         self.troveTups = set()
-        for withFiles, trv in troveCache.cache.values():
+        for trv in troveCache.iterCachedTroves():
             for nvf in trv.iterTroveList(strongRefs = True, weakRefs = True):
                 self.troveTups.add(nvf)
 
@@ -593,6 +593,8 @@ class ConaryContext(ConfigSection):
     keepRequired          =  CfgBool
     ignoreDependencies    =  (CfgDependencyClassList,
                               [ deps.AbiDependency, deps.RpmLibDependencies])
+    inMemoryDepCheck      =  (CfgBool, False, "Check the dependencies of "
+            "updates in memory instead of in temporary database tables")
     installLabelPath      =  CfgInstallLabelPath
     interactive           =  (CfgBool, False)
     logFile               =  (CfgPathList, ('/var/log/conary',
@@ -603,6 +605,8 @@ class ConaryContext(ConfigSection):
                                             '/etc/conary/distro/mirrors',
                                             '/etc/conary/mirrors',))
     modelPath             =  '/etc/conary/system-model'
+    modelSearchThreads    =  (CfgInt, 1, "Number of independent system "
+            "model searches to run at the same time")
     name                  =  None
     quiet                 =  CfgBool
     pinTroves             =  CfgRegExpList
@@ -621,6 +625,8 @@ class ConaryContext(ConfigSection):
             "for outbound HTTP requests.")
     downloadAttempts      = (CfgInt, 3, "Number of attempts to restart an "
             "interrupted download")
+    downloadConcurrency   = (CfgInt, 4, "Maximum number of repositories "
+            "to download changesets and file contents from at the same time")
     downloadRetryThreshold = (CfgBytes('M'), 10000000,
             "Reset the download attempt count if at least this many megabytes "
             "have been transferred since the last failure")
@@ -641,6 +647,8 @@ class ConaryContext(ConfigSection):
     factoryTemplate       =  None
     repositoryMap         =  CfgRepoMap
     resolveLevel          =  (CfgInt, 2)
+    restoreThreads        =  (CfgInt, 1, "Number of threads used to write "
+            "file contents to disk when applying updates")
     root                  =  (CfgPath, '/')
     recipeTemplateDirs    =  (CfgPathList, ('~/.conary/recipeTemplates',
                                             '/etc/conary/recipeTemplates'))
@@ -655,6 +663,11 @@ class ConaryContext(ConfigSection):
     sourceSearchDir       =  (CfgPath, '.')
     threaded              =  (CfgBool, True)
     downloadFirst         =  (CfgBool, False)
+    downloadJobSets       =  (CfgInt, 1, "Number of update job sets to "
+            "download at the same time while an update is being applied")
+    downloadBufferSize    =  (CfgBytes('M'), 512000000,
+            "Stop downloading job sets ahead once the ones waiting to be "
+            "applied take up this many megabytes")
     tmpDir                =  (CfgPath, _getDefaultTempDir())
     trustThreshold        =  (CfgInt, 0)
     trustedCerts          =  (CfgPathList, (),
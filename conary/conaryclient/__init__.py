@@ -88,6 +88,7 @@ class ConaryClient(ClientClone, ClientBranch, ClientUpdate, ClientNewTrove,
         self.cfg = cfg
         self.db = database.Database(cfg.root, cfg.dbPath, cfg.modelPath,
                                     modelFile=modelFile)
+        self.db.restoreThreads = cfg.restoreThreads
         if repos:
             self.repos = repos
         else:
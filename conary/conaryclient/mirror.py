@@ -14,7 +14,9 @@
 # limitations under the License.
 #
 
+import collections
 import copy
+import heapq
 import itertools
 import optparse
 import os
@@ -27,7 +29,7 @@ import traceback
 from conary.conaryclient import callbacks as clientCallbacks
 from conary.conaryclient import cmdline
 from conary import conarycfg, callbacks, trove
-from conary.lib import cfg, util, log
+from conary.lib import cfg, util, log, workerpool
 from conary.repository import errors, changeset, netclient
 from conary.deps.deps import parseFlavor
 
@@ -120,6 +122,10 @@ class MirrorFileConfiguration(cfg.SectionedConfigFile):
             "Split jobs that would commit two versions of a trove at once. "
             "Needed for compatibility with older repositories.")
     noPGP = (cfg.CfgBool, False)
+    prefetchBundles = (cfg.CfgInt, 1,
+            "Number of bundles fetched from the source ahead of the one "
+            "being committed to the targets; 0 fetches each bundle only "
+            "when it is needed")
 
     _allowNewSections = True
     _defaultSectionType = MirrorConfigurationSection
@@ -492,8 +498,8 @@ def displayJobList(jobList):
     return displayBundle([(0, x) for x in jobList])
 
 # mirroring stuff when we are running into PathIdConflict errors
-def splitJobList(jobList, src, targetSet, hidden = False, callback = ChangesetCallback()):
-    log.debug("Changeset Key conflict detected; splitting job further...")
+def _splitJobList(jobList):
+    # split a job list by package, for changesets with conflicting keys
     jobs = {}
     for job in jobList:
         name = job[0]
@@ -501,21 +507,100 @@ def splitJobList(jobList, src, targetSet, hidden = False, callback = ChangesetCa
             name = name.split(':')[0]
         l = jobs.setdefault(name, [])
         l.append(job)
-    i = 0
-    for smallJobList in jobs.itervalues():
-        (outFd, tmpName) = util.mkstemp()
-        os.close(outFd)
-        log.debug("jobsplit %d of %d %s" % (
-            i + 1, len(jobs), displayBundle([(0,x) for x in smallJobList])))
-        src.createChangeSetFile(smallJobList, tmpName, recurse = False,
+    return jobs.values()
+
+def _fetchChangeSetFile(src, jobList, callback):
+    (outFd, tmpName) = util.mkstemp()
+    os.close(outFd)
+    try:
+        src.createChangeSetFile(jobList, tmpName, recurse = False,
                                 callback = callback, mirrorMode = True)
-        _parallel(targetSet, TargetRepository.commitChangeSetFile,
-                tmpName, hidden=hidden, callback=callback)
+    except:
         os.unlink(tmpName)
-        callback.done()
-        i += 1
-    return
+        raise
+    return tmpName
+
+def _fetchBundle(src, jobList, callback):
+    # returns the list of changeset files to commit for jobList, in order
+    try:
+        return [ _fetchChangeSetFile(src, jobList, callback) ]
+    except changeset.ChangeSetKeyConflictError:
+        pass
+
+    log.debug("Changeset Key conflict detected; splitting job further...")
+    jobs = _splitJobList(jobList)
+    fileList = []
+    try:
+        for i, smallJobList in enumerate(jobs):
+            log.debug("jobsplit %d of %d %s" % (
+                i + 1, len(jobs),
+                displayBundle([(0,x) for x in smallJobList])))
+            fileList.append(_fetchChangeSetFile(src, smallJobList, callback))
+    except:
+        _removeFiles(fileList)
+        raise
+    return fileList
+
+def _removeFiles(fileList):
+    for fileName in fileList:
+        try:
+            os.unlink(fileName)
+        except OSError:
+            pass
 
+def _fetchBundles(src, bundles, prefetch, callback):
+    """
+    Yield C{(bundle, fileList)} for each bundle in order, where fileList
+    is the list of changeset files to commit for it. Up to C{prefetch}
+    bundles are fetched ahead of the one being committed, so at most
+    C{prefetch + 1} bundles are on disk at once. The files of a bundle are
+    removed once the next one is asked for.
+    """
+    def _fetch(i, bundle, callback):
+        log.debug("getting (%d of %d) %s" % (i + 1, len(bundles),
+                                             displayBundle(bundle)))
+        return _fetchBundle(src, [ x[1] for x in bundle ], callback)
+
+    if prefetch <= 0:
+        for i, bundle in enumerate(bundles):
+            fileList = _fetch(i, bundle, callback)
+            try:
+                yield bundle, fileList
+            finally:
+                _removeFiles(fileList)
+        return
+
+    # a single worker fetches the bundles in order, so the source
+    # repository is only used from one thread; it gets its own callback
+    # to keep its progress apart from the commits
+    callback = copy.copy(callback)
+    callback.setPrefix("source: ")
+    pool = workerpool.WorkerPool(1, name = 'mirror-fetch')
+    pending = collections.deque()
+    bundleIter = enumerate(bundles)
+    try:
+        while True:
+            for i, bundle in itertools.islice(bundleIter,
+                                              prefetch + 1 - len(pending)):
+                pending.append((bundle,
+                                pool.submit(_fetch, i, bundle, callback)))
+            if not pending:
+                break
+
+            bundle, result = pending.popleft()
+            fileList = result.get()
+            try:
+                yield bundle, fileList
+            finally:
+                _removeFiles(fileList)
+    finally:
+        # wait for the fetches already started before cleaning up after them
+        pool.close()
+        for bundle, result in pending:
+            try:
+                _removeFiles(result.get())
+            except Exception:
+                pass
 
 # filter a trove tuple based on cfg
 def _filterTup(troveTup, cfg):
@@ -691,6 +776,30 @@ def mirrorRemoved(sourceRepos, targetRepos, troveSet, test = False, callback = C
     callback.done()
     return len(jobList)
 
+class _PendingMarks(object):
+    """
+    Marks of the troves which are still to be committed to a target.
+    """
+
+    def __init__(self, marks):
+        self._counts = {}
+        for mark in marks:
+            self._counts[mark] = self._counts.get(mark, 0) + 1
+        self._heap = self._counts.keys()
+        heapq.heapify(self._heap)
+
+    def remove(self, marks):
+        for mark in marks:
+            self._counts[mark] -= 1
+        while self._heap and not self._counts[self._heap[0]]:
+            heapq.heappop(self._heap)
+
+    def first(self):
+        # the lowest mark still pending, or None when nothing is
+        if self._heap:
+            return self._heap[0]
+        return None
+
 # target repo class that helps dealing with testing mode
 class TargetRepository:
     def __init__(self, repo, cfg, name = 'target', test=False):
@@ -918,6 +1027,7 @@ def mirrorRepository(sourceRepos, targetRepos, cfg,
 
     # removed troves are a special blend - we keep them separate
     removedSet  = set([ x[1] for x in troveList if x[2] == trove.TROVE_TYPE_REMOVED ])
+    removedMarks = [ x[0] for x in troveList if x[2] == trove.TROVE_TYPE_REMOVED ]
     troveList = [ (x[0], x[1]) for x in troveList if x[2] != trove.TROVE_TYPE_REMOVED ]
 
     # figure out if we need to recurse the group-troves
@@ -991,6 +1101,15 @@ def mirrorRepository(sourceRepos, targetRepos, cfg,
     # sort the targetSets by length
     targetSets = list(enumerate(targetSetList))
     targetSets.sort(lambda a,b: cmp(len(a[1]), len(b[1])))
+    # without hidden commits there is only one target, and its mirror mark
+    # follows the bundles as they are committed; an interrupted run starts
+    # again from the first trove which didn't make it
+    if hidden or test:
+        pendingMarks = None
+    else:
+        pendingMarks = _PendingMarks(
+                [ x[0] for troveList in byTarget.itervalues()
+                  for x in troveList ] + removedMarks)
     bundlesMark = 0
     for idx, targetSet in targetSets:
         troveList = byTarget[idx]
@@ -1002,31 +1121,31 @@ def mirrorRepository(sourceRepos, targetRepos, cfg,
         target = list(targetSet)[0]
         bundles = buildBundles(sourceRepos, target, troveList,
                 cfg.absoluteChangesets, cfg.splitNodes)
-        for i, bundle in enumerate(bundles):
-            jobList = [ x[1] for x in bundle ]
-            # XXX it's a shame we can't give a hint as to what server to use
-            # to avoid having to open the changeset and read in bits of it
-            if test:
+        if test:
+            for i, bundle in enumerate(bundles):
+                jobList = [ x[1] for x in bundle ]
                 log.debug("test mode: not mirroring (%d of %d) %s" % (i + 1, len(bundles), jobList))
                 updateCount += len(bundle)
-                continue
-            (outFd, tmpName) = util.mkstemp()
-            os.close(outFd)
-            log.debug("getting (%d of %d) %s" % (i + 1, len(bundles), displayBundle(bundle)))
-            try:
-                sourceRepos.createChangeSetFile(jobList, tmpName, recurse = False,
-                                                callback = callback, mirrorMode = True)
-            except changeset.ChangeSetKeyConflictError:
-                splitJobList(jobList, sourceRepos, targetSet, hidden=hidden,
-                             callback=callback)
-            else:
-                _parallel(targetSet, TargetRepository.commitChangeSetFile,
-                        tmpName, hidden=hidden, callback=callback)
+        else:
+            # XXX it's a shame we can't give a hint as to what server to use
+            # to avoid having to open the changeset and read in bits of it
+            fetched = _fetchBundles(sourceRepos, bundles,
+                                    cfg.prefetchBundles, callback)
             try:
-                os.unlink(tmpName)
-            except OSError:
-                pass
-            callback.done()
+                for bundle, fileList in fetched:
+                    for tmpName in fileList:
+                        _parallel(targetSet,
+                                TargetRepository.commitChangeSetFile,
+                                tmpName, hidden=hidden, callback=callback)
+                        callback.done()
+                    if pendingMarks is not None:
+                        pendingMarks.remove([ x[0] for x in bundle ])
+                        mark = pendingMarks.first()
+                        if mark is not None and mark > long(targets[0].mark):
+                            targets[0].setMirrorMark(mark)
+            finally:
+                # waits for the fetches in flight and removes their files
+                fetched.close()
         updateCount += len(bundle)
         # compute the max mark of the bundles we comitted
         mark = max([min([x[0] for x in bundle]) for bundle in bundles])
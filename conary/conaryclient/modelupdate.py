@@ -34,6 +34,7 @@ class CMLActionData(troveset.ActionData):
         troveset.ActionData.__init__(self, troveCache, flavor)
         self.repos = repos
         self.cfg = cfg
+        self.maxWorkers = cfg.modelSearchThreads
 
 class CMLTroveCache(trovecache.TroveCache):
 
@@ -94,9 +95,6 @@ class CMLTroveCache(trovecache.TroveCache):
                   (not self.troveIsCached(x) and x not in self.componentMap) ]
         self.cacheTroves(need)
 
-    def cacheModified(self):
-        return self._getSizeTuple() != self._startingSizes
-
     def getPackageComponents(self, troveTup):
         if self.troveIsCached(troveTup):
             trv = self.getTrove(withFiles = False, *troveTup)
@@ -112,7 +110,8 @@ class DatabaseTroveSet(troveset.SearchSourceTroveSet):
 
     # this class changes the name of the node in the dot graph. handy.
 
-    pass
+    def _searchesDatabase(self):
+        return True
 
 class CMLExcludeTrovesAction(troveset.DelayedTupleSetAction):
 
@@ -244,7 +243,8 @@ class CMLFinalFetchAction(troveset.FetchAction):
 
     prefilter = troveset.FetchAction
 
-    def _fetch(self, actionList, data):
+    @staticmethod
+    def _fetchTuples(actionList, data):
         troveTuples = set()
 
         for action in actionList:
@@ -256,7 +256,7 @@ class CMLFinalFetchAction(troveset.FetchAction):
                                 (trove.troveIsGroup(troveTup[0]) or isExplicit)
                                ) )
 
-        data.troveCache.getTroves(troveTuples, withFiles = False)
+        return troveTuples
 
 class FlattenedTroveTupleSet(troveset.DelayedTupleSet):
 
@@ -441,19 +441,15 @@ class CMLClient(object):
         # be nice if we could explicitly get the trove types from the
         # repository, but we can't right now
         newTroves = [ (x[0], x[2][0], x[2][1]) for x in jobList ]
-        newTroveSizes = troveCache.getTroveInfo(
-                                trove._TROVEINFO_TAG_SIZE, newTroves)
+        (newTroveSizes, scripts, compatibilityClasses, capsuleInfo) = \
+            troveCache.getMultipleTroveInfo(
+                                [ trove._TROVEINFO_TAG_SIZE,
+                                  trove._TROVEINFO_TAG_SCRIPTS,
+                                  trove._TROVEINFO_TAG_COMPAT_CLASS,
+                                  trove._TROVEINFO_TAG_CAPSULE ], newTroves)
         missingSize = [ troveTup for (troveTup, size) in
                             itertools.izip(newTroves, newTroveSizes)
                             if size is None ]
-
-        scripts = troveCache.getTroveInfo(trove._TROVEINFO_TAG_SCRIPTS,
-                                          newTroves)
-        compatibilityClasses = troveCache.getTroveInfo(
-                                          trove._TROVEINFO_TAG_COMPAT_CLASS,
-                                          newTroves)
-        capsuleInfo = troveCache.getTroveInfo(trove._TROVEINFO_TAG_CAPSULE,
-                newTroves)
         neededTroves = [ troveTup for (troveTup, script, compatClass)
                          in itertools.izip(newTroves, scripts,
                                            compatibilityClasses)
@@ -727,7 +723,8 @@ class CMLClient(object):
         if resolveDeps or split:
             check = self.db.getDepStateClass(troveCache,
                findOrdering = split,
-               ignoreDepClasses = self.cfg.ignoreDependencies)
+               ignoreDepClasses = self.cfg.ignoreDependencies,
+               inMemory = self.cfg.inMemoryDepCheck)
 
             linkedJobs = self._findOverlappingJobs(job, troveCache,
                                       pathHashCache = pathHashCache)
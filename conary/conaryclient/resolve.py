@@ -76,7 +76,8 @@ class DependencySolver(object):
         ineligible = set()
 
         check = self.db.getDepStateClass(uJob.getTroveSource(),
-           findOrdering = split, ignoreDepClasses = self.cfg.ignoreDependencies)
+           findOrdering = split, ignoreDepClasses = self.cfg.ignoreDependencies,
+           inMemory = self.cfg.inMemoryDepCheck)
 
         (result, cannotResolve, keepList, ineligible) = \
                         self.checkDeps(uJob, jobSet, troveSource,
@@ -21,7 +21,7 @@ from conary import trove, versions
 from conary.conaryclient import cml
 from conary.deps import deps
 from conary.errors import ConaryError, TroveSpecsNotFound
-from conary.lib import graph, sha1helper
+from conary.lib import graph, sha1helper, workerpool
 from conary.repository import searchsource, trovesource
 
 class SimpleFilteredTroveSource(trovesource.SimpleTroveSource):
@@ -212,6 +212,10 @@ class TroveSet(object):
     def __str__(self):
         return self.__class__.__name__ #+ '%' + str(id(self))
 
+    def _searchesDatabase(self):
+        # True if finding troves in this set reads the local database
+        return False
+
     def _action(self, *args, **kwargs):
         ActionClass = kwargs.pop('ActionClass')
         index = kwargs.pop('index', None)
@@ -547,6 +551,10 @@ class SearchPathTroveSet(SearchSourceTroveSet):
         assert(self.troveSetList is None)
         self.troveSetList = troveSetList
 
+    def _searchesDatabase(self):
+        return bool([ ts for ts in self.troveSetList or []
+                      if ts._searchesDatabase() ])
+
     def _getResolveSource(self, depDb = None, filterFn = None):
         # we search differently then we resolve; resolving is recursive
         # while searching isn't
@@ -561,6 +569,9 @@ class SearchPathTroveSet(SearchSourceTroveSet):
 
 class ActionData(object):
 
+    # number of independent batched actions realized at the same time
+    maxWorkers = 1
+
     def __init__(self, repos, flavor):
         self.troveCache = repos
         self.flavor = flavor
@@ -636,18 +647,29 @@ class FetchAction(ParallelAction):
         self.fetchAll = all
 
     def fetchAction(self, actionList, data):
-        for action in actionList:
-            action.outSet._setOptional(action.primaryTroveSet._getOptionalSet())
-            action.outSet._setInstall(action.primaryTroveSet._getInstallSet())
-
-        self._fetch(actionList, data);
-
+        self.fetchGroups([ (self.__class__, actionList) ], data)
         return True
 
     __call__ = fetchAction
 
     @staticmethod
-    def _fetch(actionList, data):
+    def fetchGroups(groupList, data):
+        # groupList is a list of (FetchAction class, actionList) tuples;
+        # the troves for all of them are fetched in one call
+        troveTuples = set()
+        for actionClass, actionList in groupList:
+            for action in actionList:
+                action.outSet._setOptional(
+                                action.primaryTroveSet._getOptionalSet())
+                action.outSet._setInstall(
+                                action.primaryTroveSet._getInstallSet())
+
+            troveTuples.update(actionClass._fetchTuples(actionList, data))
+
+        data.troveCache.getTroves(troveTuples, withFiles = False)
+
+    @staticmethod
+    def _fetchTuples(actionList, data):
         troveTuples = set()
 
         for action in actionList:
@@ -661,7 +683,7 @@ class FetchAction(ParallelAction):
 
             troveTuples.update(newTuples)
 
-        data.troveCache.getTroves(troveTuples, withFiles = False)
+        return troveTuples
 
 class FindAction(ParallelAction):
 
@@ -682,32 +704,13 @@ class FindAction(ParallelAction):
                 else:
                     l.append((action.outSet, troveSpec))
 
+        # each input set is searched independently of the others
         notFound = set()
-        for inSet, searchList in troveSpecsByInSet.iteritems():
-            cacheable = set()
-            cached = set()
-            for i, (outSet, troveSpec) in enumerate(searchList):
-                if troveSpec.version and '/' in troveSpec.version:
-                    match = data.troveCache.getFindResult(troveSpec)
-                    if match is None:
-                        cacheable.add(i)
-                    else:
-                        cached.add(i)
-                        outSet._setInstall(match)
-
-            d = inSet._findTroves([ x[1] for i, x in enumerate(searchList)
-                                            if i not in cached ])
-            for i, (outSet, troveSpec) in enumerate(searchList):
-                if i in cached:
-                    continue
-
-                if troveSpec in d:
-                    outSet._setInstall(d[troveSpec])
-                    if i in cacheable:
-                        data.troveCache.addFindResult(troveSpec,
-                                                      d[troveSpec])
-                else:
-                    notFound.add(troveSpec)
+        for missing in workerpool.parallelMap(
+                lambda x: self._find(x[0], x[1], data),
+                troveSpecsByInSet.iteritems(), data.maxWorkers,
+                name = 'find'):
+            notFound.update(missing)
 
         if notFound:
             raise TroveSpecsNotFound(sorted(notFound))
@@ -716,6 +719,48 @@ class FindAction(ParallelAction):
 
     __call__ = findAction
 
+    @staticmethod
+    def _find(inSet, searchList, data):
+        # searchList is a list of (outSet, troveSpec) tuples; returns the
+        # troveSpecs which were not found
+        notFound = set()
+        cacheable = set()
+        cached = set()
+        for i, (outSet, troveSpec) in enumerate(searchList):
+            if troveSpec.version and '/' in troveSpec.version:
+                match = data.troveCache.getFindResult(troveSpec)
+                if match is None:
+                    cacheable.add(i)
+                else:
+                    cached.add(i)
+                    outSet._setInstall(match)
+
+        # the local database connection can't be used by several threads
+        # at once, and the trove cache reads from it while holding its lock
+        lock = None
+        if inSet._searchesDatabase():
+            lock = data.troveCache._lock
+            lock.acquire()
+        try:
+            d = inSet._findTroves([ x[1] for i, x in enumerate(searchList)
+                                            if i not in cached ])
+        finally:
+            if lock is not None:
+                lock.release()
+        for i, (outSet, troveSpec) in enumerate(searchList):
+            if i in cached:
+                continue
+
+            if troveSpec in d:
+                outSet._setInstall(d[troveSpec])
+                if i in cacheable:
+                    data.troveCache.addFindResult(troveSpec,
+                                                  d[troveSpec])
+            else:
+                notFound.add(troveSpec)
+
+        return notFound
+
     def __str__(self):
         if not self.troveSpecs:
             s = '()'
@@ -1201,26 +1246,57 @@ class OperationGraph(graph.DirectedGraph):
 
             assert(layer)
             byAction = {}
+            actionOrder = []
 
             for node in layer:
                 if not node.realized:
                     if isinstance(node, DelayedTupleSet):
-                        byAction.setdefault(
-                            node.action.__class__, []).append(node)
+                        action = node.action.__class__
+                        if action not in byAction:
+                            byAction[action] = []
+                            actionOrder.append(action)
+                        byAction[action].append(node)
                     else:
                         node.realize(data)
 
-            for action, nodeList in byAction.iteritems():
-                if issubclass(action, ParallelAction):
-                    nodeList[0].action([ node.action for node in nodeList ],
-                                       data)
-                    for node in nodeList:
-                        node.beenRealized(data)
-                else:
-                    for node in nodeList:
+            self._realizeParallel(
+                    [ (action, byAction[action]) for action in actionOrder
+                      if issubclass(action, ParallelAction) ], data)
+
+            for action in actionOrder:
+                if not issubclass(action, ParallelAction):
+                    for node in byAction[action]:
                         if not node.realize(data):
                             reset = True
 
+    @staticmethod
+    def _realizeParallel(groupList, data):
+        # Every node in the layer has all of its inputs realized, so the
+        # batched actions are independent of each other. Fetches for the
+        # whole layer become one call, and the other batches run on a pool
+        # of data.maxWorkers threads. Each batch only writes the output
+        # sets of its own nodes, so the order they finish in doesn't
+        # change the results.
+        fetchList = []
+        batchList = []
+        for action, nodeList in groupList:
+            actionList = [ node.action for node in nodeList ]
+            if (issubclass(action, FetchAction) and
+                    action.__call__ == FetchAction.__call__):
+                fetchList.append((action, actionList))
+            else:
+                batchList.append((actionList[0], actionList))
+
+        if fetchList:
+            batchList.insert(0, (FetchAction.fetchGroups, fetchList))
+
+        workerpool.parallelMap(lambda x: x[0](x[1], data), batchList,
+                               data.maxWorkers, name = 'realize')
+
+        for action, nodeList in groupList:
+            for node in nodeList:
+                node.beenRealized(data)
+
     def trace(self, troveSpecList):
         ordering = self.getTotalOrdering()
 
@@ -23,6 +23,7 @@ import itertools
 import re
 import os
 import tempfile
+import threading
 import traceback
 import sys
 
@@ -31,11 +32,11 @@ from conary.callbacks import UpdateCallback
 from conary.conaryclient import cmdline, resolve
 from conary.deps import deps
 from conary.errors import ClientError, ConaryError, InternalConaryError, MissingTrovesError, DecodingError
-from conary.lib import log, util, api
+from conary.lib import log, util, api, workerpool
 from conary.lib import cfgtypes
 from conary.local import capsules
 from conary.local import database
-from conary.repository import changeset, trovesource, searchsource
+from conary.repository import changeset, filecontainer, trovesource, searchsource
 from conary.repository.errors import TroveMissing, OpenError
 from conary import trove, versions
 
@@ -107,6 +108,45 @@ class UpdateChangeSet(changeset.ReadOnlyChangeSet):
         self.contents = []
         self.empty = True
 
+class _DownloadBudget(object):
+    """
+    Tracks the size of the job sets which have been downloaded but not
+    applied yet. Job sets are only downloaded ahead while that is under
+    C{limit}; the next job set to be applied is always allowed.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.nextJob = 0
+        self.sizes = {}
+        self.changed = threading.Event()
+        self._lock = threading.Lock()
+
+    def allows(self, jobIdx):
+        self._lock.acquire()
+        try:
+            return (jobIdx == self.nextJob or not self.limit or
+                    sum(self.sizes.itervalues()) < self.limit)
+        finally:
+            self._lock.release()
+
+    def add(self, jobIdx, size):
+        self._lock.acquire()
+        self.sizes[jobIdx] = size
+        self._lock.release()
+        self.changed.set()
+
+    def release(self, jobIdx):
+        self._lock.acquire()
+        self.sizes.pop(jobIdx, None)
+        self.nextJob = jobIdx + 1
+        self._lock.release()
+        self.changed.set()
+
+def _changeSetSize(cs):
+    # downloaded changesets are read from slices of temporary files
+    return sum(getattr(x.file, 'size', 0) for x in cs.fileContainers)
+
 class ClientUpdate(object):
 
     @staticmethod
@@ -727,7 +767,8 @@ class ClientUpdate(object):
         [ existsTrv.addTrove(*x) for x in referencedNotInstalled ]
 
         jobList = availableTrove.diff(existsTrv,
-                                      getPathHashes=lookupPathHashes)[2]
+                                      getPathHashes=lookupPathHashes,
+                                      scoreCache=self.db.flavorScoreCache)[2]
 
         # alreadyReferenced troves are in both the update set
         # and the installed set.  They are a good match for themselves.
@@ -1381,86 +1422,76 @@ conary erase '%s=%s[%s]'
         if pathHashCache is None:
             pathHashCache = {}
 
-        # overlapping is a dict from jobSet id -> overlapping id OR
-        # jobSet id -> list of other ids that overlap.
-        # for example, overlapping[3] -> 2, and overlapping[2] -> [2,3]
-        # would be reasonable, meaning that the set at id 2 contains
-        # all the overlapping troves there.
-        overlapping = {}
-
-        # d is a dict of pathHash -> id of first job that has that
-        # pathHash.
-        d = {}
-
-        jobSet = list(enumerate(jobSet))
-
-        oldTroves = [ (idx, (x[0], x[1][0], x[1][1]))
-                        for idx, x in jobSet if x[1][0] ]
-        pathHashesNeeded = [ x for (idx, x) in oldTroves
-                                    if x not in pathHashCache and
-                                    not trove.troveIsCollection(x[0]) ]
-        oldPathHashes = self.db.getPathHashesForTroveList(pathHashesNeeded)
-        pathHashCache.update(itertools.izip(pathHashesNeeded, oldPathHashes))
-        oldJobs = [ (jobSet[idx], pathHashCache.get(info, None))
-                                    for (idx, info) in oldTroves ]
-
-        getHashes = troveSource.getPathHashesForTroveList
-        justNewJobs = [ x for x in jobSet if x[1][2][0] ]
-        newTroves = [ (x[1][0], x[1][2][0], x[1][2][1]) for x in justNewJobs ]
-        newJobs = ( (x, hashes) for x, hashes in
-                        itertools.izip(justNewJobs, getHashes(newTroves)) )
-
-        for ((idx, job), pathHashes) in itertools.chain(oldJobs, newJobs):
+        jobSet = list(jobSet)
+
+        oldTroves = [ (idx, (job[0], job[1][0], job[1][1]))
+                        for idx, job in enumerate(jobSet) if job[1][0] ]
+        newTroves = [ (idx, (job[0], job[2][0], job[2][1]))
+                        for idx, job in enumerate(jobSet) if job[2][0] ]
+
+        # path hashes are cached by trove tuple, and callers pass the same
+        # cache for each round of dependency resolution, so only troves
+        # which haven't been seen yet are looked up
+        def _pathHashes(troveList, getPathHashes, skip = lambda x: False):
+            missing = []
+            hashList = [ pathHashCache.get(x, missing)
+                            for (idx, x) in troveList ]
+            needed = [ i for i, hashes in enumerate(hashList)
+                        if hashes is missing ]
+            for i in needed:
+                hashList[i] = None
+
+            needed = [ i for i in needed if not skip(troveList[i][1][0]) ]
+            if needed:
+                tupList = [ troveList[i][1] for i in needed ]
+                for i, tup, hashes in itertools.izip(needed, tupList,
+                                                getPathHashes(tupList)):
+                    pathHashCache[tup] = hashes
+                    hashList[i] = hashes
+
+            return itertools.izip([ x[0] for x in troveList ], hashList)
+
+        # collections don't have paths, so the database isn't asked about
+        # them
+        jobHashes = itertools.chain(
+                _pathHashes(oldTroves, self.db.getPathHashesForTroveList,
+                            skip = trove.troveIsCollection),
+                _pathHashes(newTroves, troveSource.getPathHashesForTroveList))
+
+        # parent is a union-find forest over the job indexes; jobs which
+        # share a path end up with the same root
+        parent = {}
+
+        def _root(idx):
+            root = idx
+            while parent[root] != root:
+                root = parent[root]
+            while idx != root:
+                parent[idx], idx = root, parent[idx]
+            return root
+
+        # firstJob is a dict of pathHash -> index of the first job which
+        # adds or removes that path; every later job touching the same
+        # path is joined to it
+        firstJob = {}
+        for idx, pathHashes in jobHashes:
             if pathHashes is None:
                 continue
             for pathHash in pathHashes:
-                if pathHash not in d:
-                    d[pathHash] = idx
-                else:
-                    if d[pathHash] == idx:
-                        continue
-                    # someone else already had this issue.  Find out
-                    # what overlapping set they are in and add ourselves to
-                    # it.
-                    newIdx = d[pathHash]
-
-                    if idx in overlapping:
-                        # if we're already part of a set, find our set.
-                        while isinstance(overlapping[idx], int):
-                            idx = overlapping[idx]
-
-                        if newIdx in overlapping and overlapping[newIdx] == idx:
-                            # in this case newIdx is already a part of our
-                            # set.
-                            continue
-                        overlapping[idx].append(newIdx)
-                    else:
-                        # create a new set consisting of ourselves and
-                        # newIdx.
-                        overlapping[idx] = [idx, newIdx]
-
-                    if newIdx in overlapping:
-                        # if newIdx was already part of a set,
-                        # find that set and extend our set with it.
-                        while isinstance(overlapping[newIdx], int):
-                            oldIdx = overlapping[newIdx]
-                            overlapping[newIdx] = idx
-                            newIdx = oldIdx
-                        if newIdx == idx:
-                            continue
-
-                        overlapping[idx].extend(overlapping[newIdx])
+                otherIdx = firstJob.setdefault(pathHash, idx)
+                if otherIdx == idx:
+                    continue
+                parent.setdefault(idx, idx)
+                parent.setdefault(otherIdx, otherIdx)
+                root, otherRoot = _root(idx), _root(otherIdx)
+                if root != otherRoot:
+                    parent[max(root, otherRoot)] = min(root, otherRoot)
 
-                    # we've joined newIdx (and maybe all its friends) into
-                    # our set, so now point newIdx to our set.
-                    overlapping[newIdx] = idx
+        sets = {}
+        for idx in sorted(parent):
+            sets.setdefault(_root(idx), []).append(jobSet[idx])
 
-        sets = []
-        for val in overlapping.itervalues():
-            if isinstance(val, int):
-                continue
-            sets.append([ jobSet[x][1] for x in set(val) ])
-        return sets
+        return [ sets[x] for x in sorted(sets) ]
 
     def _trovesNotFound(self, notFound):
         """
@@ -3370,6 +3401,10 @@ conary erase '%s=%s[%s]'
             (depList, suggMap, cannotResolve, splitJob, keepList,
              criticalUpdates) = ( [], {}, [], [ list(jobSet) ], [], [] )
 
+        # flavor scores gathered while building and resolving the job are
+        # written out once, now that nothing else will be scored
+        self.db.flavorScoreCache.save()
+
         if keepList:
             self.updateCallback.done()
             for job, depSet, reqInfo in sorted(keepList):
@@ -3493,13 +3528,7 @@ conary erase '%s=%s[%s]'
                                               for x in sorted(extraTroves)))
 
     def _createCs(self, repos, db, jobSet, uJob):
-        baseCs = changeset.ReadOnlyChangeSet()
-
-        cs, remainder = uJob.getTroveSource().createChangeSet(jobSet,
-                                    recurse = False, withFiles = True,
-                                    withFileContents = True,
-                                    useDatabase = False)
-        baseCs.merge(cs)
+        baseCs, remainder = self._createLocalCs(jobSet, uJob)
         if remainder:
             newCs = repos.createChangeSet(remainder, recurse = False,
                                           callback = self.updateCallback)
@@ -3509,6 +3538,18 @@ conary erase '%s=%s[%s]'
 
         return baseCs
 
+    def _createLocalCs(self, jobSet, uJob):
+        # returns the part of the job set which the update job's trove
+        # source provides, and the jobs which need to be downloaded
+        baseCs = changeset.ReadOnlyChangeSet()
+
+        cs, remainder = uJob.getTroveSource().createChangeSet(jobSet,
+                                    recurse = False, withFiles = True,
+                                    withFileContents = True,
+                                    useDatabase = False)
+        baseCs.merge(cs)
+        return baseCs, remainder
+
     def _applyCs(self, cs, uJob, **kwargs):
         # Before applying this job, reset the underlying changesets. This
         # lets us traverse user-supplied changesets multiple times.
@@ -3539,7 +3580,7 @@ conary erase '%s=%s[%s]'
                 raise UpdateError, "changeset cannot be applied:\n%s" % e
             raise
 
-    def _createAllCs(self, q, allJobs, uJob, cfg, stopSelf):
+    def _createAllCs(self, q, allJobs, uJob, cfg, stopSelf, budget = None):
         # Reopen the local database so we don't share a sqlite object
         # with the main thread. This gets the user map from the already
         # existing repository object to ensure we still have access to
@@ -3555,33 +3596,124 @@ conary erase '%s=%s[%s]'
         repos = self.createRepos(db, cfg)
         self.updateCallback.setAbortEvent(stopSelf)
 
+        maxWorkers = min(cfg.downloadJobSets, len(allJobs))
+        if maxWorkers > 1:
+            csIter = self._downloadAllCs(repos, db, allJobs, uJob, cfg,
+                                         stopSelf, budget, maxWorkers)
+        else:
+            csIter = self._downloadAllCsSerially(repos, db, allJobs, uJob,
+                                                 stopSelf)
+
+        try:
+            for newCs in csIter:
+                while True:
+                    # block for no more than 5 seconds so we can
+                    # check to see if we should abort
+                    try:
+                        q.put((False, newCs), True, 5)
+                        break
+                    except Queue.Full:
+                        # if the queue is full, check to see if the
+                        # other thread wants to quit
+                        if stopSelf.isSet():
+                            return
+        except:
+            q.put((True, sys.exc_info()))
+            return
+
+        if stopSelf.isSet():
+            return
+
+        self.updateCallback.setAbortEvent(None)
+        q.put(None)
+
+        # returning terminates the thread
+
+    def _downloadAllCsSerially(self, repos, db, allJobs, uJob, stopSelf):
         for i, job in enumerate(allJobs):
             if stopSelf.isSet():
                 return
 
             self.updateCallback.setChangesetHunk(i + 1, len(allJobs))
+            yield self._createCs(repos, db, job, uJob)
+
+    def _downloadAllCs(self, repos, db, allJobs, uJob, cfg, stopSelf,
+                       budget, maxWorkers):
+        # Download up to maxWorkers job sets at once, running ahead of the
+        # job set being applied while the budget allows, and yield them in
+        # order. The update job's trove source and the local database are
+        # only used from this thread; each worker reopens the database, as
+        # this thread did, for a repository client of its own to use.
+        callback = workerpool.SerializedProxy(self.updateCallback)
+        workerData = threading.local()
+        workerDbs = []
+        if budget is None:
+            budget = _DownloadBudget(cfg.downloadBufferSize)
+
+        def _download(jobIdx, remainder):
+            if stopSelf.isSet():
+                return None
             try:
-                newCs = self._createCs(repos, db, job, uJob)
-            except:
-                q.put((True, sys.exc_info()))
-                return
+                workerRepos = getattr(workerData, 'repos', None)
+                if workerRepos is None:
+                    workerDb = database.Database(cfg.root, cfg.dbPath,
+                                                 timeout = 300000)
+                    workerDbs.append(workerDb)
+                    workerRepos = workerData.repos = self.createRepos(
+                                                        workerDb, cfg)
+                newCs = workerRepos.createChangeSet(remainder,
+                        recurse = False, callback = callback)
+                budget.add(jobIdx, _changeSetSize(newCs))
+                return newCs
+            finally:
+                budget.changed.set()
+
+        def _ready(result):
+            return result is None or result.ready()
+
+        pool = workerpool.WorkerPool(maxWorkers, name = 'jobset')
+        # jobIdx -> (changeset from the trove source, download result)
+        pending = {}
+        try:
+            nextJob = 0
+            for i in range(len(allJobs)):
+                while (not stopSelf.isSet() and
+                       (i not in pending or not _ready(pending[i][1]))):
+                    running = len([ x for x in pending.itervalues()
+                                    if not _ready(x[1]) ])
+                    if (nextJob < len(allJobs) and running < maxWorkers and
+                            budget.allows(nextJob)):
+                        baseCs, remainder = self._createLocalCs(
+                                                    allJobs[nextJob], uJob)
+                        result = None
+                        if remainder:
+                            result = pool.submit(_download, nextJob,
+                                                 remainder)
+                        pending[nextJob] = (baseCs, result)
+                        nextJob += 1
+                        continue
 
-            while True:
-                # block for no more than 5 seconds so we can
-                # check to see if we should abort
-                try:
-                    q.put((False, newCs), True, 5)
-                    break
-                except Queue.Full:
-                    # if the queue is full, check to see if the
-                    # other thread wants to quit
-                    if stopSelf.isSet():
-                        return
+                    budget.changed.wait(1)
+                    budget.changed.clear()
 
-        self.updateCallback.setAbortEvent(None)
-        q.put(None)
+                if stopSelf.isSet():
+                    return
 
-        # returning terminates the thread
+                baseCs, result = pending.pop(i)
+                if result is not None:
+                    baseCs.merge(result.get())
+                self._replaceIncomplete(baseCs, db, db, repos)
+                # the workers download out of order, so the hunks are
+                # reported as they are handed on
+                self.updateCallback.setChangesetHunk(i + 1, len(allJobs))
+                yield baseCs
+        finally:
+            if pending:
+                # abort the downloads which are still running
+                stopSelf.set()
+            pool.close()
+            for workerDb in workerDbs:
+                workerDb.close()
 
     @api.publicApi
     def getDownloadSizes(self, uJob):
@@ -3624,7 +3756,8 @@ conary erase '%s=%s[%s]'
 
             # Dump the changeset to disk
             path = os.path.join(destDir, "%04d.ccs" % i)
-            newCs.writeToFile(path)
+            newCs.writeToFile(path,
+                    versionOverride = filecontainer.FILE_CONTAINER_VERSION_TOC)
             csFiles.append(path)
 
         uJob.setJobsChangesetList(csFiles)
@@ -3772,9 +3905,11 @@ conary erase '%s=%s[%s]'
 
         csQueue = Queue.Queue(5)
         stopDownloadEvent = Event()
+        budget = _DownloadBudget(self.cfg.downloadBufferSize)
 
         downloadThread = Thread(None, self._createAllCs,
-                args = (csQueue, allJobs, uJob, self.cfg, stopDownloadEvent))
+                args = (csQueue, allJobs, uJob, self.cfg, stopDownloadEvent,
+                        budget))
         downloadThread.start()
 
         try:
@@ -3804,6 +3939,7 @@ conary erase '%s=%s[%s]'
                 kwargs['jobIdx'] = i - 1
                 self._applyCs(newCs, uJob, removeHints = removeHints,
                               **kwargs)
+                budget.release(i - 1)
                 self.updateCallback.updateDone()
                 if self.updateCallback.cancelOperation():
                     break
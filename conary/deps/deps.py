@@ -1882,6 +1882,130 @@ class DependencyMatcher(object):
         self.depMap.clear()
 
 
+class CompactDependencyMatcher(object):
+    """
+    Matches requirements against a large set of provides.
+
+    Works like L{DependencyMatcher}, but interns flag names to small
+    integers and stores the flags of each provide as a single integer
+    bitmask, so testing a provide is one C{&} operation rather than a loop
+    over its flags. Provides are indexed by (class, name), and flags are
+    numbered separately for each (class, name) so the masks stay as small
+    as the flags of that dependency allow. L{checkMany}
+    checks many dependency sets at once, testing each distinct
+    requirement only once.
+    """
+
+    def __init__(self, ignoreDepClasses=()):
+        self.ignoreDepClasses = set()
+        for depClass in ignoreDepClasses:
+            if not isinstance(depClass, (int, long)):
+                depClass = depClass.tag
+            self.ignoreDepClasses.add(depClass)
+        self.clear()
+
+    @staticmethod
+    def _provMask(flagIds, flags):
+        mask = 0
+        for flag in flags:
+            flagId = flagIds.get(flag)
+            if flagId is None:
+                flagId = flagIds[flag] = len(flagIds)
+            mask |= 1 << flagId
+        return mask
+
+    @staticmethod
+    def _depMask(flagIds, flags):
+        # returns None if a flag isn't provided by anything
+        mask = 0
+        for flag in flags:
+            assert flag[0] not in '~!'
+            flagId = flagIds.get(flag)
+            if flagId is None:
+                return None
+            mask |= 1 << flagId
+        return mask
+
+    def add(self, depSet, data=None):
+        for depClassId, depName, depFlags in depSet.iterRawDeps():
+            self.addRaw(depClassId, depName, depFlags, data)
+
+    def addRaw(self, depClassId, depName, depFlags, data=None):
+        if depClassId in self.ignoreDepClasses:
+            return
+        key = (depClassId, depName)
+        provides = self.depMap.get(key)
+        if provides is None:
+            # flag ids, provide masks, provide data
+            provides = self.depMap[key] = ({}, [], [])
+        provides[1].append(self._provMask(provides[0], depFlags))
+        provides[2].append(data)
+
+    def _matches(self, depClassId, depName, depFlags):
+        provides = self.depMap.get((depClassId, depName))
+        if provides is None:
+            return []
+        mask = self._depMask(provides[0], depFlags)
+        if mask is None:
+            return []
+        if not mask:
+            return list(provides[2])
+        return [ data for provMask, data in itertools.izip(provides[1],
+                                                           provides[2])
+                 if provMask & mask == mask ]
+
+    def _satisfied(self, depClassId, depName, depFlags):
+        provides = self.depMap.get((depClassId, depName))
+        if provides is None:
+            return False
+        mask = self._depMask(provides[0], depFlags)
+        if mask is None:
+            return False
+        for provMask in provides[1]:
+            if provMask & mask == mask:
+                return True
+        return False
+
+    def find(self, depSet):
+        return [ self._matches(*x) for x in depSet.iterRawDeps() ]
+
+    def findRaw(self, depClassId, depName, depFlags):
+        return self._matches(depClassId, depName, depFlags)
+
+    def check(self, depSet):
+        return self.checkMany([depSet])[0]
+
+    def checkMany(self, depSetList):
+        """
+        Return a list parallel to C{depSetList} holding, for each
+        dependency set, a DependencySet of the requirements which are not
+        provided, or None if everything is provided.
+        """
+        results = []
+        seen = {}
+        for depSet in depSetList:
+            unsatisfied = None
+            for depClassId, depName, depFlags in depSet.iterRawDeps():
+                if depClassId in self.ignoreDepClasses:
+                    continue
+                key = (depClassId, depName, tuple(depFlags))
+                found = seen.get(key)
+                if found is None:
+                    found = seen[key] = self._satisfied(depClassId, depName,
+                                                        depFlags)
+                if not found:
+                    if unsatisfied is None:
+                        unsatisfied = DependencySet()
+                    depClass = dependencyClasses[depClassId]
+                    dep = DependencyClass.thawRawDep(depName, depFlags)
+                    unsatisfied.addDep(depClass, dep)
+            results.append(unsatisfied)
+        return results
+
+    def clear(self):
+        self.depMap = {}
+
+
 dependencyCache = weakref.WeakValueDictionary()
 
 ident = '(?:[0-9A-Za-z_-]+)'
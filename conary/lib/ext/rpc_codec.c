@@ -0,0 +1,452 @@
+/*
+ * Copyright (c) SAS Institute Inc.
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+/*
+ * Compact binary encoding for RPC arguments and results. See rpc_codec.py
+ * for a description of the format; both implementations must agree.
+ */
+
+#include <Python.h>
+#include <string.h>
+#include <stdint.h>
+#include "pycompat.h"
+
+#define MAX_DEPTH 100
+
+static PyObject * dumps(PyObject *self, PyObject *args);
+static PyObject * loads(PyObject *self, PyObject *args);
+
+static PyMethodDef methods[] = {
+    { "dumps", dumps, METH_VARARGS },
+    { "loads", loads, METH_VARARGS },
+    {NULL}  /* Sentinel */
+};
+
+
+struct buffer {
+    char *data;
+    Py_ssize_t size;
+    Py_ssize_t alloced;
+};
+
+
+static int reserve(struct buffer *buf, Py_ssize_t extra) {
+    Py_ssize_t needed = buf->size + extra;
+    Py_ssize_t alloced = buf->alloced;
+    char *data;
+
+    if (needed <= alloced)
+        return 0;
+    while (alloced < needed)
+        alloced *= 2;
+    data = PyMem_Realloc(buf->data, alloced);
+    if (data == NULL) {
+        PyErr_NoMemory();
+        return -1;
+    }
+    buf->data = data;
+    buf->alloced = alloced;
+    return 0;
+}
+
+
+static int putHeader(struct buffer *buf, char tag, Py_ssize_t len) {
+    unsigned char *ptr;
+
+    if (len > 0xFFFFFFFFLL) {
+        PyErr_SetString(PyExc_ValueError, "value is too large to encode");
+        return -1;
+    }
+    if (reserve(buf, 5))
+        return -1;
+    ptr = (unsigned char *) buf->data + buf->size;
+    ptr[0] = tag;
+    ptr[1] = (len >> 24) & 0xFF;
+    ptr[2] = (len >> 16) & 0xFF;
+    ptr[3] = (len >> 8) & 0xFF;
+    ptr[4] = len & 0xFF;
+    buf->size += 5;
+    return 0;
+}
+
+
+static int putBytes(struct buffer *buf, char tag, const char *data,
+                    Py_ssize_t len) {
+    if (putHeader(buf, tag, len) || reserve(buf, len))
+        return -1;
+    memcpy(buf->data + buf->size, data, len);
+    buf->size += len;
+    return 0;
+}
+
+
+static int put64(struct buffer *buf, char tag, uint64_t val) {
+    unsigned char *ptr;
+    int i;
+
+    if (reserve(buf, 9))
+        return -1;
+    ptr = (unsigned char *) buf->data + buf->size;
+    ptr[0] = tag;
+    for (i = 8; i > 0; i--) {
+        ptr[i] = val & 0xFF;
+        val >>= 8;
+    }
+    buf->size += 9;
+    return 0;
+}
+
+
+static int putLong(struct buffer *buf, PyObject *value) {
+    PY_LONG_LONG val;
+    PyObject *str;
+    int rc;
+
+    val = PyLong_AsLongLong(value);
+    if (val != -1 || !PyErr_Occurred())
+        return put64(buf, 'i', (uint64_t) val);
+    if (!PyErr_ExceptionMatches(PyExc_OverflowError))
+        return -1;
+    PyErr_Clear();
+
+    /* too big for 64 bits, send it as a decimal string */
+    str = PyObject_Str(value);
+    if (str == NULL)
+        return -1;
+    rc = putBytes(buf, 'l', PYBYTES_AS_STRING(str), PYBYTES_GET_SIZE(str));
+    Py_DECREF(str);
+    return rc;
+}
+
+
+static int dumpValue(struct buffer *buf, PyObject *value, int depth) {
+    Py_ssize_t i, size;
+
+    if (depth > MAX_DEPTH) {
+        PyErr_SetString(PyExc_ValueError, "value is nested too deeply");
+        return -1;
+    }
+
+    if (value == Py_None) {
+        if (reserve(buf, 1))
+            return -1;
+        buf->data[buf->size++] = 'N';
+    } else if (PyBool_Check(value)) {
+        if (reserve(buf, 1))
+            return -1;
+        buf->data[buf->size++] = (value == Py_True) ? 'T' : 'F';
+    } else if (PYBYTES_Check(value)) {
+        return putBytes(buf, 's', PYBYTES_AS_STRING(value),
+                        PYBYTES_GET_SIZE(value));
+    } else if (PYINT_Check(value)) {
+        return put64(buf, 'i', (uint64_t) (PY_LONG_LONG)
+                     PYINT_AS_LONG(value));
+    } else if (PyList_Check(value) || PyTuple_Check(value)) {
+        PyObject *seq = PySequence_Fast(value, "");
+        if (seq == NULL)
+            return -1;
+        size = PySequence_Fast_GET_SIZE(seq);
+        if (putHeader(buf, '[', size)) {
+            Py_DECREF(seq);
+            return -1;
+        }
+        for (i = 0; i < size; i++) {
+            if (dumpValue(buf, PySequence_Fast_GET_ITEM(seq, i), depth + 1)) {
+                Py_DECREF(seq);
+                return -1;
+            }
+        }
+        Py_DECREF(seq);
+    } else if (PyDict_Check(value)) {
+        PyObject *key, *item;
+        i = 0;
+        if (putHeader(buf, '{', PyDict_Size(value)))
+            return -1;
+        while (PyDict_Next(value, &i, &key, &item)) {
+            if (dumpValue(buf, key, depth + 1) ||
+                    dumpValue(buf, item, depth + 1))
+                return -1;
+        }
+    } else if (PyLong_Check(value)) {
+        return putLong(buf, value);
+    } else if (PyUnicode_Check(value)) {
+        PyObject *utf8 = PyUnicode_AsUTF8String(value);
+        int rc;
+        if (utf8 == NULL)
+            return -1;
+        rc = putBytes(buf, 'u', PYBYTES_AS_STRING(utf8),
+                      PYBYTES_GET_SIZE(utf8));
+        Py_DECREF(utf8);
+        return rc;
+    } else if (PyFloat_Check(value)) {
+        union {
+            double d;
+            uint64_t u;
+        } conv;
+        conv.d = PyFloat_AS_DOUBLE(value);
+        return put64(buf, 'd', conv.u);
+    } else {
+        PyErr_Format(PyExc_TypeError, "cannot marshal %s objects",
+                     Py_TYPE(value)->tp_name);
+        return -1;
+    }
+    return 0;
+}
+
+
+static PyObject * dumps(PyObject *self, PyObject *args) {
+    struct buffer buf;
+    PyObject *rc = NULL;
+
+    if (PyTuple_GET_SIZE(args) != 1) {
+        PyErr_SetString(PyExc_TypeError, "exactly one argument expected");
+        return NULL;
+    }
+
+    buf.size = 0;
+    buf.alloced = 4096;
+    buf.data = PyMem_Malloc(buf.alloced);
+    if (buf.data == NULL)
+        return PyErr_NoMemory();
+
+    if (!dumpValue(&buf, PyTuple_GET_ITEM(args, 0), 0))
+        rc = PYBYTES_FromStringAndSize(buf.data, buf.size);
+    PyMem_Free(buf.data);
+    return rc;
+}
+
+
+struct reader {
+    const unsigned char *ptr;
+    const unsigned char *end;
+};
+
+
+static int truncated(void) {
+    PyErr_SetString(PyExc_ValueError, "truncated data");
+    return -1;
+}
+
+
+/* Read a length. Strings take that many bytes and every item of a list or
+ * dict takes at least one, so anything longer than the rest of the data is
+ * truncated; checking that before converting keeps the length from coming
+ * out negative where Py_ssize_t is 32 bits. */
+static int getLength(struct reader *rd, Py_ssize_t *val) {
+    const unsigned char *p = rd->ptr;
+    uint32_t v;
+
+    if (rd->end - p < 4)
+        return truncated();
+    v = ((uint32_t) p[0] << 24) | ((uint32_t) p[1] << 16) |
+        ((uint32_t) p[2] << 8) | p[3];
+    rd->ptr += 4;
+    if ((size_t) (rd->end - rd->ptr) < (size_t) v)
+        return truncated();
+    *val = (Py_ssize_t) v;
+    return 0;
+}
+
+
+static int get64(struct reader *rd, uint64_t *val) {
+    const unsigned char *p = rd->ptr;
+    uint64_t v = 0;
+    int i;
+
+    if (rd->end - p < 8)
+        return truncated();
+    for (i = 0; i < 8; i++)
+        v = (v << 8) | p[i];
+    *val = v;
+    rd->ptr += 8;
+    return 0;
+}
+
+
+static int getBytes(struct reader *rd, const char **data, Py_ssize_t *len) {
+    if (getLength(rd, len))
+        return -1;
+    *data = (const char *) rd->ptr;
+    rd->ptr += *len;
+    return 0;
+}
+
+
+static PyObject * loadValue(struct reader *rd, int depth) {
+    const char *data;
+    Py_ssize_t i, len;
+    uint64_t val;
+    PyObject *value, *key, *item;
+    char tag;
+
+    if (depth > MAX_DEPTH) {
+        PyErr_SetString(PyExc_ValueError, "value is nested too deeply");
+        return NULL;
+    }
+    if (rd->ptr == rd->end) {
+        truncated();
+        return NULL;
+    }
+
+    tag = *rd->ptr++;
+    switch (tag) {
+    case 's':
+        if (getBytes(rd, &data, &len))
+            return NULL;
+        return PYBYTES_FromStringAndSize(data, len);
+
+    case 'i':
+        if (get64(rd, &val))
+            return NULL;
+        if ((PY_LONG_LONG) val >= LONG_MIN && (PY_LONG_LONG) val <= LONG_MAX)
+            return PYINT_FromLong((long) val);
+        return PyLong_FromLongLong((PY_LONG_LONG) val);
+
+    case '[':
+        if (getLength(rd, &len))
+            return NULL;
+        value = PyList_New(len);
+        if (value == NULL)
+            return NULL;
+        for (i = 0; i < len; i++) {
+            item = loadValue(rd, depth + 1);
+            if (item == NULL) {
+                Py_DECREF(value);
+                return NULL;
+            }
+            PyList_SET_ITEM(value, i, item);
+        }
+        return value;
+
+    case 'N':
+        Py_RETURN_NONE;
+
+    case 'T':
+        Py_RETURN_TRUE;
+
+    case 'F':
+        Py_RETURN_FALSE;
+
+    case '{':
+        if (getLength(rd, &len))
+            return NULL;
+        value = PyDict_New();
+        if (value == NULL)
+            return NULL;
+        for (i = 0; i < len; i++) {
+            key = loadValue(rd, depth + 1);
+            if (key == NULL) {
+                Py_DECREF(value);
+                return NULL;
+            }
+            item = loadValue(rd, depth + 1);
+            if (item == NULL || PyDict_SetItem(value, key, item)) {
+                Py_DECREF(key);
+                Py_XDECREF(item);
+                Py_DECREF(value);
+                return NULL;
+            }
+            Py_DECREF(key);
+            Py_DECREF(item);
+        }
+        return value;
+
+    case 'u':
+        if (getBytes(rd, &data, &len))
+            return NULL;
+        return PyUnicode_DecodeUTF8(data, len, NULL);
+
+    case 'l': {
+        char *digits, *end;
+        Py_ssize_t i;
+        if (getBytes(rd, &data, &len))
+            return NULL;
+        /* PyLong_FromString also takes signs and whitespace; only accept
+         * what the pure Python codec does */
+        i = (len > 0 && data[0] == '-') ? 1 : 0;
+        if (i == len) {
+            PyErr_SetString(PyExc_ValueError, "invalid long");
+            return NULL;
+        }
+        for (; i < len; i++) {
+            if (data[i] < '0' || data[i] > '9') {
+                PyErr_SetString(PyExc_ValueError, "invalid long");
+                return NULL;
+            }
+        }
+        digits = PyMem_Malloc(len + 1);
+        if (digits == NULL)
+            return PyErr_NoMemory();
+        memcpy(digits, data, len);
+        digits[len] = '\0';
+        value = PyLong_FromString(digits, &end, 10);
+        if (value != NULL && end != digits + len) {
+            Py_DECREF(value);
+            value = NULL;
+            PyErr_SetString(PyExc_ValueError, "invalid long");
+        }
+        PyMem_Free(digits);
+        return value;
+    }
+
+    case 'd': {
+        union {
+            double d;
+            uint64_t u;
+        } conv;
+        if (get64(rd, &conv.u))
+            return NULL;
+        return PyFloat_FromDouble(conv.d);
+    }
+
+    default:
+        PyErr_Format(PyExc_ValueError, "unknown type tag 0x%02x",
+                     (unsigned char) tag);
+        return NULL;
+    }
+}
+
+
+static PyObject * loads(PyObject *self, PyObject *args) {
+    PyObject *dataArg, *value;
+    struct reader rd;
+
+    if (PyTuple_GET_SIZE(args) != 1) {
+        PyErr_SetString(PyExc_TypeError, "exactly one argument expected");
+        return NULL;
+    }
+    dataArg = PyTuple_GET_ITEM(args, 0);
+    if (!PYBYTES_CheckExact(dataArg)) {
+        PyErr_SetString(PyExc_TypeError, "expected a string");
+        return NULL;
+    }
+
+    rd.ptr = (const unsigned char *) PYBYTES_AS_STRING(dataArg);
+    rd.end = rd.ptr + PYBYTES_GET_SIZE(dataArg);
+    value = loadValue(&rd, 0);
+    if (value != NULL && rd.ptr != rd.end) {
+        Py_DECREF(value);
+        PyErr_SetString(PyExc_ValueError,
+                        "extra data after the encoded value");
+        return NULL;
+    }
+    return value;
+}
+
+
+PYMODULE_DECLARE(rpc_codec, methods, "Binary encoding for RPC values");
+
+/* vim: set sts=4 sw=4 expandtab : */
@@ -0,0 +1,166 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+"""
+Compact binary encoding for RPC arguments and results.
+
+Every value starts with a one byte tag. Lengths and counts are unsigned
+32-bit and numbers are 64-bit, all big-endian:
+
+ - C{N} None, C{T} True, C{F} False
+ - C{i} int or long that fits in 64 bits
+ - C{l} any other long, as a length prefixed decimal string
+ - C{d} float
+ - C{s} str, as a length prefixed byte string
+ - C{u} unicode, as a length prefixed UTF-8 string
+ - C{[} list or tuple, item count followed by the items
+ - C{{} dict, item count followed by alternating keys and values
+
+Sequences always decode as lists, like they do with XML-RPC.
+"""
+
+import struct
+
+MAX_DEPTH = 100
+
+_int64 = struct.Struct('>q')
+_uint32 = struct.Struct('>I')
+_double = struct.Struct('>d')
+
+
+def dumps(value):
+    out = []
+    _dump(value, out.append, 0)
+    return ''.join(out)
+
+
+def _dump(value, write, depth):
+    if depth > MAX_DEPTH:
+        raise ValueError("value is nested too deeply")
+    if value is None:
+        write('N')
+    elif value is True:
+        write('T')
+    elif value is False:
+        write('F')
+    elif isinstance(value, str):
+        write('s')
+        write(_uint32.pack(len(value)))
+        write(value)
+    elif isinstance(value, (int, long)):
+        try:
+            write('i' + _int64.pack(value))
+        except struct.error:
+            value = str(value)
+            write('l')
+            write(_uint32.pack(len(value)))
+            write(value)
+    elif isinstance(value, (list, tuple)):
+        write('[')
+        write(_uint32.pack(len(value)))
+        for item in value:
+            _dump(item, write, depth + 1)
+    elif isinstance(value, dict):
+        write('{')
+        write(_uint32.pack(len(value)))
+        for key, item in value.iteritems():
+            _dump(key, write, depth + 1)
+            _dump(item, write, depth + 1)
+    elif isinstance(value, unicode):
+        value = value.encode('utf-8')
+        write('u')
+        write(_uint32.pack(len(value)))
+        write(value)
+    elif isinstance(value, float):
+        write('d' + _double.pack(value))
+    else:
+        raise TypeError("cannot marshal %s objects" % type(value))
+
+
+def loads(data):
+    if not isinstance(data, str):
+        raise TypeError("expected a string")
+    try:
+        value, offset = _load(data, 0, 0)
+    except struct.error:
+        raise ValueError("truncated data")
+    if offset != len(data):
+        raise ValueError("extra data after the encoded value")
+    return value
+
+
+def _loadString(data, offset):
+    size, = _uint32.unpack_from(data, offset)
+    offset += 4
+    if offset + size > len(data):
+        raise ValueError("truncated data")
+    return data[offset:offset + size], offset + size
+
+
+def _load(data, offset, depth):
+    if depth > MAX_DEPTH:
+        raise ValueError("value is nested too deeply")
+    tag = data[offset:offset + 1]
+    offset += 1
+    if tag == 's':
+        return _loadString(data, offset)
+    elif tag == 'i':
+        return _int64.unpack_from(data, offset)[0], offset + 8
+    elif tag == '[':
+        count, = _uint32.unpack_from(data, offset)
+        offset += 4
+        if count > len(data) - offset:
+            raise ValueError("truncated data")
+        value = []
+        for i in xrange(count):
+            item, offset = _load(data, offset, depth + 1)
+            value.append(item)
+        return value, offset
+    elif tag == 'N':
+        return None, offset
+    elif tag == 'T':
+        return True, offset
+    elif tag == 'F':
+        return False, offset
+    elif tag == '{':
+        count, = _uint32.unpack_from(data, offset)
+        offset += 4
+        if count > len(data) - offset:
+            raise ValueError("truncated data")
+        value = {}
+        for i in xrange(count):
+            key, offset = _load(data, offset, depth + 1)
+            value[key], offset = _load(data, offset, depth + 1)
+        return value, offset
+    elif tag == 'u':
+        value, offset = _loadString(data, offset)
+        return value.decode('utf-8'), offset
+    elif tag == 'l':
+        value, offset = _loadString(data, offset)
+        if value.startswith('-'):
+            digits = value[1:]
+        else:
+            digits = value
+        if not digits.isdigit():
+            raise ValueError("invalid long")
+        return long(value), offset
+    elif tag == 'd':
+        return _double.unpack_from(data, offset)[0], offset + 8
+    elif not tag:
+        raise ValueError("truncated data")
+    else:
+        raise ValueError("unknown type tag 0x%02x" % ord(tag))
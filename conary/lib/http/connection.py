@@ -22,6 +22,7 @@ import httplib
 import os
 import select
 import socket
+import threading
 import time
 import warnings
 
@@ -39,6 +40,122 @@ except ImportError:
         pass
 
 
+class ConnectionPool(object):
+    """Idle persistent connections, kept per destination.
+
+    Connections are lent out for one request at a time and come back once
+    the response has been read to the end, so every opener sharing a pool
+    reuses the connections (and SSL sessions) of the others. Connections idle
+    for longer than C{idleTimeout} seconds, or which the server has closed in
+    the meantime, are dropped instead of being handed out.
+    """
+
+    idleTimeout = 30
+    maxIdle = 4
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.idle = {}
+        self.pid = os.getpid()
+
+    def _check(self):
+        if self.pid != os.getpid():
+            # Forked; the sockets still belong to the parent. Closing them
+            # could shut down its SSL sessions, so just forget about them.
+            self.idle = {}
+            self.pid = os.getpid()
+
+    def get(self, key):
+        """Return an idle connection for C{key}, or C{None}."""
+        self.lock.acquire()
+        try:
+            self._check()
+            conns = self.idle.get(key)
+            now = time.time()
+            while conns:
+                conn, lastUsed = conns.pop()
+                if now - lastUsed < self.idleTimeout and _isIdle(conn.sock):
+                    return conn
+                conn.close()
+            return None
+        finally:
+            self.lock.release()
+
+    def put(self, key, conn):
+        """Keep C{conn} for the next request to C{key}."""
+        self.lock.acquire()
+        try:
+            self._check()
+            conns = self.idle.setdefault(key, [])
+            if len(conns) < self.maxIdle:
+                conns.append((conn, time.time()))
+                conn = None
+        finally:
+            self.lock.release()
+        if conn is not None:
+            conn.close()
+
+    def close(self):
+        """Close all idle connections."""
+        self.lock.acquire()
+        try:
+            self._check()
+            idle, self.idle = self.idle, {}
+        finally:
+            self.lock.release()
+        for conns in idle.values():
+            for conn, lastUsed in conns:
+                conn.close()
+
+
+def _isIdle(sock):
+    """Return True if nothing arrived on an idle socket, which would mean
+    the server closed it (or is talking out of turn)."""
+    if sock is None:
+        return False
+    try:
+        return not select.select([sock], [], [], 0)[0]
+    except (select.error, socket.error):
+        return False
+
+
+# Pool shared by all persistent openers in the process
+defaultPool = ConnectionPool()
+
+
+class PooledResponse(httplib.HTTPResponse):
+    """Response which hands its connection back to a L{ConnectionPool}.
+
+    The connection is only reused when the body was read to the end. A
+    response closed before that takes the connection down with it, as the
+    rest of the body would otherwise be mistaken for the next response.
+    """
+
+    pool = key = conn = None
+    _inRead = False
+
+    def read(self, amt=None):
+        self._inRead = True
+        try:
+            return httplib.HTTPResponse.read(self, amt)
+        finally:
+            self._inRead = False
+
+    def close(self):
+        wasOpen = self.fp is not None
+        httplib.HTTPResponse.close(self)
+        conn, self.conn = self.conn, None
+        if conn is None or not wasOpen:
+            return
+        # httplib closes the response itself once it reaches the end of the
+        # body, but also after a short read
+        complete = self._inRead and (self.chunked or self.length == 0)
+        if complete and not self.will_close:
+            self.pool.put(self.key, conn)
+        else:
+            conn.close()
+
+
 class Connection(object):
     """Connection to a single endpoint, possibly encrypted and/or proxied
     and/or tunneled.
@@ -51,7 +168,8 @@ class Connection(object):
     userAgent = "conary-http-client/%s" % constants.version
     connectTimeout = 30
 
-    def __init__(self, endpoint, proxy=None, caCerts=None, commonName=None):
+    def __init__(self, endpoint, proxy=None, caCerts=None, commonName=None,
+            pool=None):
         """
         @param endpoint: Destination URL (host, port, optional SSL, optional
             authorization)
@@ -61,6 +179,8 @@ class Connection(object):
             against.
         @param commonName: Optional hostname to use for checking server
             certificates.
+        @param pool: Optional L{ConnectionPool} to take kept-alive
+            connections from and return them to.
         """
         # endpoint and proxy must be URL objects, not names.
         self.endpoint = endpoint
@@ -75,6 +195,7 @@ class Connection(object):
         self.commonName = commonName
         self.doSSL = endpoint.scheme == 'https'
         self.doTunnel = bool(proxy) and self.doSSL
+        self.pool = pool
         # Cached HTTPConnection object
         self.cached = None
 
@@ -84,6 +205,8 @@ class Connection(object):
             self.cached = None
 
     def request(self, req):
+        if self.pool is not None:
+            return self._requestPooled(req)
         if self.cached:
             # Try once to use the cached connection; if it fails to send the
             # request then discard and try again.
@@ -110,6 +233,52 @@ class Connection(object):
             self.cached = conn
         return ret
 
+    def getPoolKey(self):
+        # Everything that went into setting up the socket
+        return (self.endpoint.scheme, self.endpoint.hostport, self.proxy,
+                self.doSSL, self.doTunnel, self.commonName,
+                tuple(self.caCerts or ()))
+
+    def _requestPooled(self, req):
+        key = self.getPoolKey()
+        while True:
+            conn = self.pool.get(key)
+            if conn is None:
+                break
+            try:
+                response = self.requestOnce(conn, req)
+            except http_error.RequestError, err:
+                err.wrapped.clear()
+            except httplib.BadStatusLine:
+                pass
+            except socket.error, err:
+                if err.args[0] not in (errno.ECONNRESET, errno.EPIPE):
+                    raise
+            else:
+                return self._keepResponse(response, conn, key)
+            # The server dropped the kept-alive connection before answering,
+            # so the request can safely be sent again on another one.
+            conn.close()
+            req.reset()
+
+        try:
+            conn = self.openConnection()
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            wrapped = util.SavedException()
+            raise http_error.RequestError(wrapped)
+        conn.response_class = PooledResponse
+        response = self.requestOnce(conn, req)
+        return self._keepResponse(response, conn, key)
+
+    def _keepResponse(self, response, conn, key):
+        if not response.will_close:
+            response.pool = self.pool
+            response.key = key
+            response.conn = conn
+        return response
+
     def openConnection(self):
         sock = self.connectSocket()
         sock = self.startTunnel(sock)
@@ -130,6 +299,9 @@ class Connection(object):
         sock = socket.socket(host.family, socket.SOCK_STREAM)
         sock.settimeout(self.connectTimeout)
         sock.connect((str(host), port))
+        # Requests are written as headers followed by the body; don't let
+        # the body wait for the ACK of the headers on a reused connection.
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         return sock
 
     def startTunnel(self, sock):
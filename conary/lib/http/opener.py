@@ -43,7 +43,7 @@ class URLOpener(object):
     redirectAttempts = 5
 
     def __init__(self, proxyMap=None, caCerts=None, persist=False,
-            connectAttempts=None, followRedirects=False):
+            connectAttempts=None, followRedirects=False, connectionPool=None):
         if proxyMap is None:
             proxyMap = proxy_map.ProxyMap()
         self.proxyMap = proxyMap
@@ -52,8 +52,12 @@ class URLOpener(object):
         if connectAttempts:
             self.connectAttempts = connectAttempts
         self.followRedirects = followRedirects
+        # Persistent openers keep their connections alive in a pool, shared
+        # process-wide unless one is given.
+        if persist and connectionPool is None:
+            connectionPool = conn_mod.defaultPool
+        self.connectionPool = connectionPool
 
-        self.connectionCache = {}
         self.lastProxy = None
 
     def newRequest(self, url, data=None, method=None, headers=()):
@@ -103,7 +107,8 @@ class URLOpener(object):
 
         for x in range(self.redirectAttempts):
             response = self._doRequest(req, forceProxy=forceProxy)
-            if response.status == 200:
+            if response.status == 200 or (response.status == 206
+                    and 'Range' in req.headers):
                 return self._handleResponse(req, response)
             elif self.followRedirects and response.status in (
                     301, 302, 303, 307):
@@ -268,14 +273,11 @@ class URLOpener(object):
 
     def _requestOnce(self, req, proxy):
         """Issue a request to a a single destination."""
-        key = (req.url.scheme, req.url.hostport, proxy)
-        conn = self.connectionCache.get(key)
-        if conn is None:
+        if self.connectionPool is not None:
+            conn = self.connectionFactory(req.url, proxy, self.caCerts,
+                    pool=self.connectionPool)
+        else:
             conn = self.connectionFactory(req.url, proxy, self.caCerts)
-            if self.persist:
-                self.connectionCache[key] = conn
-
-        if not self.persist:
             req.headers.setdefault('Connection', 'close')
 
         response = conn.request(req)
@@ -311,9 +313,9 @@ class URLOpener(object):
             error.strerror = msgError
 
     def close(self):
-        for conn in self.connectionCache.values():
-            conn.close()
-        self.connectionCache.clear()
+        # Idle connections belong to the pool, which may be shared with other
+        # openers, so they are left for it to expire.
+        pass
 
 
 class ResponseWrapper(object):
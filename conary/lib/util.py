@@ -18,6 +18,7 @@
 import base64
 import bdb
 import bz2
+import ctypes
 import debugger
 import errno
 import fnmatch
@@ -44,8 +45,10 @@ import zlib
 
 from conary.lib import fixedglob, log, api, urlparse
 from conary.lib import networking
+from conary.lib.ext import ctypes_utils
 from conary.lib.ext import digest_uncompress
 from conary.lib.ext import file_utils
+from conary.lib.ext import rpc_codec
 from conary.lib.ext import system
 
 # Imported for the benefit of older code,
@@ -1782,6 +1785,35 @@ def xmlrpcLoad(stream):
     return u.close(), u.getmethodname()
 
 
+# Content type of RPC requests and responses using the binary encoding
+BINRPC_CONTENT_TYPE = 'application/x-conary-rpc'
+
+def binrpcDump(params, methodname=None):
+    """
+    Binary counterpart of L{xmlrpcDump}. Unlike XML-RPC, byte strings are
+    sent as they are, so they do not need to be base64 encoded first.
+    Faults are not supported.
+    """
+    assert isinstance(params, tuple), "argument must be a tuple"
+    return rpc_codec.dumps((methodname, params))
+
+def binrpcLoad(stream):
+    """
+    Binary counterpart of L{xmlrpcLoad}. Returns a tuple of the parameters
+    and the method name, which is C{None} for responses.
+
+    @raise ValueError: the data is not a valid binary RPC message
+    """
+    if hasattr(stream, "read"):
+        stream = stream.read()
+    message = rpc_codec.loads(stream)
+    if (not isinstance(message, list) or len(message) != 2
+            or not isinstance(message[1], list)):
+        raise ValueError("invalid binary RPC message")
+    methodname, params = message
+    return tuple(params), methodname
+
+
 class ServerProxyMethod(object):
 
     def __init__(self, send, name):
@@ -1811,8 +1843,12 @@ class ServerProxy(object):
         self._encoding = encoding
         self._allow_none = allow_none
 
-    def _request(self, methodname, params):
+    def _request(self, methodname, params, binary=False):
         # Call a method on the remote server
+        if binary:
+            request = binrpcDump(params, methodname)
+            return self._transport.request(self._url, request,
+                    contentType=BINRPC_CONTENT_TYPE)
         request = xmlrpcDump(params, methodname,
             encoding = self._encoding, allow_none=self._allow_none)
 
@@ -2517,6 +2553,92 @@ def iterFileChunks(fobj):
         yield data
 
 
+_sendfile = None
+
+def sendfile(outFd, inFd, offset, count):
+    """
+    Copy up to C{count} bytes at C{offset} in C{inFd} to C{outFd} inside the
+    kernel. Returns the number of bytes copied, which may be short.
+    """
+    global _sendfile
+    if _sendfile is None:
+        libc = ctypes_utils.get_libc()
+        func = getattr(libc, 'sendfile64', None) or libc.sendfile
+        func.argtypes = (ctypes.c_int, ctypes.c_int,
+                ctypes.POINTER(ctypes.c_int64), ctypes.c_size_t)
+        func.restype = ctypes.c_ssize_t
+        _sendfile = func
+
+    while True:
+        rc = _sendfile(outFd, inFd, ctypes.byref(ctypes.c_int64(offset)),
+                count)
+        if rc >= 0:
+            return rc
+        err = ctypes.get_errno()
+        if err != errno.EINTR:
+            raise OSError(err, os.strerror(err))
+
+
+class FileRange(object):
+    """
+    A range of bytes in an open file. Producers which can be sent with
+    L{sendfile} yield these in place of the data itself; the descriptor is
+    only guaranteed to stay open until the next item is requested.
+    """
+
+    __slots__ = [ 'fd', 'offset', 'size' ]
+
+    def __init__(self, fd, offset, size):
+        self.fd = fd
+        self.offset = offset
+        self.size = size
+
+    def __repr__(self):
+        return 'FileRange(%r, %r, %r)' % (self.fd, self.offset, self.size)
+
+    @classmethod
+    def fromFile(cls, fobj, size):
+        """
+        Return the first C{size} bytes of the unread file C{fobj}, or None
+        if C{fobj} is not backed by a file descriptor.
+        """
+        if hasattr(fobj, '_fdInfo'):
+            fd, start = fobj._fdInfo()[:2]
+            if fd is None:
+                return None
+        elif hasattr(fobj, 'fileno'):
+            fd, start = fobj.fileno(), fobj.tell()
+        else:
+            return None
+        return cls(fd, start, size)
+
+    def skip(self, count):
+        """Return this range without its first C{count} bytes."""
+        return FileRange(self.fd, self.offset + count, self.size - count)
+
+    def iterChunks(self, chunkSize = 65536):
+        """Yield the contents of the range."""
+        offset, end = self.offset, self.offset + self.size
+        while offset < end:
+            data = file_utils.pread(self.fd, min(chunkSize, end - offset),
+                    offset)
+            if not data:
+                raise IOError(errno.EIO,
+                        "file is shorter than the requested range")
+            offset += len(data)
+            yield data
+
+    def sendTo(self, outFd):
+        """Copy the range to C{outFd} with L{sendfile}."""
+        offset, end = self.offset, self.offset + self.size
+        while offset < end:
+            sent = sendfile(outFd, self.fd, offset, end - offset)
+            if not sent:
+                raise IOError(errno.EIO,
+                        "file is shorter than the requested range")
+            offset += sent
+
+
 class cachedProperty(object):
     """A decorator that creates a memoized property. The first time the
     property is accessed, the decorated function is called and the return value
@@ -0,0 +1,177 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Bounded pool of worker threads for running independent, I/O bound tasks
+concurrently.
+"""
+
+import Queue
+import sys
+import threading
+
+
+class Result(object):
+    """
+    Handle for a task submitted to a L{WorkerPool}.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._value = None
+        self._excInfo = None
+
+    def _set(self, value, excInfo):
+        self._value = value
+        self._excInfo = excInfo
+        self._event.set()
+
+    def ready(self):
+        return self._event.isSet()
+
+    def wait(self):
+        # wait with a timeout so KeyboardInterrupt is delivered
+        while not self._event.isSet():
+            self._event.wait(1)
+
+    def get(self):
+        """
+        Wait for the task to finish and return its result. If the task
+        raised an exception it is re-raised here with its original
+        traceback.
+        """
+        self.wait()
+        if self._excInfo is not None:
+            raise self._excInfo[0], self._excInfo[1], self._excInfo[2]
+        return self._value
+
+
+class WorkerPool(object):
+    """
+    Run callables on at most C{maxWorkers} threads. Threads are started on
+    demand and exit once L{close} is called and the queue drains.
+    """
+
+    def __init__(self, maxWorkers, name = 'worker'):
+        self.maxWorkers = max(1, maxWorkers)
+        self.name = name
+        self._queue = Queue.Queue()
+        self._threads = []
+        self._idle = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def submit(self, func, *args, **kwargs):
+        if self._closed:
+            raise RuntimeError('worker pool is closed')
+        result = Result()
+        self._lock.acquire()
+        try:
+            self._queue.put((result, func, args, kwargs))
+            if (self._queue.qsize() > self._idle
+                    and len(self._threads) < self.maxWorkers):
+                thread = threading.Thread(target = self._run,
+                        name = '%s-%d' % (self.name, len(self._threads)))
+                thread.setDaemon(True)
+                self._threads.append(thread)
+                thread.start()
+        finally:
+            self._lock.release()
+        return result
+
+    def _run(self):
+        while True:
+            self._setIdle(1)
+            item = self._queue.get()
+            self._setIdle(-1)
+            if item is None:
+                return
+            result, func, args, kwargs = item
+            try:
+                value = func(*args, **kwargs)
+            except:
+                result._set(None, sys.exc_info())
+            else:
+                result._set(value, None)
+            del item, result, func, args, kwargs
+
+    def _setIdle(self, delta):
+        self._lock.acquire()
+        self._idle += delta
+        self._lock.release()
+
+    def close(self):
+        """Stop accepting work and wait for the workers to exit."""
+        if self._closed:
+            return
+        self._closed = True
+        for thread in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def parallelMap(func, items, maxWorkers, name = 'worker'):
+    """
+    Return C{[ func(x) for x in items ]}, evaluating up to C{maxWorkers}
+    items at a time. Results are returned in the order of C{items}; if any
+    call fails, the exception from the earliest failing item is raised after
+    all calls have finished.
+    """
+    items = list(items)
+    if maxWorkers <= 1 or len(items) <= 1:
+        return [ func(x) for x in items ]
+
+    pool = WorkerPool(min(maxWorkers, len(items)), name = name)
+    try:
+        results = [ pool.submit(func, x) for x in items ]
+        for result in results:
+            result.wait()
+        return [ x.get() for x in results ]
+    finally:
+        pool.close()
+
+
+class SerializedProxy(object):
+    """
+    Wrap an object so that calls to its methods from several threads are
+    made one at a time.
+    """
+
+    def __init__(self, obj, lock = None):
+        self._obj = obj
+        if lock is None:
+            lock = threading.RLock()
+        self._lock = lock
+
+    def __getattr__(self, name):
+        attr = getattr(self._obj, name)
+        if not callable(attr):
+            return attr
+        lock = self._lock
+        def wrapper(*args, **kwargs):
+            lock.acquire()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                lock.release()
+        return wrapper
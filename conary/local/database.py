@@ -1246,7 +1246,7 @@ class UpdateJob:
 class DepCheckState:
 
     def __init__(self, db, troveSource, findOrdering = True,
-                 ignoreDepClasses = []):
+                 ignoreDepClasses = [], inMemory = False):
         """
         @param troveSource: Trove source troves in the job are
                             available from
@@ -1258,6 +1258,9 @@ class DepCheckState:
         @param ignoreDepClasses: List of dependency classes which should
         not be enforced.
         @type ignoreDepClasses: list of deps.Depenendency
+        @param inMemory: If true, dependencies of the job are checked
+        in memory rather than through temporary database tables.
+        @type inMemory: boolean
         """
 
         self.setTroveSource(troveSource)
@@ -1266,6 +1269,7 @@ class DepCheckState:
         self.jobSet = set()
         self.checker = None
         self.findOrdering = findOrdering
+        self.inMemory = inMemory
 
     def setTroveSource(self, troveSource):
         self.troveSource = troveSource
@@ -1283,7 +1287,8 @@ class DepCheckState:
         if self.checker is None:
             self.checker = self.db.dependencyChecker(self.troveSource,
                                     findOrdering = self.findOrdering,
-                                    ignoreDepClasses = self.ignoreDepClasses)
+                                    ignoreDepClasses = self.ignoreDepClasses,
+                                    inMemory = self.inMemory)
 
     def setJobs(self, newJobSet):
         newJobSet = set(newJobSet)
@@ -1671,6 +1676,8 @@ class Database(SqlDbRepository):
     # FilesystemRepository has the same problem
 
     ROLLBACK_PHASE_LOCAL = update.ROLLBACK_PHASE_LOCAL
+    # number of threads FilesystemJob.apply writes file contents with
+    restoreThreads = 1
 
     def iterFilesInTrove(self, troveName, version, flavor,
                          sortByPath = False, withFiles = False,
@@ -1733,7 +1740,7 @@ class Database(SqlDbRepository):
         return resultDict
 
     def getDepStateClass(self, troveSource, findOrdering = True,
-                         ignoreDepClasses = set() ):
+                         ignoreDepClasses = set(), inMemory = False):
         """
         Return dependency state class which can be used for dependency checks
         against this repository. For parameter list and return
@@ -1743,7 +1750,8 @@ class Database(SqlDbRepository):
         # in
         return DepCheckState(self.db, troveSource,
                              findOrdering = findOrdering,
-                             ignoreDepClasses = set(ignoreDepClasses))
+                             ignoreDepClasses = set(ignoreDepClasses),
+                             inMemory = inMemory)
 
     def getFileContents(self, l):
         # look for config files in the datastore first, then look for other
@@ -1920,7 +1928,8 @@ class Database(SqlDbRepository):
         fsJob.apply(journal, opJournal = opJournal,
                     justDatabase = commitFlags.justDatabase,
                     noScripts = commitFlags.noScripts,
-                    capsuleChangeSet = capsuleChangeSet)
+                    capsuleChangeSet = capsuleChangeSet,
+                    restoreThreads = self.restoreThreads)
 
         if (updateDatabase and not localChanges):
             for (name, version, flavor) in fsJob.getOldTroveList():
@@ -2984,6 +2993,10 @@ class Database(SqlDbRepository):
     def capsuleDb(self):
         return capsulesmod.MetaCapsuleDatabase(self)
 
+    @util.cachedProperty
+    def flavorScoreCache(self):
+        return trove.FlavorScoreCache(self.flavorScorePath)
+
     def __init__(self, root, path, modelPath=None, timeout=None, modelFile=None):
         """
         Instantiate a database object
@@ -3016,6 +3029,7 @@ class Database(SqlDbRepository):
             self.opJournalPath = None
             self.modelFile = None
             self.rollbackStack = None
+            self.flavorScorePath = None
         else:
             conarydbPath = util.joinPaths(root, path)
             SqlDbRepository.__init__(self, conarydbPath, timeout = timeout)
@@ -3026,6 +3040,7 @@ class Database(SqlDbRepository):
             self.lockFile = top + "/syslock"
             self.rollbackCache = top + "/rollbacks"
             self.rollbackStatus = self.rollbackCache + "/status"
+            self.flavorScorePath = top + "/flavorscores"
             try:
                 self.rollbackStack = RollbackStack(self.rollbackCache, root,
                                                    self.modelPath,
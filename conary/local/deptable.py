@@ -15,6 +15,8 @@
 #
 
 
+import itertools
+
 from conary import dbstore, trove, versions
 from conary.deps import deps
 from conary.lib import graph
@@ -1082,11 +1084,14 @@ class DependencyChecker:
         self.workTables.merge()
         self.workTables.mergeRemoves()
 
-    def _check(self, linkedJobs = None,
-              criticalJobs = None, finalJobs = None, createGraph = False):
-        # we can't create the graph if we're not finding the ordering
-        assert(not createGraph or self.findOrdering)
-
+    def _resolve(self):
+        """
+        Returns a row for each (requirement, provider) pair for the
+        requirements which have not been satisfied yet. Rows are
+        (depId, depNum, reqInstanceId, reqNodeId, provInstanceId,
+        provNodeId, reqDepNum) tuples, where the node ids are those of the
+        jobs removing the requiring and providing troves (or None).
+        """
         # dependencies which could have been resolved by something in
         # RemovedIds, but instead weren't resolved at all are considered
         # "unresolvable" dependencies. (they could be resolved by something
@@ -1108,7 +1113,22 @@ class DependencyChecker:
 
         # it's a shame we instantiate this, but merging _gatherResoltion
         # and _createDepGraph doesn't seem like any fun
-        sqlResult = self.cu.fetchall()
+        return self.cu.fetchall()
+
+    def _markSatisfied(self, depNums):
+        # depNums of None marks every outstanding requirement as satisfied
+        if depNums is None:
+            self.cu.execute("update tmprequires set satisfied=1")
+        else:
+            self.cu.execute("update tmprequires set satisfied=1 where "
+                        "depNum in (%s)" % ",".join(["%d" % x for x in depNums]))
+
+    def _check(self, linkedJobs = None,
+              criticalJobs = None, finalJobs = None, createGraph = False):
+        # we can't create the graph if we're not finding the ordering
+        assert(not createGraph or self.findOrdering)
+
+        sqlResult = self._resolve()
 
         # None in depList means the dependency got resolved; we track
         # would have been resolved by something which has been removed as
@@ -1136,7 +1156,7 @@ class DependencyChecker:
         if not unsatisfiedList and not unresolveableList:
             # Everything was satisfied. No reason to be careful about updating
             # the satisfied list.
-            self.cu.execute("update tmprequires set satisfied=1")
+            self._markSatisfied(None)
         else:
             for (depId, depNum, reqInstanceId,
                  reqNodeIdx, provInstId, provNodeIdx, reqDepNum) in sqlResult:
@@ -1147,8 +1167,7 @@ class DependencyChecker:
                     continue
                 l.add(reqDepNum)
 
-            self.cu.execute("update tmprequires set satisfied=1 where "
-                        "depNum in (%s)" % ",".join(["%d" % x for x in l]))
+            self._markSatisfied(l)
 
         if createGraph or self.findOrdering:
             # During the dependency resolution process this method is invoked
@@ -1219,6 +1238,213 @@ class DependencyChecker:
         self.cu.execute("BEGIN")
         self.inTransaction = True
 
+class MemoryDependencyChecker(DependencyChecker):
+
+    """
+    Dependency checker which keeps the requirements and provides of the
+    job in memory instead of merging them into temporary tables. The
+    provides of installed troves are read from the database the first time
+    a requirement with that name is seen, and the requirements broken by
+    removing troves are read when those removals are added. Each call to
+    addJobs() only adds the new jobs to the index, and each check only
+    looks at the requirements which have not been satisfied yet.
+
+    The results are the same as those of L{DependencyChecker}.
+    """
+
+    # how many names to look up in one query
+    QUERY_BATCH = 500
+
+    def __init__(self, db, troveSource, findOrdering = True,
+                 ignoreDepClasses = set()):
+        DependencyChecker.__init__(self, db, troveSource,
+                                   findOrdering = findOrdering,
+                                   ignoreDepClasses = ignoreDepClasses)
+        self.ignoreTags = set(x.tag for x in self.ignoreDepClasses)
+        # providers are indexed by (classId, name); the data is the
+        # instanceId for installed troves and -nodeId for new troves
+        self.provides = deps.CompactDependencyMatcher()
+        self.loadedNames = set()
+        # instanceId -> nodeId for installed troves being removed
+        self.removedIds = {}
+        self.removedInfoToId = {}
+        # (instanceId, depNum) -> (depCount, classId, name, flags) for
+        # installed requirements provided by removed troves
+        self.oldRequires = {}
+        # requirements to check, as (depNum, reqInstanceId, classId, name,
+        # flags, depId) tuples
+        self.pending = []
+
+    def _addRequirement(self, depNum, instanceId, classId, name, flags):
+        flags = tuple(sorted(flags))
+        self.pending.append((depNum, instanceId, classId, name, flags,
+                             (classId, name, flags)))
+
+    def _getInstanceId(self, (name, version, flavor)):
+        args = [ name, version.asString() ]
+        if flavor is None or flavor.isEmpty():
+            flavorCheck = "Flavors.flavor is NULL"
+        else:
+            flavorCheck = "Flavors.flavor = ?"
+            args.append(flavor.freeze())
+
+        self.cu.execute("""
+            SELECT instanceId FROM Instances
+                JOIN Versions USING (versionId)
+                JOIN Flavors ON Instances.flavorId = Flavors.flavorId
+                WHERE
+                    Instances.troveName = ? AND
+                    Versions.version = ? AND
+                    %s
+        """ % flavorCheck, args)
+
+        l = self.cu.fetchall()
+        if not l:
+            return None
+        return l[0][0]
+
+    def _removeTroves(self, removedList):
+        newIds = []
+        for info, nodeId in removedList:
+            instanceId = self._getInstanceId(info)
+            if instanceId is None:
+                continue
+            self.removedIds[instanceId] = nodeId
+            self.removedInfoToId[info] = instanceId
+            newIds.append(instanceId)
+
+        # anything installed which requires something provided by a trove
+        # being removed needs to be checked again
+        for i in range(0, len(newIds), self.QUERY_BATCH):
+            idList = newIds[i:i + self.QUERY_BATCH]
+            self.cu.execute("""
+            SELECT DISTINCT
+                Requires.instanceId, Requires.depNum, Requires.depCount,
+                Dependencies.class, Dependencies.name, Dependencies.flag
+            FROM Provides
+            JOIN Requires ON Provides.depId = Requires.depId
+            JOIN Dependencies ON Dependencies.depId = Requires.depId
+            WHERE Provides.instanceId IN (%s)
+            """ % ",".join("%d" % x for x in idList))
+
+            for (instanceId, depNum, depCount, classId, name,
+                            flag) in self.cu:
+                if classId in self.ignoreTags:
+                    continue
+                key = (instanceId, depNum)
+                req = self.oldRequires.get(key)
+                if req is None:
+                    req = self.oldRequires[key] = (depCount, classId, name,
+                                                   set())
+                elif len(req[3]) == req[0]:
+                    # already complete (and queued for checking)
+                    continue
+                req[3].add(flag)
+                if len(req[3]) == depCount:
+                    # only requirements whose every flag is provided by
+                    # troves being removed can be broken by the removal
+                    flags = [ x for x in req[3] if x != NO_FLAG_MAGIC ]
+                    self._addRequirement(depNum, instanceId, classId, name,
+                                         flags)
+
+    def _loadProvides(self, names):
+        byClass = {}
+        for classId, name in names:
+            if (classId, name) in self.loadedNames:
+                continue
+            self.loadedNames.add((classId, name))
+            byClass.setdefault(classId, []).append(name)
+
+        for classId, nameList in sorted(byClass.iteritems()):
+            for i in range(0, len(nameList), self.QUERY_BATCH):
+                batch = nameList[i:i + self.QUERY_BATCH]
+                self.cu.execute("""
+                SELECT Provides.instanceId, Dependencies.name,
+                       Dependencies.flag
+                FROM Dependencies
+                JOIN Provides ON Dependencies.depId = Provides.depId
+                WHERE Dependencies.class = ? AND
+                      Dependencies.name IN (%s)
+                """ % ",".join("?" * len(batch)), [ classId ] + batch)
+
+                found = {}
+                for instanceId, name, flag in self.cu:
+                    flags = found.setdefault((instanceId, name), [])
+                    if flag != NO_FLAG_MAGIC:
+                        flags.append(flag)
+
+                for (instanceId, name), flags in found.iteritems():
+                    self.provides.addRaw(classId, name, flags, instanceId)
+
+    def restoreTrove(self, troveTup):
+        nodeId = self.oldInfoToNodeId[troveTup]
+        del self.oldInfoToNodeId[troveTup]
+        self.nodes[nodeId] = None
+        self.g.delete(nodeId)
+        instanceId = self.removedInfoToId.pop(troveTup, None)
+        if instanceId is not None:
+            del self.removedIds[instanceId]
+
+    def addJobs(self, jobSet):
+        allDeps = self.troveSource.getDepsForTroveList(
+                [ (job[0], job[2][0], job[2][1]) for job in jobSet
+                        if job[2][0] is not None ] )
+
+        removedList = []
+        for job in jobSet:
+            if job[2][0] is None:
+                nodeId = self._addJob(job)
+                removedList.append(((job[0], job[1][0], job[1][1]), nodeId))
+                continue
+
+            (provides, requires) = allDeps.pop(0)
+
+            newNodeId = self._addJob(job)
+            newRequires = self._findNewDependencies(newNodeId, requires,
+                                                    self.requiresToNodeId)
+            for depClassId, depName, depFlags in provides.iterRawDeps():
+                self.provides.addRaw(depClassId, depName, depFlags,
+                                     -newNodeId)
+
+            # depNums for new requirements are negative indexes into
+            # depList, just like the ones in the sql tables
+            for depClass, dep in newRequires.iterDeps(sort = True):
+                depNum = -len(self.depList)
+                self.depList.append((-newNodeId, depClass.tag, dep))
+                self._addRequirement(depNum, -newNodeId, depClass.tag,
+                                     dep.name, dep.flags.keys())
+
+            del provides, requires
+
+            if job[1][0] is not None:
+                removedList.append(((job[0], job[1][0], job[1][1]),
+                                    newNodeId))
+
+        self.jobSet.update(jobSet)
+        self._removeTroves(removedList)
+
+    def _resolve(self):
+        self._loadProvides(set((x[2], x[3]) for x in self.pending))
+
+        result = []
+        getNode = self.removedIds.get
+        findRaw = self.provides.findRaw
+        for (depNum, reqInstId, classId, name, flags,
+                depId) in self.pending:
+            reqNodeIdx = getNode(reqInstId)
+            for provInstId in set(findRaw(classId, name, flags)):
+                result.append((depId, depNum, reqInstId, reqNodeIdx,
+                               provInstId, getNode(provInstId), depNum))
+
+        return result
+
+    def _markSatisfied(self, depNums):
+        if depNums is None:
+            self.pending = []
+        else:
+            self.pending = [ x for x in self.pending if x[0] not in depNums ]
+
+
 class BulkDependencyLoader:
 
     def __init__(self, db, cu):
@@ -1239,6 +1465,32 @@ class BulkDependencyLoader:
         self.workTables.merge(intoDatabase = True)
 
 class DependencyTables:
+    @staticmethod
+    def _buildDepSet(rows):
+        # rows are (class, name, flag) tuples sorted by class and name;
+        # returns None if there are no rows
+        last = None
+        flags = []
+        depSet = deps.DependencySet()
+        for (classId, name, flag) in rows:
+            if (classId, name) == last:
+                if flag != NO_FLAG_MAGIC:
+                    flags.append((flag, deps.FLAG_SENSE_REQUIRED))
+            else:
+                if last:
+                    depSet.addDep(deps.dependencyClasses[last[0]],
+                                  deps.Dependency(last[1], flags))
+                last = (classId, name)
+                flags = []
+                if flag != NO_FLAG_MAGIC:
+                    flags.append((flag, deps.FLAG_SENSE_REQUIRED))
+
+        if not last:
+            return None
+        depSet.addDep(deps.dependencyClasses[last[0]],
+                      deps.Dependency(last[1], flags))
+        return depSet
+
     def get(self, cu, trv, troveId):
         for (tblName, setFn) in (('Requires', trv.setRequires),
                                  ('Provides', trv.setProvides)):
@@ -1246,27 +1498,34 @@ class DependencyTables:
                        "Dependencies WHERE instanceId=? ORDER BY class, name"
                     % tblName, troveId)
 
-            last = None
-            flags = []
-            depSet = deps.DependencySet()
-            for (classId, name, flag) in cu:
-                if (classId, name) == last:
-                    if flag != NO_FLAG_MAGIC:
-                        flags.append((flag, deps.FLAG_SENSE_REQUIRED))
-                else:
-                    if last:
-                        depSet.addDep(deps.dependencyClasses[last[0]],
-                                      deps.Dependency(last[1], flags))
-                    last = (classId, name)
-                    flags = []
-                    if flag != NO_FLAG_MAGIC:
-                        flags.append((flag, deps.FLAG_SENSE_REQUIRED))
-
-            if last:
-                depSet.addDep(deps.dependencyClasses[last[0]],
-                              deps.Dependency(last[1], flags))
+            depSet = self._buildDepSet(cu)
+            if depSet is not None:
                 setFn(depSet)
 
+    def getBulk(self, cu, idTable, troveList):
+        """
+        Sets the requires and provides of many troves with one query per
+        table. C{idTable} is a table with (idx, instanceId) columns, where
+        idx is the index of the trove in C{troveList}.
+        """
+        for (tblName, setFn) in (('Requires', trove.Trove.setRequires),
+                                 ('Provides', trove.Trove.setProvides)):
+            cu.execute("""
+            SELECT %(idTable)s.idx, Dependencies.class, Dependencies.name,
+                   Dependencies.flag
+            FROM %(idTable)s
+            JOIN %(tblName)s USING (instanceId)
+            JOIN Dependencies ON %(tblName)s.depId = Dependencies.depId
+            ORDER BY %(idTable)s.idx, Dependencies.class, Dependencies.name
+            """ % dict(idTable = idTable, tblName = tblName))
+
+            for idx, rows in itertools.groupby(cu, lambda x: x[0]):
+                trv = troveList[idx]
+                if trv is None:
+                    continue
+                depSet = self._buildDepSet(x[1:] for x in rows)
+                setFn(trv, depSet)
+
     def add(self, cu, trove, troveId):
         self._add(cu, troveId, trove.getProvides(), trove.getRequires())
 
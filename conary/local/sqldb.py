@@ -1373,13 +1373,13 @@ order by
             results[idx].addTrove(name, version, flavor, byDefault = byDefault,
                                   weakRef = weakRef)
 
-        for idx, instanceId in enumerate(instanceIds):
-            trv = results[idx]
-
-            if withDeps:
-                self.depTables.get(cu, trv, instanceId)
-            self.troveInfoTable.getInfo(cu, trv, instanceId)
-            if not withFiles:
+        # load the dependencies and trove info for all of the troves at
+        # once rather than querying for each instance
+        if withDeps:
+            self.depTables.getBulk(cu, 'getTrovesTbl', results)
+        self.troveInfoTable.getInfoBulk(cu, 'getTrovesTbl', results)
+        if not withFiles:
+            for trv in results:
                 yield trv
 
         if not pristine or withFiles:
@@ -1511,10 +1511,14 @@ order by
         self.flavorsNeeded = {}
 
     def dependencyChecker(self, troveSource, findOrdering = True,
-                          ignoreDepClasses = set()):
-        return deptable.DependencyChecker(self.db, troveSource,
-                                          findOrdering = findOrdering,
-                                          ignoreDepClasses = ignoreDepClasses)
+                          ignoreDepClasses = set(), inMemory = False):
+        if inMemory:
+            checkerClass = deptable.MemoryDependencyChecker
+        else:
+            checkerClass = deptable.DependencyChecker
+        return checkerClass(self.db, troveSource,
+                            findOrdering = findOrdering,
+                            ignoreDepClasses = ignoreDepClasses)
 
     def pathIsOwned(self, path):
         for instanceId in self.troveFiles.iterPath(path):
@@ -15,6 +15,8 @@
 #
 
 
+import itertools
+
 from conary import streams
 from conary.local import schema
 
@@ -35,6 +37,14 @@ class TroveInfoTable:
         schema.createTroveInfo(db)
 
     def addInfo(self, cu, trove, idNum):
+        self.db.bulkload("TroveInfo", self.freezeInfo(cu, trove, idNum),
+                         [ 'instanceId', 'infoType', 'data'] )
+
+    def freezeInfo(self, cu, trove, idNum):
+        """
+        Return the (instanceId, infoType, data) rows which store the trove
+        info of C{trove} under C{idNum}.
+        """
         # c = True if the trove is a component
         n = trove.getName()
         # complete fixup is internal to a single client run; it should never be stored
@@ -57,15 +67,32 @@ class TroveInfoTable:
         if frz:
             newInfo.append((idNum, -1, cu.binary(frz)))
 
-        self.db.bulkload("TroveInfo", newInfo,
-                         [ 'instanceId', 'infoType', 'data'] )
+        return newInfo
 
 
     def getInfo(self, cu, trove, idNum):
         cu.execute("SELECT infoType, data FROM TroveInfo WHERE instanceId=?",
                    idNum)
+        self._thawInfo(cu, trove, cu)
+
+    def getInfoBulk(self, cu, idTable, troveList):
+        """
+        Thaws the trove info of many troves with a single query.
+        C{idTable} is a table with (idx, instanceId) columns, where idx is
+        the index of the trove in C{troveList}.
+        """
+        cu.execute("""
+            SELECT %(idTable)s.idx, infoType, data FROM %(idTable)s
+            JOIN TroveInfo USING (instanceId)
+            ORDER BY %(idTable)s.idx
+        """ % dict(idTable = idTable))
+        for idx, rows in itertools.groupby(cu, lambda x: x[0]):
+            if troveList[idx] is not None:
+                self._thawInfo(cu, troveList[idx], (x[1:] for x in rows))
+
+    def _thawInfo(self, cu, trove, rows):
         unknown = ''
-        for (tag, frz) in cu:
+        for (tag, frz) in rows:
             if tag in trove.troveInfo.streamDict:
                 name = trove.troveInfo.streamDict[tag][2]
                 trove.troveInfo.__getattribute__(name).thaw(cu.frombinary(frz))
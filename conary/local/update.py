@@ -31,7 +31,7 @@ import weakref
 from conary import errors, files, trove, versions
 from conary.build import tags
 from conary.callbacks import UpdateCallback
-from conary.lib import log, patch, sha1helper, util, fixedglob
+from conary.lib import log, patch, sha1helper, util, fixedglob, workerpool
 from conary.local import capsules
 from conary.local.errors import (DatabasePathConflictError,
         DirectoryInWayError, DirectoryToNonDirectoryError,
@@ -83,6 +83,117 @@ class LastRestored(object):
         self.target = None
         self.type = None
 
+class RestorePipeline(object):
+    """
+    Writes the contents of independent files on a pool of worker threads.
+    Files are handed to the workers in batches to keep the hand-off cost
+    small next to the work of writing a file. The operation journal is only
+    touched from the calling thread: the backup is taken when a file is
+    queued and its creation is recorded when the file is reaped, in the
+    order the files were queued.
+    """
+
+    batchSize = 64
+
+    def __init__(self, threads, root, journal, opJournal, isSourceTrove):
+        self.pool = workerpool.WorkerPool(threads, name = 'restore')
+        self.maxPending = 2 * threads
+        self.pending = []
+        self.batch = []
+        self.root = root
+        if journal:
+            journal = workerpool.SerializedProxy(journal)
+        self.journal = journal
+        self.opJournal = opJournal
+        self.isSourceTrove = isSourceTrove
+
+    def restore(self, fileObj, contents, target, msg):
+        self.opJournal.backup(target)
+
+        # uid/gid lookups may chroot, which affects every thread; fill the
+        # caches here so the workers only ever hit them
+        if not self.journal and not self.isSourceTrove:
+            owner = fileObj.inode.owner()
+            group = fileObj.inode.group()
+            if owner:
+                files.userCache.lookupName(self.root, owner)
+            if group:
+                files.groupCache.lookupName(self.root, group)
+
+        if contents is not None and contents.isCompressed():
+            # open lazy changeset files now; the file cache isn't thread safe
+            src = contents.get()
+            if hasattr(src, '_fdInfo'):
+                src._fdInfo()
+
+        self.batch.append((fileObj, contents, target, msg))
+        if len(self.batch) >= self.batchSize:
+            self._submit()
+
+    def _submit(self):
+        if not self.batch:
+            return
+
+        batch = self.batch
+        self.batch = []
+        self.pending.append((self.pool.submit(self._restoreBatch, batch),
+                             batch))
+        if len(self.pending) > self.maxPending:
+            self._reap(len(self.pending) - self.maxPending)
+
+    def _restoreBatch(self, batch):
+        # returns how many files were written and, if one failed, the
+        # exception it failed with; the rest of the batch is skipped
+        for i, (fileObj, contents, target, msg) in enumerate(batch):
+            try:
+                if (fileObj.hasContents and contents and
+                            not fileObj.flags.isConfig()):
+                    fileObj.restore(contents, self.root, target,
+                                    journal = self.journal,
+                                    sha1 = fileObj.contents.sha1())
+                else:
+                    fileObj.restore(contents, self.root, target,
+                                    journal = self.journal,
+                                    nameLookup = (not self.isSourceTrove))
+            except:
+                return i, sys.exc_info()
+
+        return len(batch), None
+
+    def _reap(self, count, ignoreErrors = False):
+        excInfo = None
+        reaped = self.pending[:count]
+        del self.pending[:count]
+        for result, batch in reaped:
+            try:
+                written, error = result.get()
+            except:
+                written, error = 0, sys.exc_info()
+
+            for fileObj, contents, target, msg in batch[:written]:
+                self.opJournal.create(target)
+                log.debug(msg, target)
+
+            if error is not None and excInfo is None:
+                excInfo = error
+
+        if excInfo is not None and not ignoreErrors:
+            raise excInfo[0], excInfo[1], excInfo[2]
+
+    def drain(self):
+        """Wait for every queued file to be written."""
+        self._submit()
+        self._reap(len(self.pending))
+
+    def close(self):
+        # after a failure, files which were written anyway still need their
+        # journal entries so the rollback removes them
+        try:
+            self.batch = []
+            self._reap(len(self.pending), ignoreErrors = True)
+        finally:
+            self.pool.close()
+
 class FilesystemJob:
     """
     Represents a set of actions which need to be applied to the filesystem.
@@ -337,7 +448,7 @@ class FilesystemJob:
         return True
 
     def apply(self, journal = None, opJournal = None, justDatabase = False,
-              noScripts = False, capsuleChangeSet = None):
+              noScripts = False, capsuleChangeSet = None, restoreThreads = 1):
         assert(not self.errors)
         rootLen = len(self.root.rstrip('/'))
 
@@ -424,157 +535,181 @@ class FilesystemJob:
         restoreIndex = 0
         j = 0
         lastRestored = LastRestored()
-        while restoreIndex < len(restores):
-            (pathId, fileId, fileObj, target, override, msg) = \
-                                                restores[restoreIndex]
-            restoreIndex += 1
-            ptrId = pathId + fileId
+        if restoreThreads > 1:
+            # files whose contents nothing later in this loop reads back are
+            # written by the pipeline; it is drained before anything which
+            # could (shared contents, link groups, ptr targets)
+            pipeline = RestorePipeline(restoreThreads, self.root, journal,
+                                       opJournal, self.isSourceTrove)
+        else:
+            pipeline = None
 
-            if isinstance(fileObj, files.Directory):
-                continue
+        try:
+            while restoreIndex < len(restores):
+                (pathId, fileId, fileObj, target, override, msg) = \
+                                                    restores[restoreIndex]
+                restoreIndex += 1
+                ptrId = pathId + fileId
 
-            if not fileObj:
-                # this means we've reached some contents that are the
-                # target of ptr's, but not a ptr itself. look through
-                # the delayedRestore list for someplace to put this file
-                match = None
-                for j, item in enumerate(delayedRestores):
-                    if pathId == item[4] or ptrId == item[4]:
-                        match = j, item
-                        break
+                if isinstance(fileObj, files.Directory):
+                    continue
+
+                if not fileObj:
+                    # this means we've reached some contents that are the
+                    # target of ptr's, but not a ptr itself. look through
+                    # the delayedRestore list for someplace to put this file
+                    match = None
+                    for j, item in enumerate(delayedRestores):
+                        if pathId == item[4] or ptrId == item[4]:
+                            match = j, item
+                            break
 
-                assert(match)
+                    assert(match)
 
-                (otherId, fileObj, target, msg, ptrId, otherFileId) = match[1]
+                    (otherId, fileObj, target, msg, ptrId, otherFileId) = match[1]
 
-                contType, contents = self.changeSet.getFileContents(
-                                            pathId, fileId,
-                                            compressed = True)
-                assert(contType == changeset.ChangedFileTypes.file)
-                tmpPtrFile = self.restoreFile(fileObj, contents, self.root,
-                    target, journal, opJournal, self.isSourceTrove,
-                    keepTempfile = True)
-                del delayedRestores[match[0]]
-                # at this point we _should_ have tmpPtrFile != target
-                # but we'll test for it just to be safe
+                    contType, contents = self.changeSet.getFileContents(
+                                                pathId, fileId,
+                                                compressed = True)
+                    assert(contType == changeset.ChangedFileTypes.file)
+                    tmpPtrFile = self.restoreFile(fileObj, contents, self.root,
+                        target, journal, opJournal, self.isSourceTrove,
+                        keepTempfile = True)
+                    del delayedRestores[match[0]]
+                    # at this point we _should_ have tmpPtrFile != target
+                    # but we'll test for it just to be safe
+                    if tmpPtrFile != target:
+                        tmpPtrFiles.append(tmpPtrFile)
+
+                    if fileObj.hasContents and fileObj.linkGroup():
+                        linkGroup = fileObj.linkGroup()
+                        self.linkGroups[linkGroup] = target
+                    ptrTargets[ptrId] = tmpPtrFile
+                    continue
+
+                # None means "don't restore contents"; "" means "take the
+                # contents from the change set or from the database". If we
+                # take the file contents from the change set, we look for the
+                # opportunity to make a hard link instead of actually restoring it.
+                needContents = fileObj.hasContents
+                if (override != "" and pathId not in ptrTargets
+                                   and ptrId not in ptrTargets):
+                    needContents = False
+                    contents = override
+                if needContents and fileObj.hasContents:
+                    self.callback.restoreFiles(fileObj.contents.size(),
+                                               self.restoreSize)
+                    if fileObj.flags.isConfig() and not fileObj.flags.isSource():
+                        # take the config file from the local database
+                        contents = self.db.getFileContents(
+                                        [ (None, None, fileObj) ])[0]
+                        contents = filecontents.FromString(contents.get().read())
+                    elif fileObj.linkGroup() and \
+                            self.linkGroups.has_key(fileObj.linkGroup()):
+                        # this creates links whose target we already know
+                        # (because it was already present or already restored)
+                        if pipeline:
+                            pipeline.drain()
+                        if self._createLink(fileObj.linkGroup(), target, opJournal):
+                            self.updatePtrs(ptrId, pathId, ptrTargets, override,
+                                       contents, target)
+                            continue
+                    else:
+                        if (lastRestored.pathId, lastRestored.fileId) == \
+                                        (pathId, fileId):
+                            # we share contents with another path
+                            contType = lastRestored.type
+                            if lastRestored.type == changeset.ChangedFileTypes.ptr:
+                                contents = filecontents.FromString(
+                                                    lastRestored.target)
+                            else:
+                                if pipeline:
+                                    pipeline.drain()
+                                contents = filecontents.FromFilesystem(
+                                                    lastRestored.target)
+                        else:
+                            contType, contents = self.changeSet.getFileContents(
+                                                                pathId, fileId,
+                                                                compressed = True)
+
+                        assert(contType != changeset.ChangedFileTypes.diff)
+                        # PTR types are restored later. We need to cache
+                        # information about them in lastRestored in case another
+                        # instances of this fileId/pathId combination needs the
+                        # same target
+                        if contType == changeset.ChangedFileTypes.ptr:
+                            targetPtrId = contents.get().read()
+                            if contents.isCompressed():
+                                targetPtrId = util.decompressString(targetPtrId)
+
+                            lastRestored.pathId = pathId
+                            lastRestored.fileId = fileId
+                            lastRestored.type = changeset.ChangedFileTypes.ptr
+                            lastRestored.target = targetPtrId
+
+                            delayedRestores.append((pathId, fileObj, target, msg,
+                                                    targetPtrId, fileId))
+                            if not ptrTargets.has_key(targetPtrId):
+                                ptrTargets[targetPtrId] = None
+                                targetPtrPathId = targetPtrId[:16]
+                                targetPtrFileId = targetPtrId[16:]
+                                # this doesn't insert duplicate records, they're
+                                # silently skipped
+                                util.tupleListBsearchInsert(restores,
+                                    (targetPtrPathId, targetPtrFileId, None, None,
+                                     None, None), self.ptrCmp)
+
+                            continue
+                        elif contType == changeset.ChangedFileTypes.hldr:
+                            # missing contents; skip it and hope someone else
+                            # figures it out later (probably in the local part
+                            # of the rollback)
+
+                            # XXX we need to create this or conary thinks it
+                            # was removed by the user if it doesn't already
+                            # exist, when that's not what we mean here
+                            dirName = os.path.dirname(target)
+                            util.mkdirChain(dirName)
+                            name = os.path.basename(target)
+                            tmpfd, tmpname = tempfile.mkstemp(name, '.ct', dirName)
+                            os.close(tmpfd)
+                            opJournal.backup(target)
+                            os.rename(tmpname, target)
+
+                            continue
+
+                isPtrTarget = self.updatePtrs(ptrId, pathId, ptrTargets, override, contents, target)
+
+                if override != "":
+                    contents = override
+
+                if pipeline and not isPtrTarget:
+                    pipeline.restore(fileObj, contents, target, msg)
+                    tmpPtrFile = target
+                else:
+                    tmpPtrFile = self.restoreFile(fileObj, contents, self.root,
+                                target, journal, opJournal, self.isSourceTrove,
+                                keepTempfile = isPtrTarget)
+                    log.debug(msg, target)
                 if tmpPtrFile != target:
+                    self.updatePtrs(ptrId, pathId, ptrTargets, override, contents,
+                                    tmpPtrFile)
                     tmpPtrFiles.append(tmpPtrFile)
 
+                lastRestored.pathId = pathId
+                lastRestored.fileId = fileId
+                lastRestored.target = tmpPtrFile
+                lastRestored.type = changeset.ChangedFileTypes.file
+
                 if fileObj.hasContents and fileObj.linkGroup():
                     linkGroup = fileObj.linkGroup()
                     self.linkGroups[linkGroup] = target
-                ptrTargets[ptrId] = tmpPtrFile
-                continue
 
-            # None means "don't restore contents"; "" means "take the
-            # contents from the change set or from the database". If we
-            # take the file contents from the change set, we look for the
-            # opportunity to make a hard link instead of actually restoring it.
-            needContents = fileObj.hasContents
-            if (override != "" and pathId not in ptrTargets
-                               and ptrId not in ptrTargets):
-                needContents = False
-                contents = override
-            if needContents and fileObj.hasContents:
-                self.callback.restoreFiles(fileObj.contents.size(),
-                                           self.restoreSize)
-                if fileObj.flags.isConfig() and not fileObj.flags.isSource():
-                    # take the config file from the local database
-                    contents = self.db.getFileContents(
-                                    [ (None, None, fileObj) ])[0]
-                    contents = filecontents.FromString(contents.get().read())
-                elif fileObj.linkGroup() and \
-                        self.linkGroups.has_key(fileObj.linkGroup()):
-                    # this creates links whose target we already know
-                    # (because it was already present or already restored)
-                    if self._createLink(fileObj.linkGroup(), target, opJournal):
-                        self.updatePtrs(ptrId, pathId, ptrTargets, override,
-                                   contents, target)
-                        continue
-                else:
-                    if (lastRestored.pathId, lastRestored.fileId) == \
-                                    (pathId, fileId):
-                        # we share contents with another path
-                        contType = lastRestored.type
-                        if lastRestored.type == changeset.ChangedFileTypes.ptr:
-                            contents = filecontents.FromString(
-                                                lastRestored.target)
-                        else:
-                            contents = filecontents.FromFilesystem(
-                                                lastRestored.target)
-                    else:
-                        contType, contents = self.changeSet.getFileContents(
-                                                            pathId, fileId,
-                                                            compressed = True)
-
-                    assert(contType != changeset.ChangedFileTypes.diff)
-                    # PTR types are restored later. We need to cache
-                    # information about them in lastRestored in case another
-                    # instances of this fileId/pathId combination needs the
-                    # same target
-                    if contType == changeset.ChangedFileTypes.ptr:
-                        targetPtrId = contents.get().read()
-                        if contents.isCompressed():
-                            targetPtrId = util.decompressString(targetPtrId)
-
-                        lastRestored.pathId = pathId
-                        lastRestored.fileId = fileId
-                        lastRestored.type = changeset.ChangedFileTypes.ptr
-                        lastRestored.target = targetPtrId
-
-                        delayedRestores.append((pathId, fileObj, target, msg,
-                                                targetPtrId, fileId))
-                        if not ptrTargets.has_key(targetPtrId):
-                            ptrTargets[targetPtrId] = None
-                            targetPtrPathId = targetPtrId[:16]
-                            targetPtrFileId = targetPtrId[16:]
-                            # this doesn't insert duplicate records, they're
-                            # silently skipped
-                            util.tupleListBsearchInsert(restores,
-                                (targetPtrPathId, targetPtrFileId, None, None,
-                                 None, None), self.ptrCmp)
-
-                        continue
-                    elif contType == changeset.ChangedFileTypes.hldr:
-                        # missing contents; skip it and hope someone else
-                        # figures it out later (probably in the local part
-                        # of the rollback)
-
-                        # XXX we need to create this or conary thinks it
-                        # was removed by the user if it doesn't already
-                        # exist, when that's not what we mean here
-                        dirName = os.path.dirname(target)
-                        util.mkdirChain(dirName)
-                        name = os.path.basename(target)
-                        tmpfd, tmpname = tempfile.mkstemp(name, '.ct', dirName)
-                        os.close(tmpfd)
-                        opJournal.backup(target)
-                        os.rename(tmpname, target)
-
-                        continue
-
-            isPtrTarget = self.updatePtrs(ptrId, pathId, ptrTargets, override, contents, target)
-
-            if override != "":
-                contents = override
-
-            tmpPtrFile = self.restoreFile(fileObj, contents, self.root,
-                        target, journal, opJournal, self.isSourceTrove,
-                        keepTempfile = isPtrTarget)
-            if tmpPtrFile != target:
-                self.updatePtrs(ptrId, pathId, ptrTargets, override, contents,
-                                tmpPtrFile)
-                tmpPtrFiles.append(tmpPtrFile)
-
-            lastRestored.pathId = pathId
-            lastRestored.fileId = fileId
-            lastRestored.target = tmpPtrFile
-            lastRestored.type = changeset.ChangedFileTypes.file
-            log.debug(msg, target)
-
-            if fileObj.hasContents and fileObj.linkGroup():
-                linkGroup = fileObj.linkGroup()
-                self.linkGroups[linkGroup] = target
+            if pipeline:
+                pipeline.drain()
+        finally:
+            if pipeline:
+                pipeline.close()
 
         for (pathId, fileObj, target, msg, ptrId, fileId) in delayedRestores:
             # we wouldn't be here if the fileObj didn't have contents and
@@ -424,21 +424,26 @@ class ChangeSet(streams.StreamSet):
         return one + two
 
     def appendToFile(self, outFile, withReferences = False,
-                     versionOverride = None):
+                     versionOverride = None, compressThreads = 0):
         start = outFile.tell()
 
+        # references are expanded when the changeset is sent, which would
+        # invalidate the offsets in an index
+        assert(not (withReferences and
+               versionOverride == filecontainer.FILE_CONTAINER_VERSION_TOC))
         csf = filecontainer.FileContainer(outFile,
-                                          version = versionOverride,
-                                          append = True)
+                version = versionOverride, append = True,
+                compressThreads = compressThreads)
 
         str = self.freeze()
         csf.addFile("CONARYCHANGESET", filecontents.FromString(str), "")
         correction = self.writeAllContents(csf,
                                            withReferences = withReferences)
+        csf.close()
         return (outFile.tell() - start) + correction
 
     def writeToFile(self, outFileName, withReferences = False, mode = 0666,
-                    versionOverride = None):
+                    versionOverride = None, compressThreads = 0):
         # 0666 is right for mode because of umask
         try:
             outFileFd = os.open(outFileName,
@@ -447,7 +452,8 @@ class ChangeSet(streams.StreamSet):
             outFile = os.fdopen(outFileFd, "w+")
 
             size = self.appendToFile(outFile, withReferences = withReferences,
-                                     versionOverride = versionOverride)
+                                     versionOverride = versionOverride,
+                                     compressThreads = compressThreads)
             outFile.close()
             return size
         except:
@@ -1419,6 +1425,16 @@ class ReadOnlyChangeSet(ChangeSet):
                 f.seek(0)
                 cont = filecontents.FromFile(f, compressed = True)
         else:
+            # indexed containers are read directly, leaving the sequential
+            # position alone
+            indexed = self._getIndexedFile(key)
+            if indexed is not None:
+                name, tagInfo, f = indexed
+                if not compressed:
+                    f = gzip.GzipFile(None, "r", fileobj = f)
+                return ('cft-' + tagInfo.split()[1],
+                        filecontents.FromFile(f, compressed = compressed))
+
             self.filesRead = True
 
             rc = self._nextFile()
@@ -1451,6 +1467,15 @@ class ReadOnlyChangeSet(ChangeSet):
         else:
             return (tag, cont)
 
+    def _getIndexedFile(self, name):
+        for csf in self.fileContainers:
+            if csf.hasIndex():
+                entry = csf.getFile(name)
+                if entry is not None:
+                    return entry
+
+        return None
+
     def makeAbsolute(self, repos):
         """
         Converts this (relative) change set to an abstract change set.  File
@@ -66,16 +66,47 @@ knowing the total size being stored as well as the dynamic compression making
 that size unknowable in advance. It does limit file storage size a bit, but
 leaves us with well over 63 bits of length.
 
+Containers of version FILE_CONTAINER_VERSION_TOC are followed by an index
+which allows files to be looked up by name without reading the entries in
+front of them. The index is stored as one more (uncompressed) file entry
+named INDEX_NAME, and the container ends with a fixed size footer:
+
+ - INDEX_MAGIC (4 bytes)
+ - offset of the index file table entry (8 bytes)
+
+The index contents are entries sorted by file name:
+
+ - length of file name (2 bytes)
+ - length of arbitrary data (2 bytes)
+ - offset of the file data (8 bytes)
+ - length of the file data (8 bytes)
+ - file name
+ - arbitrary file table data
+
+Offsets are relative to the start of the container. Sequential readers stop
+at the index entry, so everything before it is laid out exactly as in a
+FILE_CONTAINER_VERSION_FILEID_IDX container; dumpIter() streams indexed
+containers in that version for clients which don't know about indexes.
+TOC containers are only written for local use, never sent over the wire.
+
 This code is careful not to depend on the file pointer at all for reading
 (via pread). The file pointer is used while creating file containers.
+
+Containers created with compressThreads > 1 gzip the contents of files
+added with addFile() on a pool of worker threads, ahead of the writer.
+Entries are still written in the order they were added and compressed
+exactly as DeterministicGzipFile would, so the container is byte for byte
+the same; the pending entries are written out by close().
 """
 
+import bisect
 import errno
 import os
 import struct
+import zlib
 
 import conary.errors
-from conary.lib import util
+from conary.lib import util, workerpool
 from conary.repository import filecontents
 
 FILE_CONTAINER_MAGIC = "\xEA\x3F\x81\xBB"
@@ -83,21 +114,67 @@ SUBFILE_MAGIC = 0x3FBB
 # used for files whose contents are > 4gig
 LARGE_SUBFILE_MAGIC = 0x40CD
 
+INDEX_NAME = "CONARYINDEX"
+INDEX_MAGIC = "\xEA\x3F\x81\xBC"
+INDEX_ENTRY = struct.Struct("!HHQQ")
+INDEX_FOOTER = struct.Struct("!4sQ")
+
 # File container versions. Add references to these in netclient too.
+FILE_CONTAINER_VERSION_TOC          = 2015061201
 FILE_CONTAINER_VERSION_FILEID_IDX   = 2007022001
 FILE_CONTAINER_VERSION_WITH_REMOVES = 2006071301
 FILE_CONTAINER_VERSION_NO_REMOVES   = 2005101901
 
-READABLE_VERSIONS = [ FILE_CONTAINER_VERSION_FILEID_IDX,
+READABLE_VERSIONS = [ FILE_CONTAINER_VERSION_TOC,
+                      FILE_CONTAINER_VERSION_FILEID_IDX,
                       FILE_CONTAINER_VERSION_WITH_REMOVES,
                       FILE_CONTAINER_VERSION_NO_REMOVES ]
 
-FILE_CONTAINER_VERSION_LATEST = max(READABLE_VERSIONS)
+# indexed containers are local only; this is the newest version exchanged
+# with repositories
+FILE_CONTAINER_VERSION_LATEST = FILE_CONTAINER_VERSION_FILEID_IDX
 
 SEEK_SET = 0
 SEEK_CUR = 1
 SEEK_END = 2
 
+# gzip header written by DeterministicGzipFile: no file name, mtime of 0,
+# maximum compression flag and an unknown OS
+GZIP_HEADER = "\037\213\010\000\000\000\000\000\002\377"
+
+def _compressContents(contents, bufSize):
+    """
+    Gzip C{contents} into a temporary buffer, producing the same bytes as
+    copying it into a level 6 DeterministicGzipFile. Safe to call from
+    several threads at once.
+    """
+    out = util.BoundedStringIO(maxMemorySize = 1024 * 1024)
+    out.write(GZIP_HEADER)
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS,
+                                  zlib.DEF_MEM_LEVEL, 0)
+    crc = zlib.crc32('') & 0xffffffffL
+    size = 0
+
+    fileObj = contents.get()
+    while True:
+        buf = fileObj.read(bufSize)
+        if not buf:
+            break
+        crc = zlib.crc32(buf, crc) & 0xffffffffL
+        size += len(buf)
+        out.write(compressor.compress(buf))
+    out.write(compressor.flush())
+    out.write(struct.pack("<II", crc, size & 0xffffffffL))
+    out.seek(0)
+    return out
+
+def defaultCompressThreads():
+    try:
+        cpus = os.sysconf('SC_NPROCESSORS_ONLN')
+    except (ValueError, OSError):
+        cpus = 1
+    return max(1, min(cpus, 16))
+
 class FileContainer:
 
     bufSize = 128 * 1024
@@ -119,18 +196,127 @@ class FileContainer:
         self.next = self.contentsStart
 
     def close(self):
+        if self.file is not None and self.mutable:
+            self._writePending()
+            if self.pool is not None:
+                self.pool.close()
+                self.pool = None
+            if self.index is not None:
+                self._writeIndex()
         self.file = None
 
+    def _writeIndex(self):
+        index = self.index
+        self.index = None
+        index.sort(key = lambda x: x[0])
+        data = ''.join(INDEX_ENTRY.pack(len(name), len(tag), offset, size)
+                       + name + tag for (name, tag, offset, size) in index)
+
+        indexOffset = self.file.tell() - self.start
+        self.addFile(INDEX_NAME, filecontents.FromString(data), "",
+                     precompressed = True)
+        self.file.write(INDEX_FOOTER.pack(INDEX_MAGIC, indexOffset))
+
+    def _readIndex(self):
+        self.indexNames = []
+        self.indexEntries = []
+        if self.version != FILE_CONTAINER_VERSION_TOC:
+            return
+        footer = self.file.pread(INDEX_FOOTER.size,
+                                 self.size - INDEX_FOOTER.size)
+        if len(footer) != INDEX_FOOTER.size:
+            raise BadContainer("file container is truncated")
+        magic, indexOffset = INDEX_FOOTER.unpack(footer)
+        if magic != INDEX_MAGIC:
+            raise BadContainer("file container index is missing")
+
+        name, tag, size, dataOffset, nextOffset = self._readEntry(indexOffset)
+        if name != INDEX_NAME:
+            raise BadContainer("file container index is corrupt")
+        data = self.file.pread(size, dataOffset)
+        if len(data) < size:
+            raise BadContainer("file container is truncated")
+
+        i = 0
+        while i < size:
+            nameLen, tagLen, offset, fileSize = INDEX_ENTRY.unpack_from(data, i)
+            i += INDEX_ENTRY.size
+            name = data[i:i + nameLen]
+            i += nameLen
+            tag = data[i:i + tagLen]
+            i += tagLen
+            self.indexNames.append(name)
+            self.indexEntries.append((tag, offset, fileSize))
+
+    def hasIndex(self):
+        return self.version == FILE_CONTAINER_VERSION_TOC
+
+    def getFile(self, name):
+        """
+        Return C{(name, tag, fileObj)} for the first file named C{name}, or
+        None if there is no such file. Indexed containers look the name up
+        in the index; others are scanned from the start. The position used
+        by L{getNextFile} is not affected.
+        """
+        assert(not self.mutable)
+
+        if self.hasIndex():
+            if self.indexNames is None:
+                self._readIndex()
+            i = bisect.bisect_left(self.indexNames, name)
+            if i == len(self.indexNames) or self.indexNames[i] != name:
+                return None
+            tag, offset, size = self.indexEntries[i]
+            return (name, tag,
+                    util.SeekableNestedFile(self.file, size, start = offset))
+
+        offset = self.contentsStart
+        while True:
+            (entryName, tag, size, dataOffset,
+                    offset) = self._readEntry(offset)
+            if entryName is None:
+                return None
+            if entryName == name:
+                return (name, tag, util.SeekableNestedFile(self.file, size,
+                                                           start = dataOffset))
+
     def addFile(self, fileName, contents, tableData, precompressed = False):
         assert(isinstance(contents, filecontents.FileContents))
         assert(self.mutable)
 
-        fileObj = contents.get()
+        if self.pool is not None and not precompressed:
+            self.pending.append((fileName, tableData,
+                    self.pool.submit(_compressContents, contents,
+                                     self.bufSize)))
+            # write out whatever is finished, keeping the number of
+            # buffered entries bounded
+            self._writePending(limit = self.maxPending)
+            return
+
+        self._writePending()
+        self._writeFile(fileName, contents.get(), tableData, precompressed)
+
+    def _writePending(self, limit = 0):
+        # write entries in order as long as they are finished, waiting for
+        # them while more than limit are outstanding
+        while self.pending:
+            fileName, tableData, result = self.pending[0]
+            if len(self.pending) <= limit and not result.ready():
+                break
+            del self.pending[0]
+            fileObj = result.get()
+            self._writeFile(fileName, fileObj, tableData, True)
+            fileObj.close()
+
+    def _writeFile(self, fileName, fileObj, tableData, precompressed):
         headerOffset = self.file.tell()
         self.file.write(struct.pack("!HH", SUBFILE_MAGIC, len(fileName)))
         self.file.write(struct.pack("!IH", 0, len(tableData)))
         self.file.write(fileName)
         self.file.write(tableData)
+        # the name and table data come before the contents in both entry
+        # formats; only the large one adds anything after them
+        dataOffset = self.file.tell() - self.start
 
         if precompressed:
             size = util.copyfileobj(fileObj, self.file)
@@ -141,6 +327,9 @@ class FileContainer:
             gzFile.close()
             size = self.file.tell() - start
 
+        if self.index is not None:
+            self.index.append((fileName, tableData, dataOffset, size))
+
         if size < 0x100000000:
             self.file.seek(headerOffset + 4, SEEK_SET)
             self.file.write(struct.pack("!I", size))
@@ -169,8 +358,13 @@ class FileContainer:
         return (name, tag, fcf)
 
     def _nextFile(self):
-        offset = self.next
+        entry = self._readEntry(self.next)
+        if entry[0] == INDEX_NAME and self.hasIndex():
+            # the index is the end of the contents
+            return (None, None, None, None, None)
+        return entry
 
+    def _readEntry(self, offset):
         nameLen = self.file.pread(10, offset)
         if not len(nameLen):
             return (None, None, None, None, None)
@@ -219,7 +413,7 @@ class FileContainer:
             footer = struct.pack('!HH', len(name), len(tag))
         return ''.join((header, name, tag)), footer
 
-    def dumpIter(self, readFileFunc, args=(), offset=0):
+    def dumpIter(self, readFileFunc, args=(), offset=0, fileRanges=False):
         """Dump the changeset as a byte stream, yielding chunks of bytes.
 
         C{readFileFunc} allows the caller to replace placeholders with actual
@@ -234,10 +428,18 @@ class FileContainer:
         @type  args: C{tuple}
         @param offset: Skip this many bytes in the output stream
         @type  offset: C{int}
+        @param fileRanges: Yield a L{util.FileRange} instead of the data for
+        each subfile backed by a file descriptor. Each range must be consumed
+        before the next item is requested.
+        @type  fileRanges: C{bool}
         """
         assert not self.mutable
 
         fileHeader = self.file.pread(8, 0)
+        if self.version == FILE_CONTAINER_VERSION_TOC:
+            # the index is dropped, leaving an ordinary container
+            fileHeader = FILE_CONTAINER_MAGIC + struct.pack("!I",
+                    FILE_CONTAINER_VERSION_FILEID_IDX)
         if offset < 8:
             yield fileHeader[offset:]
         if offset:
@@ -256,10 +458,16 @@ class FileContainer:
             if offset:
                 offset = max(0, offset - len(header))
             if offset < expandedSize:
-                if offset:
-                    subfile.seek(offset, os.SEEK_CUR)
-                for chunk in util.iterFileChunks(subfile):
-                    yield chunk
+                fileRange = None
+                if fileRanges:
+                    fileRange = util.FileRange.fromFile(subfile, expandedSize)
+                if fileRange is not None:
+                    yield fileRange.skip(offset)
+                else:
+                    if offset:
+                        subfile.seek(offset, os.SEEK_CUR)
+                    for chunk in util.iterFileChunks(subfile):
+                        yield chunk
             if offset:
                 offset = max(0, offset - expandedSize)
 
@@ -282,7 +490,8 @@ class FileContainer:
         if self.file:
             self.close()
 
-    def __init__(self, file, version = None, append = False):
+    def __init__(self, file, version = None, append = False,
+                 compressThreads = 1):
         """
         Create a FileContainer object.
 
@@ -292,6 +501,8 @@ class FileContainer:
         is retained, so the caller may optionally close it.
         @param append: if True, creates a new filecontainer at the end
         of the passed flie object
+        @param compressThreads: number of threads used to compress file
+        contents when creating a container
         """
 
         # make our own copy of this file which nobody can close underneath us
@@ -300,8 +511,22 @@ class FileContainer:
         if version is None:
             version = FILE_CONTAINER_VERSION_LATEST
 
+        self.index = None
+        self.indexNames = None
+        self.indexEntries = None
+        self.pool = None
+        self.pending = []
+        self.maxPending = 2 * compressThreads
+
         self.file.seek(0, SEEK_END)
-        if append or not self.file.tell():
+        self.size = self.file.tell()
+        if append or not self.size:
+            self.start = self.size
+            if version == FILE_CONTAINER_VERSION_TOC:
+                self.index = []
+            if compressThreads > 1:
+                self.pool = workerpool.WorkerPool(compressThreads,
+                                                  name = 'compress')
             try:
                 self.file.write(FILE_CONTAINER_MAGIC)
                 self.file.write(struct.pack("!I", version))
@@ -314,6 +539,7 @@ class FileContainer:
         else:
             # we don't need to put this file pointer back; we don't depend
             # on it here at all; everything is through pseek
+            self.start = 0
             try:
                 self.readHeader()
             except:
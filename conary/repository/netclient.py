@@ -32,7 +32,7 @@ from conary.cmds import metadata
 from conary import trove as trv_mod
 from conary import trovetup
 from conary import versions
-from conary.lib import util, api
+from conary.lib import util, api, workerpool
 from conary.lib import httputils
 from conary.lib import log
 from conary.lib.http import proxy_map, request as req_mod
@@ -57,7 +57,13 @@ PermissionAlreadyExists = errors.PermissionAlreadyExists
 shims = xmlshims.NetworkConvertors()
 
 # end of range or last protocol version + 1
-CLIENT_VERSIONS = range(36, 73 + 1)
+CLIENT_VERSIONS = range(36, 75 + 1)
+
+# calls made with this protocol version or newer use the binary RPC encoding
+BINARY_RPC_VERSION = 74
+
+# servers speaking this protocol version or newer accept multiCall batches
+MULTICALL_VERSION = 75
 
 from conary.repository.trovesource import TROVE_QUERY_ALL, TROVE_QUERY_PRESENT, TROVE_QUERY_NORMAL
 
@@ -122,6 +128,13 @@ class ServerProxy(util.ServerProxy):
     def getProtocolVersion(self):
         return self._protocolVersion
 
+    def batch(self):
+        """
+        Return a L{MultiCall} which collects calls to this server and makes
+        them in a single request.
+        """
+        return MultiCall(self)
+
     def _request(self, method, args, kwargs):
         protocolVersion = (kwargs.pop('protocolVersion', None) or
             self.getProtocolVersion())
@@ -152,7 +165,8 @@ class ServerProxy(util.ServerProxy):
     def _marshalCall(self, method, request):
         start = time.time()
         rawRequest = request.toWire()
-        rawResponse = util.ServerProxy._request(self, method, rawRequest)
+        rawResponse = util.ServerProxy._request(self, method, rawRequest,
+                binary=request.version >= BINARY_RPC_VERSION)
         # XMLRPC responses are a 1-tuple
         rawResponse, = rawResponse
         response = self._responseFilter.fromWire(request.version, rawResponse,
@@ -182,6 +196,47 @@ class ServerProxy(util.ServerProxy):
         self._entitlementDir = entitlementDir
         self._callLog = callLog
 
+class MultiCall(object):
+    """
+    Collects independent read-only calls to one server. Calling the
+    MultiCall object sends all of them as a single multiCall request and
+    returns their results in order; if any of the calls failed, the
+    exception of the first one is raised instead. Servers which predate
+    multiCall get the calls one at a time.
+    """
+
+    def __init__(self, proxy):
+        self._proxy = proxy
+        self._calls = []
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return ServerProxyMethod(self._add, name)
+
+    def _add(self, method, args, kwargs):
+        self._calls.append((method, args, kwargs))
+
+    def __call__(self):
+        calls, self._calls = self._calls, []
+        proxy = self._proxy
+        if (len(calls) < 2 or
+                proxy.getProtocolVersion() < MULTICALL_VERSION):
+            return [ proxy._request(method, args, kwargs)
+                     for method, args, kwargs in calls ]
+
+        rawResults = proxy._request('multiCall', (calls,), {})
+        results = []
+        for rawResponse in rawResults:
+            response = proxy._responseFilter.fromWire(
+                    proxy.getProtocolVersion(), rawResponse, {})
+            if response.isException:
+                raise unmarshalException(response.excName, response.excArgs,
+                        response.excKwargs)
+            results.append(response.result)
+        return results
+
+
 class ServerCache(object):
     TransportFactory = transport.Transport
 
@@ -384,6 +439,8 @@ class NetworkRepositoryClient(xmlshims.NetworkConvertors,
                               repository.AbstractRepository,
                               trovesource.SearchableTroveSource):
     # Constants for changeset versions
+    FILE_CONTAINER_VERSION_TOC = \
+                            filecontainer.FILE_CONTAINER_VERSION_TOC
     FILE_CONTAINER_VERSION_FILEID_IDX = \
                             filecontainer.FILE_CONTAINER_VERSION_FILEID_IDX
     FILE_CONTAINER_VERSION_WITH_REMOVES = \
@@ -1509,7 +1566,7 @@ class NetworkRepositoryClient(xmlshims.NetworkConvertors,
                             withFiles, withFileContents,
                             excludeAutoSource, filesNeeded,
                             chgSetList, removedList, changesetVersion,
-                            mirrorMode):
+                            mirrorMode, outFile, callback):
             if callback:
                 callback.requestingChangeSet()
             server.setAbortCheck(None)
@@ -1541,7 +1598,8 @@ class NetworkRepositoryClient(xmlshims.NetworkConvertors,
                                 "Attempting to resume where it left off.")
                 try:
                     (sizes, extraTroveList, extraFileList, removedTroveList,
-                            extra,) = _getCsOnce(serverVersion, args, kwargs)
+                            extra,) = _getCsOnce(server, serverVersion, args,
+                                    kwargs, outFile, callback)
                     break
                 except errors.TruncatedResponseError:
                     attempts -= 1
@@ -1577,7 +1635,8 @@ class NetworkRepositoryClient(xmlshims.NetworkConvertors,
             return (cs, self.toJobList(extraTroveList),
                     self.toFilesNeeded(extraFileList))
 
-        def _getCsOnce(serverVersion, args, kwargs):
+        def _getCsOnce(server, serverVersion, args, kwargs, outFile,
+                       callback):
             l = server.getChangeSet(*args, **kwargs)
             extra = {}
             if serverVersion >= 50:
@@ -1621,7 +1680,9 @@ class NetworkRepositoryClient(xmlshims.NetworkConvertors,
                 headers = [('X-Conary-Servername', server._serverName)]
                 try:
                     inF = transport.ConaryURLOpener(proxyMap=self.c.proxyMap
-                            ).open(url, forceProxy=forceProxy, headers=headers)
+                            ).openResumable(url, forceProxy=forceProxy,
+                                    headers=headers,
+                                    attempts=self.cfg.downloadAttempts)
                 except transport.TransportError, e:
                     raise errors.RepositoryError(str(e))
 
@@ -1658,7 +1719,8 @@ class NetworkRepositoryClient(xmlshims.NetworkConvertors,
 
         def _getCsFromShim(target, cs, server, job, recurse, withFiles,
                            withFileContents, excludeAutoSource,
-                           filesNeeded, chgSetList, removedList):
+                           filesNeeded, chgSetList, removedList, outFile,
+                           callback):
             (newCs, extraTroveList, extraFileList, removedList) = \
                   server.getChangeSetObj(job, recurse,
                                          withFiles, withFileContents,
@@ -1669,6 +1731,72 @@ class NetworkRepositoryClient(xmlshims.NetworkConvertors,
                 cs.merge(newCs)
             return cs, extraTroveList, extraFileList
 
+        def _getCsFromServer(serverName, job, outFile, callback):
+            # extra jobs and files are collected per server so that
+            # concurrent fetches don't share lists
+            server = self.c[serverName]
+            extraJobs = []
+            extraFiles = set()
+            extraRemoved = []
+            args = (target, None, server, job, recurse, withFiles,
+                    withFileContents, excludeAutoSource,
+                    extraFiles, extraJobs, extraRemoved)
+            if server.__class__ == ServerProxy:
+                # this is a XML-RPC proxy for a remote repository
+                rc = _getCsFromRepos(*(args + (changesetVersion,
+                                               mirrorMode, outFile,
+                                               callback)))
+            else:
+                # assume we are a shim repository
+                rc = _getCsFromShim(*(args + (outFile, callback)))
+            newCs, extraTroveList, extraFileList = rc
+            extraJobs += extraTroveList
+            extraFiles.update(extraFileList)
+            return newCs, extraJobs, extraFiles, extraRemoved
+
+        def _getCsFromServers(serverJobs):
+            # Remote repositories are queried concurrently, each streaming
+            # into its own temporary container. Shim repositories run in
+            # this thread. Results come back in server name order so the
+            # merged changeset doesn't depend on which server answered first.
+            serverNames = sorted(serverJobs)
+            remote = [ x for x in serverNames
+                       if self.c[x].__class__ == ServerProxy ]
+            maxWorkers = min(self.cfg.downloadConcurrency, len(remote))
+            if maxWorkers <= 1:
+                return [ _getCsFromServer(x, serverJobs[x], outFile,
+                                          callback)
+                         for x in serverNames ]
+
+            if callback:
+                workerCallback = workerpool.SerializedProxy(callback)
+            else:
+                workerCallback = None
+            pool = workerpool.WorkerPool(maxWorkers, name = 'changeset')
+            try:
+                pending = {}
+                for serverName in remote:
+                    pending[serverName] = pool.submit(_getCsFromServer,
+                            serverName, serverJobs[serverName],
+                            _tempContainer(), workerCallback)
+                results = []
+                for serverName in serverNames:
+                    if serverName in pending:
+                        results.append(pending[serverName].get())
+                    else:
+                        results.append(_getCsFromServer(serverName,
+                                serverJobs[serverName], outFile, callback))
+                return results
+            finally:
+                pool.close()
+
+        def _tempContainer():
+            (fd, path) = util.mkstemp(suffix = '.ccs')
+            f = util.ExtendedFile(path, "w+", buffering = False)
+            os.close(fd)
+            os.unlink(path)
+            return f
+
         if not chgSetList:
             # no need to work hard to find this out
             return changeset.ReadOnlyChangeSet()
@@ -1710,30 +1838,23 @@ class NetworkRepositoryClient(xmlshims.NetworkConvertors,
             chgSetList = []
             removedList = []
 
-            for serverName, job in serverJobs.iteritems():
-                server = self.c[serverName]
-                args = (target, cs, server, job, recurse, withFiles,
-                        withFileContents, excludeAutoSource,
-                        filesNeeded, chgSetList, removedList)
-
-                try:
-                    if server.__class__ == ServerProxy:
-                        # this is a XML-RPC proxy for a remote repository
-                        rc = _getCsFromRepos(*(args + (changesetVersion,
-                                                       mirrorMode)))
-                    else:
-                        # assume we are a shim repository
-                        rc = _getCsFromShim(*args)
-                    cs, extraTroveList, extraFileList = rc
-                except Exception:
-                    if target and os.path.exists(target):
-                        os.unlink(target)
-                    elif os.path.exists(tmpName):
-                        os.unlink(tmpName)
-                    raise
-
-                chgSetList += extraTroveList
-                filesNeeded.update(extraFileList)
+            try:
+                serverResults = _getCsFromServers(serverJobs)
+            except Exception:
+                if target and os.path.exists(target):
+                    os.unlink(target)
+                elif os.path.exists(tmpName):
+                    os.unlink(tmpName)
+                raise
+
+            for newCs, extraJobs, extraFiles, extraRemoved in serverResults:
+                if not cs:
+                    cs = newCs
+                else:
+                    cs.merge(newCs)
+                chgSetList += extraJobs
+                filesNeeded.update(extraFiles)
+                removedList += extraRemoved
 
             if (ourJobList or filesNeeded) and not internalCs:
                 internalCs = changeset.ChangeSet()
@@ -2151,8 +2272,10 @@ class NetworkRepositoryClient(xmlshims.NetworkConvertors,
                     return result
 
                 # Call succeded
+                rawStream = (self.c[server].getProtocolVersion() >=
+                             BINARY_RPC_VERSION)
                 for (fileStream, idx) in zip(fileStreams, idxL):
-                    result[idx] = self.toFile(fileStream)
+                    result[idx] = self.toFile(fileStream, rawStream=rawStream)
                 return result
 
             # All the files failed
@@ -2181,9 +2304,12 @@ class NetworkRepositoryClient(xmlshims.NetworkConvertors,
         return result
 
     def getFileVersion(self, pathId, fileId, version):
-        return self.toFile(self.c[version].getFileVersion(
+        server = self.c[version]
+        return self.toFile(server.getFileVersion(
                                    self.fromPathId(pathId),
-                                   self.fromFileId(fileId)))
+                                   self.fromFileId(fileId)),
+                           rawStream = (server.getProtocolVersion() >=
+                                        BINARY_RPC_VERSION))
 
 
     def getFileContentsObjects(self, server, fileList, callback, outF,
@@ -2204,8 +2330,9 @@ class NetworkRepositoryClient(xmlshims.NetworkConvertors,
         # the same proxy on subsequent requests.
         forceProxy = self.c[server].usedProxy()
         headers = [('X-Conary-Servername', server)]
-        inF = transport.ConaryURLOpener(proxyMap = self.c.proxyMap).open(url,
-                forceProxy=forceProxy, headers=headers)
+        inF = transport.ConaryURLOpener(proxyMap = self.c.proxyMap
+                ).openResumable(url, forceProxy=forceProxy, headers=headers,
+                        attempts=self.cfg.downloadAttempts)
 
         if callback:
             wrapper = callbacks.CallbackRateWrapper(
@@ -2332,15 +2459,15 @@ class NetworkRepositoryClient(xmlshims.NetworkConvertors,
             l = byServer.setdefault(server, [])
             l.append((i, (fileId, fileVersion)))
 
-        if tmpFile:
-            outF = tmpFile
-        else:
+        def _tempFile():
             (fd, path) = util.mkstemp(suffix = 'filecontents')
             outF = util.ExtendedFile(path, "r+", buffering = False)
             os.close(fd)
             os.unlink(path)
+            return outF
 
-        for server, itemList in byServer.iteritems():
+        def _fetch(server, outF, callback):
+            itemList = byServer[server]
             fileList = [ (self.fromFileId(x[1][0]),
                           self.fromVersion(x[1][1])) for x in itemList ]
             if callback:
@@ -2349,11 +2476,29 @@ class NetworkRepositoryClient(xmlshims.NetworkConvertors,
                 else:
                     callback.requestingFileContents()
 
-            fileObjList = self.getFileContentsObjects(server, fileList,
-                                                      callback, outF,
-                                                      compressed)
+            return self.getFileContentsObjects(server, fileList, callback,
+                                               outF, compressed)
 
-            for (i, item), fObj in itertools.izip(itemList, fileObjList):
+        servers = sorted(byServer)
+        maxWorkers = min(self.cfg.downloadConcurrency, len(servers))
+        if maxWorkers <= 1:
+            if tmpFile:
+                outF = tmpFile
+            else:
+                outF = _tempFile()
+            results = [ _fetch(x, outF, callback) for x in servers ]
+        else:
+            # each server downloads into its own file so the transfers
+            # can run concurrently
+            if callback:
+                callback = workerpool.SerializedProxy(callback)
+            results = workerpool.parallelMap(
+                    lambda x: _fetch(x, _tempFile(), callback),
+                    servers, maxWorkers, name = 'filecontents')
+
+        for server, fileObjList in itertools.izip(servers, results):
+            for (i, item), fObj in itertools.izip(byServer[server],
+                                                  fileObjList):
                 contents[i] = fObj
 
         return contents
@@ -2448,7 +2593,8 @@ class NetworkRepositoryClient(xmlshims.NetworkConvertors,
                         hidden = False):
         (outFd, path) = util.mkstemp()
         os.close(outFd)
-        chgSet.writeToFile(path)
+        chgSet.writeToFile(path,
+                compressThreads = filecontainer.defaultCompressThreads())
 
         try:
             result = self._commit(chgSet, path, callback = callback,
@@ -2485,8 +2631,12 @@ class NetworkRepositoryClient(xmlshims.NetworkConvertors,
             sigs = self.c[host].getTroveSigs([
                        (x[1][0], self.fromVersion(x[1][1]),
                         self.fromFlavor(x[1][2])) for x in l ])
+            rawSigs = (self.c[host].getProtocolVersion() >=
+                       BINARY_RPC_VERSION)
             for (i, info), sig in itertools.izip(l, sigs):
-                results[i] = base64.decodestring(sig)
+                if not rawSigs:
+                    sig = base64.decodestring(sig)
+                results[i] = sig
         return results
 
     def setTroveSigs(self, itemList):
@@ -2657,12 +2807,16 @@ class NetworkRepositoryClient(xmlshims.NetworkConvertors,
         return results
 
     def getTroveInfo(self, infoType, troveList):
-        # first, we need to know about this infoType
-        if infoType not in trv_mod.TroveInfo.streamDict.keys():
-            raise Exception("Invalid infoType requested")
+        return self.getMultipleTroveInfo([ infoType ], troveList)[0]
+
+    def getMultipleTroveInfo(self, infoTypes, troveList):
+        # first, we need to know about these infoTypes
+        for infoType in infoTypes:
+            if infoType not in trv_mod.TroveInfo.streamDict.keys():
+                raise Exception("Invalid infoType requested")
 
         byServer = {}
-        results = [ None ] * len(troveList)
+        results = [ [ None ] * len(troveList) for x in infoTypes ]
         for i, info in enumerate(troveList):
             l = byServer.setdefault(info[1].getHost(), [])
             l.append((i, info))
@@ -2672,26 +2826,41 @@ class NetworkRepositoryClient(xmlshims.NetworkConvertors,
                 # this server does not support the getTroveInfo call,
                 # so we need to synthetize it from a getTroves call
                 troveInfoList = self.getTroves(tl, withFiles = False)
-                for (i, tup), trv in itertools.izip(l, troveInfoList):
-                    if trv is not None:
-                        attrname = trv_mod.TroveInfo.streamDict[infoType][2]
-                        results[i] = getattr(trv.troveInfo, attrname, None)
-                continue
-            elif (infoType >= trv_mod._TROVEINFO_TAG_CLONEDFROMLIST and
-                  self.c[host].getProtocolVersion() < 64):
-                # server doesn't support this troveInfo type
+                for result, infoType in itertools.izip(results, infoTypes):
+                    attrname = trv_mod.TroveInfo.streamDict[infoType][2]
+                    for (i, tup), trv in itertools.izip(l, troveInfoList):
+                        if trv is not None:
+                            result[i] = getattr(trv.troveInfo, attrname, None)
                 continue
 
             tl = [ (x[0], self.fromVersion(x[1]), self.fromFlavor(x[2]))
                    for x in tl ]
-            infoList = self.c[host].getTroveInfo(infoType, tl)
-            for (i, tup), (present, dataStr) in itertools.izip(l, infoList):
-                if present == -1:
-                    raise errors.TroveMissing(tup[0], tup[1])
-                if present  == 0:
+            # the info types are fetched in one round trip where the server
+            # supports it
+            batch = self.c[host].batch()
+            queried = []
+            for result, infoType in itertools.izip(results, infoTypes):
+                if (infoType >= trv_mod._TROVEINFO_TAG_CLONEDFROMLIST and
+                      self.c[host].getProtocolVersion() < 64):
+                    # server doesn't support this troveInfo type
                     continue
-                data = base64.decodestring(dataStr)
-                results[i] = trv_mod.TroveInfo.streamDict[infoType][1](data)
+                batch.getTroveInfo(infoType, tl)
+                queried.append((result, infoType))
+
+            # the binary encoding carries frozen streams without base64
+            rawInfo = (self.c[host].getProtocolVersion() >=
+                       BINARY_RPC_VERSION)
+            for (result, infoType), infoList in itertools.izip(queried,
+                                                               batch()):
+                thaw = trv_mod.TroveInfo.streamDict[infoType][1]
+                for (i, tup), (present, data) in itertools.izip(l, infoList):
+                    if present == -1:
+                        raise errors.TroveMissing(tup[0], tup[1])
+                    if present  == 0:
+                        continue
+                    if not rawInfo:
+                        data = base64.decodestring(data)
+                    result[i] = thaw(data)
         return results
 
     @api.publicApi
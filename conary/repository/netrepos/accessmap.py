@@ -326,6 +326,22 @@ class RoleInstances(RoleTable):
         self.rp = RolePermissions(db)
         self.latest = versionops.LatestTable(db)
 
+    def invalidate(self, cu):
+        """
+        Record, in the current transaction, that access may have been taken
+        away from a role. This bumps the generation of all items (see
+        L{versionops.LatestTable}), which authorization results cached by
+        any server process are checked against.
+        """
+        self.latest.invalidateAll(cu)
+
+    def getGeneration(self, cu):
+        """
+        Return the generation bumped by L{invalidate}, or None if the
+        schema has no generations.
+        """
+        return self.latest.getGenerations(cu, [])[0]
+
     def _getRoleId(self, role):
         cu = self.db.cursor()
         cu.execute("SELECT userGroupId FROM UserGroups WHERE userGroup=?",
@@ -368,6 +384,7 @@ class RoleInstances(RoleTable):
         roleId = self._getRoleId(role)
         # remove the RoleTrove access
         cu = self.db.cursor()
+        self.invalidate(cu)
         self.rt.delete(roleId, troveList)
         # instanceIds that were removed from RAT are in tmpInstances now
         # RAP might still grant permissions to some, so we filter those out
@@ -425,6 +442,7 @@ class RoleInstances(RoleTable):
 
     def updatePermissionId(self, permissionId, roleId):
         cu = self.db.cursor()
+        self.invalidate(cu)
         schema.resetTable(cu, "tmpInstances")
         # figure out how the access is changing
         cu.execute("""
@@ -476,6 +494,7 @@ class RoleInstances(RoleTable):
     # updates the canWrite flag for an acl change
     def updateCanWrite(self, permissionId, roleId):
         cu = self.db.cursor()
+        self.invalidate(cu)
         # update the flattened table first
         cu.execute("""
         update UserGroupAllPermissions set canWrite = (
@@ -497,6 +516,7 @@ class RoleInstances(RoleTable):
 
     def deletePermissionId(self, permissionId, roleId):
         cu = self.db.cursor()
+        self.invalidate(cu)
         # compute the list of troves for which no other RAP/RAT access exists
         schema.resetTable(cu, "tmpInstances")
         cu.execute("""
@@ -569,6 +589,7 @@ class RoleInstances(RoleTable):
     # these used used primarily by the markRemoved code
     def deleteInstanceId(self, instanceId):
         cu = self.db.cursor()
+        self.invalidate(cu)
         for t in [ "UserGroupInstancesCache", "UserGroupAllTroves",
                    "UserGroupAllPermissions", "UserGroupTroves"]:
             cu.execute("delete from %s where instanceId = ?" % (t,),
@@ -577,6 +598,7 @@ class RoleInstances(RoleTable):
 
     def deleteInstanceIds(self, idTableName):
         cu = self.db.cursor()
+        self.invalidate(cu)
         for t in [ "UserGroupInstancesCache", "UserGroupAllTroves",
                    "UserGroupAllPermissions", "UserGroupTroves" ]:
             cu.execute("delete from %s where instanceId in (select instanceId from %s)"%(
@@ -589,6 +611,7 @@ class RoleInstances(RoleTable):
     def rebuild(self, roleId = None, cu = None):
         if cu is None:
             cu = self.db.cursor()
+        self.invalidate(cu)
         where = self.getWhereArgs("where", userGroupId = roleId)
         cu.execute("delete from UserGroupInstancesCache %s" % (where,))
         # first, rebuild the flattened tables
@@ -34,31 +34,123 @@ class EmptyCache(dict):
     def set_multi(self, items, time = 0, key_prefix = None):
         return
 
+    def delete(self, key, key_prefix = None):
+        return
+
     def incr(self, key, delta=1):
         return None
 
 
-class DumbCache(dict):
+class LRUCache(object):
+    """
+    In-process cache used when no memcached server is configured.
 
-    def __init__(self, limit = 2000):
-        dict.__init__(self)
+    Entries are kept in one least-recently-used list per key prefix so that
+    lookups, insertions and evictions are all constant time. Every entry is
+    stamped with a global access counter; when the cache as a whole is over
+    its limits the oldest tail among the per-prefix lists is evicted, which
+    gives global LRU order while still allowing per-prefix quotas.
+
+    @param limit: Maximum number of entries.
+    @param sizeLimit: Approximate maximum number of bytes held, or 0 for no
+    limit.
+    @param quotas: Optional dictionary mapping a key prefix (e.g. C{FPRINT})
+    to the maximum number of bytes entries with that prefix may use.
+    """
+
+    # node layout; nodes are plain lists to keep them cheap
+    PREV, NEXT, KEY, VALUE, EXPIRES, SIZE, STAMP = range(7)
+
+    def __init__(self, limit = 2000, sizeLimit = 0, quotas = None):
         self.limit = limit
+        self.sizeLimit = sizeLimit
+        self.quotas = dict(quotas or {})
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._map = {}
+        # key_prefix -> [ root node, bytes used ]
+        self._lists = {}
+        self._stamp = 0
+
+    def __len__(self):
+        return len(self._map)
+
+    def __contains__(self, key):
+        return key in self._map
+
+    def _getList(self, prefix):
+        lst = self._lists.get(prefix)
+        if lst is None:
+            root = [None] * 7
+            root[self.PREV] = root[self.NEXT] = root
+            lst = self._lists[prefix] = [ root, 0 ]
+        return lst
+
+    def _link(self, node, prefix):
+        self._stamp += 1
+        node[self.STAMP] = self._stamp
+        root = self._getList(prefix)[0]
+        first = root[self.NEXT]
+        node[self.PREV] = root
+        node[self.NEXT] = first
+        first[self.PREV] = node
+        root[self.NEXT] = node
+
+    def _unlink(self, node):
+        node[self.PREV][self.NEXT] = node[self.NEXT]
+        node[self.NEXT][self.PREV] = node[self.PREV]
+
+    def _remove(self, key):
+        node = self._map.pop(key)
+        self._unlink(node)
+        lst = self._lists[key[0]]
+        lst[1] -= node[self.SIZE]
+        self.size -= node[self.SIZE]
+
+    def _evictFrom(self, prefix):
+        root = self._lists[prefix][0]
+        node = root[self.PREV]
+        if node is root:
+            return False
+        self._remove(node[self.KEY])
+        self.evictions += 1
+        return True
+
+    def _evictOldest(self):
+        oldest = None
+        for prefix, (root, used) in self._lists.iteritems():
+            tail = root[self.PREV]
+            if tail is root:
+                continue
+            if oldest is None or tail[self.STAMP] < oldest[self.STAMP]:
+                oldest = tail
+        if oldest is None:
+            return False
+        self._remove(oldest[self.KEY])
+        self.evictions += 1
+        return True
 
     def get(self, key, key_prefix = None):
         key = (key_prefix, key)
-        val = dict.get(self, key, None)
-        if val is None:
+        node = self._map.get(key, None)
+        if node is None:
+            self.misses += 1
             return None
 
-        (val, expires) = val
-        if expires is None:
-            return val
-
-        if pytime.time() > expires:
-            del self[key]
+        expires = node[self.EXPIRES]
+        if expires is not None and pytime.time() > expires:
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
             return None
 
-        return val
+        self._unlink(node)
+        self._link(node, key_prefix)
+        self.hits += 1
+        return node[self.VALUE]
 
     def get_multi(self, keys, key_prefix = None):
         r = {}
@@ -71,27 +163,40 @@ class DumbCache(dict):
 
     def set(self, key, value, time = 0, key_prefix = None):
         key = (key_prefix, key)
+        if key in self._map:
+            self._remove(key)
+
         if time:
-            self[key] = (value, pytime.time() + time)
+            expires = pytime.time() + time
         else:
-            self[key] = (value, None)
-
-        if len(self) > self.limit:
-            self._shrink()
+            expires = None
+
+        size = _sizeOf(key) + _sizeOf(value)
+        node = [ None, None, key, value, expires, size, 0 ]
+        self._map[key] = node
+        self._link(node, key_prefix)
+        lst = self._lists[key_prefix]
+        lst[1] += size
+        self.size += size
+
+        quota = self.quotas.get(key_prefix)
+        if quota:
+            while lst[1] > quota and self._evictFrom(key_prefix):
+                pass
+
+        while ((len(self._map) > self.limit or
+                (self.sizeLimit and self.size > self.sizeLimit))
+                and self._evictOldest()):
+            pass
 
     def set_multi(self, items, time = 0, key_prefix = None):
         for key, val in items.iteritems():
             self.set(key, val, time = time, key_prefix = key_prefix)
 
-    def _shrink(self):
-        order = sorted((x for x in self.items() if x[1][1] is not None),
-                       lambda a, b: cmp(b[1][1], a[1][1]))
-        toRemove = order[0:self.limit / 10]
-        if (len(self) - len(toRemove)) > (self.limit * 0.95):
-            toRemove += [ x for x in self.items() ][0:self.limit / 10]
-
-        for x in toRemove:
-            del self[x[0]]
+    def delete(self, key, key_prefix = None):
+        key = (key_prefix, key)
+        if key in self._map:
+            self._remove(key)
 
     def incr(self, key, delta=1):
         val = self.get(key)
@@ -105,10 +210,39 @@ class DumbCache(dict):
         self.set(key, val)
         return val
 
+    def getStats(self):
+        """Return a dictionary of cache counters."""
+        return dict(entries=len(self._map), size=self.size, hits=self.hits,
+                misses=self.misses, evictions=self.evictions,
+                expirations=self.expirations)
+
+
+# Older name for the in-process cache
+DumbCache = LRUCache
+
+
+def _sizeOf(val):
+    """Cheap estimate of the memory used by a cached key or value."""
+    if isinstance(val, basestring):
+        return 40 + len(val)
+    if isinstance(val, (tuple, list)):
+        return 56 + 8 * len(val) + sum(_sizeOf(x) for x in val)
+    if isinstance(val, dict):
+        return 280 + sum(_sizeOf(x) + _sizeOf(y) for x, y in val.iteritems())
+    return 24
+
 
-def getCache(url):
+def getCache(url, limit = 2000, sizeLimit = 0, quotas = None):
     if url is None:
-        return DumbCache()
+        return LRUCache(limit = limit, sizeLimit = sizeLimit, quotas = quotas)
+
+    if url.startswith('shm:'):
+        # cache shared by all processes through a memory-mapped file; the
+        # file is split into "limit" slots of equal size
+        from conary.repository.netrepos import shmcache
+        slotSize = max((sizeLimit or 64000000) // limit, 1024)
+        return shmcache.getSharedMemoryCache(url[4:], slots = limit,
+                slotSize = slotSize)
 
     import memcache
     return memcache.Client([ url ])
@@ -15,10 +15,11 @@
 #
 
 
-import base64
+import itertools
 
 from conary import trove
 from conary.lib import sha1helper
+from conary.repository.netrepos import cache
 from conary.server import schema
 
 def _troveFp(troveTup, sig, meta):
@@ -30,10 +31,10 @@ def _troveFp(troveTup, sig, meta):
         (sigPresent, sigBlock) = sig
         l = []
         if sigPresent >= 1:
-            l.append(base64.decodestring(sigBlock))
+            l.append(sigBlock)
         (metaPresent, metaBlock) = meta
         if metaPresent >= 1:
-            l.append(base64.decodestring(metaBlock))
+            l.append(metaBlock)
         if sigPresent or metaPresent:
             t = tuple(l)
         else:
@@ -41,12 +42,90 @@ def _troveFp(troveTup, sig, meta):
 
     return sha1helper.sha1String("\0".join(t))
 
-def expandJobList(db, chgSetList, recurse):
+class FingerprintCache(object):
+    """
+    Process wide cache of the pieces change set fingerprints are built from:
+    the troves each job expands to and the L{_troveFp} digest of each trove
+    the caller can read.
+
+    Digests are stored with a stamp built from the database generations of
+    their item (see L{versionops.LatestTable}), which are bumped in the
+    same transaction that changes the signatures, metadata or presence of
+    a trove; a digest is only returned for the stamp it was stored with,
+    so no process hands out a digest after a change to it is committed.
+    Access is not part of the cache; callers only return digests of troves
+    batchCheck lets them read.
+
+    Job expansions have no such stamp. They are dropped when troves are
+    committed or made visible in this process, and never live longer than
+    C{expansionTimeout} seconds, so other processes find out as well.
+    """
+
+    # bumped when this process changes which troves are present
+    generation = 0
+    # lifetime of job expansions when C{timeout} is 0 (never expire)
+    expansionTimeout = 300
+
+    def __init__(self, limit = 50000, timeout = 0):
+        self.limit = limit
+        self.timeout = timeout
+        self._stamp = None
+        self._check()
+
+    @classmethod
+    def invalidate(cls):
+        cls.generation += 1
+
+    def _check(self):
+        stamp = FingerprintCache.generation
+        if stamp != self._stamp:
+            self.expansions = cache.LRUCache(limit = self.limit)
+            self.troveFps = cache.LRUCache(limit = self.limit)
+            self._stamp = stamp
+
+    def getExpansions(self, keyList):
+        self._check()
+        return [ self.expansions.get(x) for x in keyList ]
+
+    def setExpansion(self, key, expansion):
+        self.expansions.set(key, expansion,
+                            time = self.timeout or self.expansionTimeout)
+
+    def getTroveFps(self, troveList, stamps):
+        """
+        Return the digests cached for the troves in C{troveList}, or None
+        for troves which are not cached or were cached under a different
+        stamp than the one at the same position of C{stamps}.
+        """
+        self._check()
+        r = []
+        for troveTup, stamp in itertools.izip(troveList, stamps):
+            entry = self.troveFps.get(troveTup)
+            if entry is not None and entry[0] == stamp:
+                r.append(entry[1])
+            else:
+                r.append(None)
+        return r
+
+    def setTroveFp(self, troveTup, fp, stamp):
+        self.troveFps.set(troveTup, (stamp, fp), time = self.timeout)
+
+    def forgetTroves(self, troveList):
+        for troveTup in troveList:
+            self.troveFps.delete(tuple(troveTup))
+
+# marks an uncachable job in FingerprintCache.expansions
+_UNCACHABLE = 'uncachable'
+
+def expandJobList(db, chgSetList, recurse, fpCache = None):
     """
     For each job in the list, find the set of troves which are recursively
     included in it. The reutnr value is list parallel to chgSetList, each
     item of which is a sorted list of those troves which are included in the
     recursive changeset.
+
+    @param fpCache: cache to look up and remember expansions in
+    @type fpCache: FingerprintCache
     """
     # We mark old groups (ones without weak references) as uncachable
     # because they're expensive to flatten (and so old that it
@@ -55,6 +134,34 @@ def expandJobList(db, chgSetList, recurse):
     if not recurse:
         return [ [ job ] for job in chgSetList ]
 
+    if fpCache is None:
+        return _expandJobList(db, chgSetList)
+
+    keyList = [ (job[0], job[2][0], job[2][1]) for job in chgSetList ]
+    newJobList = [ None ] * len(chgSetList)
+    missing = []
+    for idx, (job, expansion) in enumerate(
+                zip(chgSetList, fpCache.getExpansions(keyList))):
+        if expansion is None:
+            missing.append(idx)
+        elif expansion != _UNCACHABLE:
+            newJobList[idx] = [ job ] + [
+                        (name, (None, None), (version, flavor), True)
+                        for (name, version, flavor) in expansion ]
+
+    if missing:
+        expanded = _expandJobList(db, [ chgSetList[x] for x in missing ])
+        for idx, fullJob in zip(missing, expanded):
+            newJobList[idx] = fullJob
+            if fullJob is None:
+                fpCache.setExpansion(keyList[idx], _UNCACHABLE)
+            else:
+                fpCache.setExpansion(keyList[idx],
+                        tuple((x[0], x[2][0], x[2][1]) for x in fullJob[1:]))
+
+    return newJobList
+
+def _expandJobList(db, chgSetList):
     cu = db.cursor()
     schema.resetTable(cu, "tmpNVF")
 
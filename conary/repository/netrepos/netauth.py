@@ -28,7 +28,7 @@ from conary.repository import errors
 from conary.lib import digestlib, sha1helper, tracelog
 from conary.dbstore import sqlerrors
 from conary.server.schema import resetTable
-from . import items, accessmap, geoip
+from . import items, accessmap, cache, geoip
 from .auth_tokens import AuthToken, ValidUser, ValidPasswordToken
 
 log = logging.getLogger(__name__)
@@ -312,6 +312,13 @@ class EntitlementAuthorization:
         return roleIds
 
 class NetworkAuthorization:
+
+    # batchCheck results which granted access, shared by every instance in
+    # the process; see _getCheckCache()
+    checkCache = None
+    checkCacheGeneration = None
+    checkCacheLimit = 50000
+
     def __init__(self, db, serverNameList, cacheTimeout = None, log = None,
             passwordURL=None, entCheckURL=None, geoIpFiles=None):
         """
@@ -327,6 +334,7 @@ class NetworkAuthorization:
         """
         self.serverNameList = serverNameList
         self.db = db
+        self.cacheTimeout = cacheTimeout
         self.log = log or tracelog.getLog(None)
         self.userAuth = UserAuthorization(
             self.db, passwordURL, cacheTimeout = cacheTimeout)
@@ -392,6 +400,28 @@ class NetworkAuthorization:
                 continue
         return flags
 
+    def _getCheckCache(self, cu):
+        """
+        Return the process wide cache of granted batchCheck results, or
+        None if authorization caching is disabled. Changes which can take
+        access away bump a generation stored in the database in the same
+        transaction (see L{accessmap.RoleInstances.invalidate}); the cache
+        is emptied whenever the committed generation differs from the one
+        it was filled under, in this process or any other.
+        """
+        if not self.cacheTimeout:
+            return None
+
+        cls = NetworkAuthorization
+        generation = self.ri.getGeneration(cu)
+        if generation is None:
+            # the schema predates generations
+            return None
+        if cls.checkCache is None or cls.checkCacheGeneration != generation:
+            cls.checkCache = cache.LRUCache(limit = cls.checkCacheLimit)
+            cls.checkCacheGeneration = generation
+        return cls.checkCache
+
     def batchCheck(self, authToken, troveList, write = False, cu = None):
         """ checks access permissions for a set of *existing* troves in the repository """
         # troveTupList is a list of (name, VFS) tuples
@@ -417,10 +447,30 @@ class NetworkAuthorization:
             return retlist
         if not len(groupIds):
             return retlist
+
+        # callers rely on tmpNVF holding the whole list afterwards, so it
+        # is loaded even when every answer comes from the cache
         resetTable(cu, "tmpNVF")
         self.db.bulkload("tmpNVF", checkList, ["idx","name","version", "flavor"],
                          start_transaction=False)
         self.db.analyze("tmpNVF")
+
+        # only granted access is cached; a trove which is missing or hidden
+        # now may become visible with the next commit
+        checkCache = self._getCheckCache(cu)
+        if checkCache is not None:
+            cachePrefix = (tuple(self.serverNameList), frozenset(groupIds),
+                           bool(write))
+            uncached = []
+            for item in checkList:
+                if checkCache.get(cachePrefix + item[1:]):
+                    retlist[item[0]] = True
+                else:
+                    uncached.append(item)
+            if not uncached:
+                return retlist
+            checkList = uncached
+
         writeCheck = ''
         if write:
             writeCheck = "and ugi.canWrite = 1"
@@ -439,6 +489,12 @@ class NetworkAuthorization:
         %s""" % (",".join("%d" % x for x in groupIds), writeCheck) )
         for i, instanceId in cu:
             retlist[i] = True
+
+        if checkCache is not None:
+            for item in checkList:
+                if retlist[item[0]]:
+                    checkCache.set(cachePrefix + item[1:], True,
+                                   time = self.cacheTimeout)
         return retlist
 
     def commitCheck(self, authToken, nameVersionList):
@@ -970,6 +1026,7 @@ class NetworkAuthorization:
                    roleId)
         cu.execute("DELETE FROM UserGroupTroves WHERE userGroupId = ?", roleId)
         cu.execute("DELETE FROM LatestCache WHERE userGroupId = ?", roleId)
+        self.ri.latest.invalidateAll(cu)
         #Note, there could be a user left behind with no associated group
         #if the group being deleted was created with a user.  This user is not
         #deleted because it is possible for this user to be a member of
@@ -1307,6 +1364,7 @@ class NetworkAuthorization:
             args.append(role)
             cu.execute("""UPDATE UserGroups SET accept_flags = ?,
                     filter_flags = ? WHERE userGroup = ?""", args)
+        self.ri.invalidate(cu)
         self.db.commit()
 
 
@@ -32,14 +32,14 @@ from conary.deps import deps
 from conary.lib import log, tracelog, sha1helper, util
 from conary.lib.cfg import ConfigFile
 from conary.lib.cfgtypes import (CfgInt, CfgString, CfgPath, CfgBool, CfgList,
-        CfgLineList)
+        CfgLineList, CfgDict, CfgBytes)
 from conary.repository import changeset, errors, xmlshims
 from conary.repository.netrepos import fsrepos, instances, trovestore
-from conary.repository.netrepos import accessmap, deptable, fingerprints
+from conary.repository.netrepos import accessmap, cache, deptable, fingerprints
 from conary.lib.openpgpfile import KeyNotFound
 from conary.repository.netrepos.netauth import NetworkAuthorization
 from conary.repository.netclient import TROVE_QUERY_ALL, TROVE_QUERY_PRESENT, \
-                                        TROVE_QUERY_NORMAL
+                                        TROVE_QUERY_NORMAL, BINARY_RPC_VERSION
 from conary.repository.netrepos import reposlog
 from conary.repository.netrepos.repo_cfg import GlobListType, CfgContentStore
 from conary import dbstore
@@ -52,7 +52,7 @@ from conary.errors import InvalidRegex
 # one in the list is the lowest protocol version we support and th
 # last one is the current server protocol version. Remember that range stops
 # at MAX - 1
-SERVER_VERSIONS = range(36, 73 + 1)
+SERVER_VERSIONS = range(36, 75 + 1)
 
 # We need to provide transitions from VALUE to KEY, we cache them as we go
 
@@ -116,6 +116,12 @@ class NetworkRepositoryServer(xmlshims.NetworkConvertors):
     _GET_TROVE_BEST_FLAVOR      = 3     # the best flavor for flavorFilter
     _GET_TROVE_ALLOWED_FLAVOR   = 4     # all flavors which are legal
 
+    # shared by every server instance in the process; see
+    # _getFingerprintCache()
+    fingerprintCache = None
+    # shared by every server instance in the process; see _getLeafCache()
+    leafCache = None
+
     def __init__(self, cfg, basicUrl, db = None):
         # this is a bit of a hack to determine if we're running
         # as a standalone server or not without having to touch
@@ -137,6 +143,12 @@ class NetworkRepositoryServer(xmlshims.NetworkConvertors):
         self.repDB = cfg.repositoryDB
         self.contentsDir = cfg.contentsDir
         self.authCacheTimeout = cfg.authCacheTimeout
+        self.memCacheTimeout = cfg.memCacheTimeout
+        self.leafCacheLimit = cfg.leafCacheLimit
+        # changes the fingerprint cache is told about once the current
+        # call commits; see _updateFingerprintCache()
+        self.changedTroves = []
+        self.changedPresence = False
         self.externalPasswordURL = cfg.externalPasswordURL
         self.entitlementCheckURL = cfg.entitlementCheckURL
         self.readOnlyRepository = cfg.readOnlyRepository
@@ -280,6 +292,8 @@ class NetworkRepositoryServer(xmlshims.NetworkConvertors):
 
         exceptionOverride = None
         start = time.time()
+        self.changedTroves = []
+        self.changedPresence = False
         try:
             r = self._callWrapper(method, authToken, orderedArgs, kwArgs)
             if self.db.inTransaction(default=True):
@@ -291,6 +305,7 @@ class NetworkRepositoryServer(xmlshims.NetworkConvertors):
             if self.db.inTransaction(default=True):
                 self.db.rollback()
         else:
+            self._updateFingerprintCache()
             if self.callLog:
                 self.callLog.log(remoteIp, authToken, methodname,
                                  orderedArgs, kwArgs,
@@ -828,8 +843,6 @@ class NetworkRepositoryServer(xmlshims.NetworkConvertors):
                       troveTypes = TROVE_QUERY_PRESENT):
         self.log(3, versionType, latestFilter, flavorFilter)
         cu = self.db.cursor()
-        singleVersionSpec = None
-        dropTroveTable = False
 
         assert(versionType == self._GTL_VERSION_TYPE_NONE or
                versionType == self._GTL_VERSION_TYPE_BRANCH or
@@ -841,6 +854,24 @@ class NetworkRepositoryServer(xmlshims.NetworkConvertors):
         if not roleIds:
             return {}
 
+        if (latestFilter == self._GET_TROVE_VERY_LATEST and
+                flavorFilter == self._GET_TROVE_ALL_FLAVORS and withFlavors and
+                self._isLeafCacheable(troveSpecs, versionType)):
+            leafCache = self._getLeafCache()
+            if leafCache is not None:
+                return self._getCachedLeaves(cu, leafCache, roleIds,
+                                             troveSpecs, versionType,
+                                             troveTypes)
+
+        return self._queryTroveList(cu, roleIds, troveSpecs, versionType,
+                                    latestFilter, flavorFilter, withFlavors,
+                                    troveTypes)
+
+    def _queryTroveList(self, cu, roleIds, troveSpecs, versionType,
+                        latestFilter, flavorFilter, withFlavors, troveTypes):
+        singleVersionSpec = None
+        dropTroveTable = False
+
         flavorIndices = {}
         if troveSpecs:
             # populate flavorIndices with all of the flavor lookups we
@@ -1148,6 +1179,115 @@ class NetworkRepositoryServer(xmlshims.NetworkConvertors):
         self.log(4, "processed troveVersions")
         return troveVersions
 
+    def _getLeafCache(self):
+        """
+        Return the process wide cache of leaf query results, or None when
+        leafCacheLimit disables it or the repository schema predates the
+        LatestCache generations it relies on.
+        """
+        if self.leafCacheLimit <= 0 or not self.troveStore.latest.generations:
+            return None
+
+        cls = NetworkRepositoryServer
+        if cls.leafCache is None:
+            cls.leafCache = cache.LRUCache(limit = self.leafCacheLimit)
+        return cls.leafCache
+
+    def _isLeafCacheable(self, troveSpecs, versionType):
+        # only leaves of named troves, without flavor filters, by label,
+        # by branch or across all branches are cached
+        if not troveSpecs or None in troveSpecs:
+            return False
+        if versionType == self._GTL_VERSION_TYPE_VERSION:
+            return False
+        for versionDict in troveSpecs.itervalues():
+            if type(versionDict) is not dict:
+                return False
+            for versionSpec, flavorList in versionDict.iteritems():
+                if flavorList is not None:
+                    return False
+                if ((versionSpec is None) !=
+                        (versionType == self._GTL_VERSION_TYPE_NONE)):
+                    return False
+        return True
+
+    def _getCachedLeaves(self, cu, leafCache, roleIds, troveSpecs,
+                         versionType, troveTypes):
+        """
+        Answer a leaf query from the process wide leaf cache, querying the
+        database only for the (name, version spec) pairs which are missing
+        from it or out of date.
+
+        Entries are stamped with the LatestCache generations of their item
+        as they were before the query ran. Every LatestCache update bumps
+        those generations in the database, so an entry stays valid until
+        any process commits a change to the leaves of that item.
+        """
+        allGeneration, generations = \
+                self.troveStore.latest.getGenerations(cu, troveSpecs)
+        roleKey = tuple(sorted(roleIds))
+
+        troveVersions = {}
+        missing = {}
+        for troveName, versionDict in troveSpecs.iteritems():
+            stamp = (allGeneration, generations.get(troveName))
+            for versionSpec in versionDict:
+                entry = leafCache.get((roleKey, troveTypes, versionType,
+                                       troveName, versionSpec))
+                if entry is not None and entry[0] == stamp:
+                    self._mergeLeaves(troveVersions, troveName, entry[1])
+                else:
+                    missing.setdefault(troveName, {})[versionSpec] = None
+
+        if not missing:
+            return troveVersions
+
+        self.log(3, "leaf cache misses", len(missing))
+        found = self._queryTroveList(cu, roleIds, missing, versionType,
+                                     self._GET_TROVE_VERY_LATEST,
+                                     self._GET_TROVE_ALL_FLAVORS, True,
+                                     troveTypes)
+        for troveName, versionDict in missing.iteritems():
+            leaves = found.get(troveName, {})
+            self._mergeLeaves(troveVersions, troveName, leaves)
+            bySpec = self._splitLeaves(leaves, versionDict, versionType)
+            if bySpec is None:
+                continue
+            stamp = (allGeneration, generations.get(troveName))
+            for versionSpec, specLeaves in bySpec.iteritems():
+                leafCache.set((roleKey, troveTypes, versionType, troveName,
+                               versionSpec), (stamp, specLeaves))
+
+        return troveVersions
+
+    def _splitLeaves(self, leaves, versionDict, versionType):
+        # each branch maps to a single label, so the leaves found for
+        # several version specs at once can be told apart by the branch
+        # or label of their versions
+        if len(versionDict) == 1:
+            return { versionDict.keys()[0] : leaves }
+
+        bySpec = dict((x, {}) for x in versionDict)
+        for version, flavorList in leaves.iteritems():
+            branch = versions.ThawVersion(version).branch()
+            if versionType == self._GTL_VERSION_TYPE_LABEL:
+                versionSpec = branch.label().asString()
+            else:
+                versionSpec = branch.asString()
+            if versionSpec not in bySpec:
+                return None
+            bySpec[versionSpec][version] = flavorList
+        return bySpec
+
+    @staticmethod
+    def _mergeLeaves(troveVersions, troveName, leaves):
+        # cached lists are shared, so copy them into the result
+        if not leaves:
+            return
+        d = troveVersions.setdefault(troveName, {})
+        for version, flavorList in leaves.iteritems():
+            d.setdefault(version, []).extend(flavorList)
+
     @accessReadOnly
     def troveNames(self, authToken, clientVersion, labelStr,
                    troveTypes = TROVE_QUERY_ALL):
@@ -1617,6 +1757,41 @@ class NetworkRepositoryServer(xmlshims.NetworkConvertors):
 
         return url, rc
 
+    def _troveInfoChanged(self, cu, troveList):
+        """
+        Note that the signatures or metadata of the (name, version, flavor)
+        string tuples in C{troveList} are being changed by the current
+        transaction.
+        """
+        self.troveStore.latest.invalidateItems(cu, [ x[0] for x in troveList ])
+        self.changedTroves.extend(tuple(x) for x in troveList)
+
+    def _updateFingerprintCache(self):
+        # called once the changes are committed, so nothing can be cached
+        # again from the old state; the database generations already keep
+        # every process from using the digests of changed troves, so
+        # forgetting them only frees the memory
+        if self.changedPresence:
+            fingerprints.FingerprintCache.invalidate()
+        if self.changedTroves and self.fingerprintCache is not None:
+            self.fingerprintCache.forgetTroves(self.changedTroves)
+        self.changedTroves = []
+        self.changedPresence = False
+
+    def _getFingerprintCache(self):
+        """
+        Return the process wide fingerprints.FingerprintCache, or None
+        when memCacheTimeout disables caching.
+        """
+        if self.memCacheTimeout < 0:
+            return None
+
+        cls = NetworkRepositoryServer
+        if cls.fingerprintCache is None:
+            cls.fingerprintCache = fingerprints.FingerprintCache(
+                                        timeout = self.memCacheTimeout)
+        return cls.fingerprintCache
+
     @accessReadOnly
     def getChangeSetFingerprints(self, authToken, clientVersion, chgSetList,
                     recurse, withFiles, withFileContents, excludeAutoSource,
@@ -1628,7 +1803,9 @@ class NetworkRepositoryServer(xmlshims.NetworkConvertors):
         merge relative changesets against old troves stored in their databases!
         """
 
-        newJobList = fingerprints.expandJobList(self.db, chgSetList, recurse)
+        fpCache = self._getFingerprintCache()
+        newJobList = fingerprints.expandJobList(self.db, chgSetList, recurse,
+                                                fpCache = fpCache)
         sigItems = []
 
         for fullJob in newJobList:
@@ -1642,23 +1819,56 @@ class NetworkRepositoryServer(xmlshims.NetworkConvertors):
                 else:
                     sigItems.append(None)
 
-        pureSigList = self.getTroveInfo(authToken, SERVER_VERSIONS[-1],
-                                        trove._TROVEINFO_TAG_SIGS,
-                                        [ x for x in sigItems if x ])
-        pureMetaList = self.getTroveInfo(authToken, SERVER_VERSIONS[-1],
-                                        trove._TROVEINFO_TAG_METADATA,
-                                        [ x for x in sigItems if x ])
-        sigList = []
-        metaList = []
-        sigCount = 0
+        localItems = [ x for x in sigItems if x ]
+        localFps = [ None ] * len(localItems)
+        stamps = None
+        if fpCache is not None and localItems:
+            allGeneration, generations = self.troveStore.latest.getGenerations(
+                    self.db.cursor(), set(x[0] for x in localItems))
+            if allGeneration is not None:
+                stamps = [ (allGeneration, generations.get(x[0]))
+                           for x in localItems ]
+        if stamps is not None:
+            # cached digests are only handed to callers who can read the
+            # trove; everyone else gets the digest of a missing trove, which
+            # is what getTroveInfo() would have led to
+            needed = []
+            access = self.auth.batchCheck(authToken, localItems)
+            for i, (item, canRead, fp) in enumerate(itertools.izip(
+                        localItems, access,
+                        fpCache.getTroveFps(localItems, stamps))):
+                if not canRead:
+                    localFps[i] = fingerprints._troveFp(item, (-1, ''),
+                                                        (-1, ''))
+                elif fp is not None:
+                    localFps[i] = fp
+                else:
+                    needed.append(i)
+        else:
+            needed = range(len(localItems))
+
+        if needed:
+            neededItems = [ localItems[i] for i in needed ]
+            pureSigList = self.getTroveInfo(authToken, SERVER_VERSIONS[-1],
+                                            trove._TROVEINFO_TAG_SIGS,
+                                            neededItems)
+            pureMetaList = self.getTroveInfo(authToken, SERVER_VERSIONS[-1],
+                                            trove._TROVEINFO_TAG_METADATA,
+                                            neededItems)
+            for i, sig, meta in itertools.izip(needed, pureSigList,
+                                               pureMetaList):
+                fp = fingerprints._troveFp(localItems[i], sig, meta)
+                localFps[i] = fp
+                if stamps is not None and sig[0] >= 0 and meta[0] >= 0:
+                    fpCache.setTroveFp(localItems[i], fp, stamps[i])
+
+        troveFps = []
+        localFps = iter(localFps)
         for item in sigItems:
-            if not item:
-                sigList.append(None)
-                metaList.append(None)
+            if item:
+                troveFps.append(localFps.next())
             else:
-                sigList.append(pureSigList[sigCount])
-                metaList.append(pureMetaList[sigCount])
-                sigCount += 1
+                troveFps.append(None)
 
         # 0 is a version number for this signature block; changing this will
         # invalidate all change set signatures downstream
@@ -1683,9 +1893,9 @@ class NetworkRepositoryServer(xmlshims.NetworkConvertors):
                     troveTup = (job[0], job[1][0], job[1][1])
                     fpList.append(fingerprints._troveFp(troveTup, None, None))
 
-                fp = fingerprints._troveFp(sigItems[sigCount],
-                                        sigList[sigCount],
-                                        metaList[sigCount])
+                fp = troveFps[sigCount]
+                if fp is None:
+                    fp = fingerprints._troveFp(sigItems[sigCount], None, None)
                 sigCount += 1
 
                 fpList.append(fp)
@@ -1779,6 +1989,7 @@ class NetworkRepositoryServer(xmlshims.NetworkConvertors):
             raise errors.InsufficientPermission
 
         self.repos.troveStore.presentHiddenTroves()
+        self.changedPresence = True
 
         return ''
 
@@ -1870,6 +2081,7 @@ class NetworkRepositoryServer(xmlshims.NetworkConvertors):
                                    hidden = hidden,
                                    serialize = self.serializeCommits,
                                    statusPath=statusPath)
+        fingerprints.FingerprintCache.invalidate()
 
         if not self.commitAction:
             return True
@@ -2011,7 +2223,9 @@ class NetworkRepositoryServer(xmlshims.NetworkConvertors):
             # the file object; we should just pass the stream back and
             # let the client set it to avoid sending it back and forth
             # for no particularly good reason
-            streamMap[i] = self.fromFileAsStream(pathId, stream, rawPathId = True)
+            streamMap[i] = self.fromFileAsStream(pathId, stream,
+                    rawPathId = True,
+                    rawStream = clientVersion >= BINARY_RPC_VERSION)
         return streamMap
 
     @accessReadOnly
@@ -2021,7 +2235,7 @@ class NetworkRepositoryServer(xmlshims.NetworkConvertors):
         assert(not withContents)
         self.log(2, pathId, fileId, "withContents=%s" % (withContents,))
         # getFileVersions is responsible for authenticating this call
-        l = self.getFileVersions(authToken, SERVER_VERSIONS[-1],
+        l = self.getFileVersions(authToken, clientVersion,
                                  [ (pathId, fileId) ])
         assert(len(l) == 1)
         return l[0]
@@ -2397,7 +2611,7 @@ class NetworkRepositoryServer(xmlshims.NetworkConvertors):
             n,v,f = itemList[missing[0]][0]
             raise errors.TroveMissing(n, v)
         for (troveTup, item), (presence, existing) in itertools.izip(itemList, metadata):
-            m = trove.Metadata(base64.decodestring(existing))
+            m = trove.Metadata(existing)
             mi = trove.MetadataItem(base64.b64decode(item))
             # don't allow items which don't have digests
             if not list(itertools.chain(mi.oldSignatures, mi.signatures)):
@@ -2463,6 +2677,8 @@ class NetworkRepositoryServer(xmlshims.NetworkConvertors):
         if not ret:
             raise errors.TroveMissing(name, version)
         instanceId = ret[0]
+        self._troveInfoChanged(cu,
+                [ (name, version.asString(), flavor.freeze()) ])
         # try to create a row lock for the signature record if needed
         cu.execute("UPDATE TroveInfo SET changed = changed "
                    "WHERE instanceId = ? AND infoType = ?",
@@ -2772,6 +2988,7 @@ class NetworkRepositoryServer(xmlshims.NetworkConvertors):
         if False in self.auth.batchCheck(authToken, [t for t,s in infoList],
                                          write=True, cu = cu):
             raise errors.InsufficientPermission
+        self._troveInfoChanged(cu, [ t for t,s in infoList ])
 
         # look up if we have all the troves we're asked
         schema.resetTable(cu, "tmpInstanceId")
@@ -3224,7 +3441,11 @@ class NetworkRepositoryServer(xmlshims.NetworkConvertors):
                 md.thaw(data)
                 data = md.freeze(skipSet = trove.TroveInfo._newMetadataItems)
 
-            ret[i] = (1, base64.encodestring(data))
+            if clientVersion < BINARY_RPC_VERSION:
+                # newer clients use the binary RPC encoding, which carries
+                # the frozen stream as it is
+                data = base64.encodestring(data)
+            ret[i] = (1, data)
         return ret
 
     @accessReadOnly
@@ -3360,6 +3581,50 @@ class NetworkRepositoryServer(xmlshims.NetworkConvertors):
                 ret[i].append((verStr,flavStr))
         return ret
 
+    @accessReadOnly
+    @requireClientProtocol(75)
+    def multiCall(self, authToken, clientVersion, calls):
+        """
+        Run a batch of read-only calls in one database transaction.
+
+        @param calls: list of (methodname, args, kwargs) tuples; every call
+        is made with the clientVersion of the batch.
+        @return: the (isException, result) response of each call, in order.
+        Marshallable exceptions are returned for the call which raised them,
+        anything else fails the whole batch.
+        """
+        self.log(2, authToken[0], "calls=%d" % len(calls))
+        results = []
+        for methodname, args, kwargs in calls:
+            try:
+                if methodname not in self.publicCalls or \
+                        methodname in ('multiCall', 'checkVersion'):
+                    raise errors.MethodNotSupported(methodname)
+                method = self.__getattribute__(methodname)
+                if method._accessType != 'readOnly':
+                    raise errors.MethodNotSupported(methodname)
+                if (hasattr(method, '_minimumClientProtocol') and
+                        method._minimumClientProtocol > clientVersion):
+                    raise errors.InvalidClientVersion(
+                            '%s call only supports protocol versions %s '
+                            'and later' % (methodname,
+                                           method._minimumClientProtocol))
+                r = method(authToken, clientVersion, *args, **kwargs)
+                response = xmlshims.ResponseArgs.newResult(r)
+            except sqlerrors.DatabaseLocked:
+                # let _callWrapper retry the whole batch
+                raise
+            except Exception, e:
+                if isinstance(e, HiddenException):
+                    e = e.forReturn
+                if not hasattr(e, 'marshall'):
+                    raise
+                excArgs, excKwArgs = e.marshall(self)
+                response = xmlshims.ResponseArgs.newException(
+                        e.__class__.__name__, excArgs, excKwArgs)
+            results.append(response.toWire(clientVersion)[0])
+        return results
+
     @accessReadOnly
     def checkVersion(self, authToken, clientVersion):
         """
@@ -3432,6 +3697,9 @@ class ServerConfig(ConfigFile):
     memCacheUserAuth        = (CfgBool, True)
     memCacheTimeout         = (CfgInt, -1)
     memCachePrefix          = CfgString
+    memCacheLimit           = (CfgInt, 2000)
+    memCacheSizeLimit       = (CfgBytes('M'), 64000000)
+    memCacheQuota           = CfgDict(CfgBytes('M'))
     changesetCacheDir       = CfgPath
     changesetCacheLogFile   = CfgPath
     commitAction            = CfgString
@@ -3442,6 +3710,7 @@ class ServerConfig(ConfigFile):
     externalPasswordURL     = CfgString
     forceSSL                = CfgBool
     geoIpFiles              = CfgList(CfgPath)
+    leafCacheLimit          = (CfgInt, 10000)
     logFile                 = CfgPath
     proxy                   = (CfgProxy, None)
     conaryProxy             = (CfgProxy, None)
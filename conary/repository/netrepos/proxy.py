@@ -102,7 +102,8 @@ class ProxyCaller:
         """Call a remote server method using request/response objects."""
         rawRequest = request.toWire()
         try:
-            rawResponse = self.proxy._request(methodname, rawRequest)
+            rawResponse = self.proxy._request(methodname, rawRequest,
+                    binary=request.version >= netclient.BINARY_RPC_VERSION)
         except IOError, e:
             raise errors.ProxyError(e.strerror)
         except http_error.ResponseError, e:
@@ -377,45 +378,50 @@ class BaseProxy(xmlshims.NetworkConvertors):
 
             response = self.responseFilter.newResult(r)
             extraInfo = caller.getExtraInfo()
-        except ProxyRepositoryError, e:
-            response = self.responseFilter.newException(e.name, e.args,
-                    e.kwArgs)
         except Exception, e:
-            if hasattr(e, 'marshall'):
-                args, kwArgs = e.marshall(self)
-                response = self.responseFilter.newException(
-                        e.__class__.__name__, args, kwArgs)
-            else:
-                for klass, marshall in errors.simpleExceptions:
-                    if isinstance(e, klass):
-                        response = self.responseFilter.newException(
-                                marshall, (str(e),))
-                        break
-
-                if not response:
-                    # this exception is not marshalled back to the client.
-                    # re-raise it now.  comment the next line out to fall into
-                    # the debugger
-                    raise
+            response = self._marshallException(e)
+            if not response:
+                # this exception is not marshalled back to the client.
+                # re-raise it now.  comment the next line out to fall into
+                # the debugger
+                raise
 
-                    # uncomment the next line to translate exceptions into
-                    # nicer errors for the client.
-                    #return (True, ("Unknown Exception", str(e)))
-
-                    # fall-through to debug this exception - this code should
-                    # not run on production servers
-                    import traceback, sys
-                    from conary.lib import debugger
-                    excInfo = sys.exc_info()
-                    lines = traceback.format_exception(*excInfo)
-                    print "".join(lines)
-                    if 1 or sys.stdout.isatty() and sys.stdin.isatty():
-                        debugger.post_mortem(excInfo[2])
-                    raise
+                # uncomment the next line to translate exceptions into
+                # nicer errors for the client.
+                #return (True, ("Unknown Exception", str(e)))
+
+                # fall-through to debug this exception - this code should
+                # not run on production servers
+                import traceback, sys
+                from conary.lib import debugger
+                excInfo = sys.exc_info()
+                lines = traceback.format_exception(*excInfo)
+                print "".join(lines)
+                if 1 or sys.stdout.isatty() and sys.stdin.isatty():
+                    debugger.post_mortem(excInfo[2])
+                raise
 
         del self._serverName
         return response, extraInfo
 
+    def _marshallException(self, e):
+        """
+        Return the response for an exception which can be passed back to the
+        client, or C{None} if it can't be.
+        """
+        if isinstance(e, ProxyRepositoryError):
+            return self.responseFilter.newException(e.name, e.args,
+                    e.kwArgs)
+        if hasattr(e, 'marshall'):
+            args, kwArgs = e.marshall(self)
+            return self.responseFilter.newException(
+                    e.__class__.__name__, args, kwArgs)
+        for klass, marshall in errors.simpleExceptions:
+            if isinstance(e, klass):
+                return self.responseFilter.newException(
+                        marshall, (str(e),))
+        return None
+
     def setBaseUrlOverride(self, rawUrl, headers, isSecure):
         if not rawUrl:
             return
@@ -456,6 +462,41 @@ class BaseProxy(xmlshims.NetworkConvertors):
 
         return commonVersions
 
+    def multiCall(self, caller, authToken, clientVersion, calls):
+        # Calls with special handling at this level are run here one by one,
+        # everything else goes to the next server as a single batch.
+        results = [ None ] * len(calls)
+        forward = []
+        for i, (methodname, args, kwargs) in enumerate(calls):
+            if (methodname in ('multiCall', 'checkVersion')
+                    or methodname not in self.publicCalls
+                    or not self._callsLocally(methodname)):
+                forward.append(i)
+                continue
+            method = self.__getattribute__(methodname)
+            try:
+                r = method(caller, authToken, clientVersion, *args, **kwargs)
+                response = self.responseFilter.newResult(r)
+            except Exception, e:
+                response = self._marshallException(e)
+                if not response:
+                    raise
+            results[i] = response.toWire(clientVersion)[0]
+
+        if forward:
+            forwarded = caller.multiCall(clientVersion,
+                    [ calls[i] for i in forward ])
+            for i, result in itertools.izip(forward, forwarded):
+                results[i] = result
+        return results
+
+    def _callsLocally(self, methodname):
+        """
+        Return True if methodname needs its special handling at this level
+        when it is part of a multiCall batch.
+        """
+        return hasattr(self, methodname)
+
     def getContentsStore(self):
         return None
 
@@ -980,7 +1021,8 @@ class ChangesetFilter(BaseProxy):
             headers = [('X-Conary-Servername', self._serverName)]
             try:
                 inF = transport.ConaryURLOpener(proxyMap=self.proxyMap
-                        ).open(url, forceProxy=forceProxy, headers=headers)
+                        ).openResumable(url, forceProxy=forceProxy,
+                                headers=headers)
             except transport.TransportError, e:
                 raise errors.RepositoryError(str(e))
 
@@ -1071,7 +1113,10 @@ class Memcache(object):
         self.memCachePrefix = cfg.memCachePrefix
 
         if self.memCacheTimeout >= 0:
-            self.memCache = cache.getCache(self.memCacheLocation)
+            self.memCache = cache.getCache(self.memCacheLocation,
+                    limit = cfg.memCacheLimit,
+                    sizeLimit = cfg.memCacheSizeLimit,
+                    quotas = cfg.memCacheQuota)
         else:
             self.memCache = cache.EmptyCache()
 
@@ -1153,12 +1198,25 @@ class Memcache(object):
 
     def getTroveInfo(self, caller, authToken, clientVersion, infoType,
                      troveList):
+        if clientVersion < netclient.BINARY_RPC_VERSION:
+            keyPrefix = "TROVEINFO"
+        else:
+            # the data isn't base64 encoded for these clients
+            keyPrefix = "TROVEINFO-RAW"
         return self._coalesce(authToken,
                 lambda nTroveList, nInfoType:
                         caller.getTroveInfo(clientVersion, nInfoType,
                                             nTroveList),
                 troveList, infoType,
-                key_prefix = "TROVEINFO")
+                key_prefix = keyPrefix)
+
+    def _callsLocally(self, methodname):
+        if (methodname in ('getDepsForTroveList', 'getTroveInfo') and
+                isinstance(self.memCache, cache.EmptyCache)):
+            # nothing would be cached, so these go on with the rest of the
+            # batch
+            return False
+        return hasattr(self, methodname)
 
     def pokeCounter(self, name, delta):
         if not delta:
@@ -1254,8 +1312,9 @@ class FileCachingChangesetFilter(BaseCachingChangesetFilter):
             os.close(fd)
             os.unlink(tmpPath)
             headers = [('X-Conary-Servername', self._serverName)]
-            inUrl = transport.ConaryURLOpener(proxyMap=self.proxyMap).open(url,
-                    forceProxy=forceProxy, headers=headers)
+            inUrl = transport.ConaryURLOpener(proxyMap=self.proxyMap
+                    ).openResumable(url, forceProxy=forceProxy,
+                            headers=headers)
             size = util.copyfileobj(inUrl, dest)
             inUrl.close()
             dest.seek(0)
@@ -1555,77 +1614,232 @@ class ChangesetProducer(object):
     """
     Transform a changeset manifest (something.cf-out) into an iterable stream
     of bytes.
+
+    Output which was not completely produced is kept so the download can be
+    resumed, but only until it has gone unused for C{keepTime} seconds.
+    After that it can't be resumed any more, and L{sweep}, which producers
+    run on their directory every C{sweepInterval} seconds, removes it.
     """
 
+    # seconds an interrupted download can be resumed for
+    keepTime = 6 * 3600
+    # seconds between sweeps of a directory by one process
+    sweepInterval = 600
+    # directory -> time this process last swept it
+    _lastSweep = {}
+
     def __init__(self, manifestPath, contentsStore):
         self.contentsStore = contentsStore
         self.items = []
         self.totalSize = 0
         self.resumeOffset = None
+        self.manifestPath = None
         assert manifestPath.endswith('-out')
+        now = time.time()
+        self._maybeSweep(os.path.dirname(manifestPath), now)
+        try:
+            st = os.stat(manifestPath)
+        except OSError as err:
+            raise IOError(*err.args)
+        if st.st_mtime < now - self.keepTime:
+            self._expire(manifestPath)
+            raise IOError(errno.ENOENT, "changeset output has expired",
+                          manifestPath)
+        # start the clock again for a download resumed later
+        os.utime(manifestPath, None)
         if manifestPath.endswith('.cf-out'):
             # Manifest of items to produce
-            for line in open(manifestPath):
-                line = line.split()
-                if len(line) == 1:
-                    key, value = line[0].split('=')
-                    if key == 'resumeOffset':
-                        self.resumeOffset = int(value)
-                    else:
-                        raise RuntimeError("invalid key in changeset manifest")
-                    continue
-                (path, expandedSize, isChangeset, preserveFile, offset,
-                        ) = line
-                expandedSize = long(expandedSize)
-                self.items.append((path, expandedSize, int(isChangeset),
-                    int(preserveFile), int(offset)))
-                self.totalSize += expandedSize
-            util.removeIfExists(manifestPath)
+            self.resumeOffset, self.items = self._readManifest(manifestPath)
+            self.totalSize = sum(x[1] for x in self.items)
+            # The manifest is kept until the whole output has been produced
+            # so an interrupted download can be resumed with a Range request
+            self.manifestPath = manifestPath
         else:
-            # Single prepared temporary file (always deleted)
+            # Single prepared temporary file (deleted once produced)
+            self.items.append((manifestPath, st.st_size, 0, 0, 0))
+            self.totalSize = st.st_size
+
+    @staticmethod
+    def _readManifest(manifestPath):
+        resumeOffset = None
+        items = []
+        for line in open(manifestPath):
+            line = line.split()
+            if len(line) == 1:
+                key, value = line[0].split('=')
+                if key == 'resumeOffset':
+                    resumeOffset = int(value)
+                else:
+                    raise RuntimeError("invalid key in changeset manifest")
+                continue
+            (path, expandedSize, isChangeset, preserveFile, offset,
+                    ) = line
+            items.append((path, long(expandedSize), int(isChangeset),
+                int(preserveFile), int(offset)))
+        return resumeOffset, items
+
+    @classmethod
+    def _expire(cls, path):
+        """Remove expired output along with the temporary files it lists."""
+        if path.endswith('.cf-out'):
             try:
-                expandedSize = os.stat(manifestPath).st_size
-            except OSError as err:
-                raise IOError(*err.args)
-            self.items.append((manifestPath, expandedSize, 0, 0, 0))
+                items = cls._readManifest(path)[1]
+            except (IOError, ValueError, RuntimeError):
+                items = []
+            for (itemPath, expandedSize, isChangeset, preserveFile, offset,
+                    ) in items:
+                if not preserveFile:
+                    util.removeIfExists(itemPath)
+        util.removeIfExists(path)
+
+    @classmethod
+    def _maybeSweep(cls, tmpDir, now):
+        last = cls._lastSweep.get(tmpDir)
+        if last is not None and last <= now < last + cls.sweepInterval:
+            return
+        cls._lastSweep[tmpDir] = now
+        cls.sweep(tmpDir, now)
+
+    @classmethod
+    def sweep(cls, tmpDir, now = None):
+        """
+        Remove the manifests and temporary changesets in C{tmpDir} which
+        have gone unused for C{keepTime} seconds, except for temporary
+        changesets listed in a manifest which is still in use.
+        """
+        if now is None:
+            now = time.time()
+        cutoff = now - cls.keepTime
+        try:
+            names = os.listdir(tmpDir)
+        except OSError:
+            return
+        inUse = set()
+        tempFiles = []
+        for name in names:
+            path = os.path.join(tmpDir, name)
+            if name.endswith('.cf-out'):
+                try:
+                    if os.stat(path).st_mtime < cutoff:
+                        cls._expire(path)
+                        continue
+                    inUse.update(x[0] for x in cls._readManifest(path)[1])
+                except (IOError, OSError, ValueError, RuntimeError):
+                    # removed or being written by someone else
+                    continue
+            elif name.endswith('.ccs-out'):
+                tempFiles.append(path)
+        for path in tempFiles:
+            if path in inUse:
+                continue
+            try:
+                if os.stat(path).st_mtime < cutoff:
+                    util.removeIfExists(path)
+            except OSError:
+                continue
 
     def getSize(self):
         return self.totalSize - (self.resumeOffset or 0)
 
+    def setRange(self, rangeHeader):
+        """
+        Restrict the output to the byte range asked for by an HTTP C{Range}
+        request header.
+
+        Only a single range that runs to the end of the output is honored,
+        which is what a client resuming a download asks for. Any other range
+        is ignored, as HTTP permits, and the whole output is produced.
+
+        @return: The value for the C{Content-Range} response header, or
+            C{None} if the range was ignored.
+        """
+        if not rangeHeader:
+            return None
+        unit, _, spec = rangeHeader.strip().partition('=')
+        if unit.strip().lower() != 'bytes' or ',' in spec:
+            return None
+        first, _, last = spec.strip().partition('-')
+        size = self.getSize()
+        try:
+            first = long(first)
+            if last:
+                last = long(last)
+                if last < size - 1:
+                    return None
+        except ValueError:
+            return None
+        if not 0 <= first < size:
+            return None
+        self.resumeOffset = (self.resumeOffset or 0) + first
+        return 'bytes %d-%d/%d' % (first, size - 1, size)
+
+    def getFileObject(self):
+        """
+        If the whole output is a verbatim copy of a single file, return that
+        file positioned where the output starts, for handing to
+        C{wsgi.file_wrapper}. Otherwise return C{None} and leave the producer
+        untouched.
+        """
+        if len(self.items) != 1:
+            return None
+        (path, expandedSize, isChangeset, preserveFile, offset,
+                ) = self.items[0]
+        resumeOffset = self.resumeOffset or 0
+        if isChangeset or resumeOffset > expandedSize:
+            return None
+        fobj = open(path, 'rb')
+        fobj.seek(offset + resumeOffset)
+        return _ProducerFile(fobj, offset + expandedSize, self._finish)
+
     def __iter__(self):
+        return self._iterItems(fileRanges=False)
+
+    def iterSegments(self):
+        """
+        Iterate over the output like iterating over the producer does, but
+        yield a L{util.FileRange} for any part that is copied verbatim from a
+        cached changeset or the contents store, so it can be sent with
+        L{util.sendfile}. Each range must be consumed before the next item is
+        requested.
+        """
+        return self._iterItems(fileRanges=True)
+
+    def _iterItems(self, fileRanges):
         for (path, expandedSize, isChangeset, preserveFile, offset,
                 ) in self.items:
+            additionalOffset = self.resumeOffset or 0
+            if additionalOffset >= expandedSize:
+                # This file has been skipped entirely
+                self.resumeOffset = additionalOffset - expandedSize
+                continue
+            self.resumeOffset = None
             container = util.ExtendedFile(path, 'rb', buffering=False)
             rawSize = os.fstat(container.fileno()).st_size - offset
             fobj = util.SeekableNestedFile(container, rawSize, offset)
-            if self.resumeOffset:
-                self.resumeOffset -= expandedSize
-                if self.resumeOffset >= 0:
-                    # This file has been skipped entirely
-                    additionalOffset = expandedSize
-                else:
-                    # Part of this file will be returned
-                    remaining = -self.resumeOffset
-                    additionalOffset = expandedSize - remaining
-                    self.resumeOffset = None
-            else:
-                additionalOffset = 0
-            assert 0 <= additionalOffset <= expandedSize
-            if additionalOffset == expandedSize:
-                # Skipped
-                pass
-            elif isChangeset:
+            if isChangeset:
                 changeSet = filecontainer.FileContainer(fobj)
                 for data in changeSet.dumpIter(self._readNestedFile,
-                        offset=additionalOffset):
+                        offset=additionalOffset, fileRanges=fileRanges):
                     yield data
+            elif fileRanges:
+                yield util.FileRange(container.fileno(),
+                        offset + additionalOffset, rawSize - additionalOffset)
             else:
                 fobj.seek(additionalOffset)
                 for data in util.iterFileChunks(fobj):
                     yield data
             container.close()
+        self._finish()
+
+    def _finish(self):
+        """Remove the manifest and temporary files once fully produced."""
+        if self.manifestPath:
+            util.removeIfExists(self.manifestPath)
+        for (path, expandedSize, isChangeset, preserveFile, offset,
+                ) in self.items:
             if not preserveFile:
-                os.unlink(path)
+                util.removeIfExists(path)
+        self.items = []
 
     def _readNestedFile(self, name, tag, rawSize, subfile):
         """Use with ChangeSet.dumpIter to handle external file references."""
@@ -1644,6 +1858,34 @@ class ChangesetProducer(object):
             return tag, rawSize, subfile
 
 
+class _ProducerFile(object):
+    """
+    File handed to C{wsgi.file_wrapper} by L{ChangesetProducer}. Closing it
+    after the whole file was read lets the producer clean up; an early close
+    means the client went away, so the output is kept for a Range request.
+    Servers that pass the descriptor to C{sendfile()} don't move the file
+    position, and are trusted to have sent everything.
+    """
+
+    def __init__(self, fobj, end, finish):
+        self.fobj = fobj
+        self.start = fobj.tell()
+        self.end = end
+        self.finish = finish
+
+    def read(self, size=-1):
+        return self.fobj.read(size)
+
+    def fileno(self):
+        return self.fobj.fileno()
+
+    def close(self):
+        pos = self.fobj.tell()
+        self.fobj.close()
+        if pos in (self.start, self.end):
+            self.finish()
+
+
 # ewtroan: for the internal proxy, we support client version 38 but need to talk to a server which is at least version 41
 # ewtroan: for external proxy, we support client version 41 and need a server which is at least 41
 # ewtroan: and when I get a call, I need to know what version the server is, which I can't keep anywhere as state
@@ -0,0 +1,305 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Memcache-compatible cache stored in a memory-mapped file, so that all worker
+processes of a repository share one cache without an external server.
+
+The file holds a fixed number of equally sized slots addressed by the SHA-1
+of the (prefix, key) pair, with a short linear probe sequence on collision.
+Values are pickled into the slot; values too large for a slot are simply not
+cached. Processes serialize access with POSIX record locks on the file, and
+threads inside one process with a lock shared by everything in the process
+using that file. Use L{getSharedMemoryCache} to get the cache for a path;
+it keeps a single instance, and so a single file descriptor, per path.
+
+A file laid out with a different geometry is never resized in place, since
+other processes may have it mapped; a new file is renamed over it instead,
+and those processes keep using the old one until they restart.
+"""
+
+import cPickle
+import errno
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import time as pytime
+
+from conary.lib import digestlib, util
+
+# path -> SharedMemoryCache, and path -> lock serializing the threads of
+# this process; POSIX record locks don't exclude them from each other
+_caches = {}
+_pathLocks = {}
+_cachesLock = threading.RLock()
+
+def _pathLock(path):
+    _cachesLock.acquire()
+    try:
+        return _pathLocks.setdefault(path, threading.Lock())
+    finally:
+        _cachesLock.release()
+
+def getSharedMemoryCache(path, slots = 2000, slotSize = 32768):
+    """
+    Return the cache stored at C{path}, opening it the first time it is
+    asked for. Every caller in the process shares the same instance.
+    """
+    path = os.path.abspath(path)
+    _cachesLock.acquire()
+    try:
+        cache = _caches.get(path)
+        if cache is None:
+            cache = _caches[path] = SharedMemoryCache(path, slots = slots,
+                                                      slotSize = slotSize)
+        elif (cache.slots, cache.slotSize) != (slots, slotSize):
+            raise ValueError('cache %s is already open with %d slots of %d '
+                             'bytes' % (path, cache.slots, cache.slotSize))
+        return cache
+    finally:
+        _cachesLock.release()
+
+
+class SharedMemoryCache(object):
+
+    MAGIC = 'CNYSHMC1'
+    # magic, slot count, slot size
+    HEADER = struct.Struct('>8sII')
+    HEADER_SIZE = 64
+    # key hash, expiration (0 for never), store time, value length, in use
+    SLOT = struct.Struct('>20sddIB3x')
+    PROBES = 8
+
+    def __init__(self, path, slots = 2000, slotSize = 32768):
+        if slotSize < self.SLOT.size + 64:
+            raise ValueError('cache slot size %d is too small' % slotSize)
+        self.path = os.path.abspath(path)
+        self.slots = slots
+        self.slotSize = slotSize
+        self._lock = _pathLock(self.path)
+        self._lock.acquire()
+        try:
+            self._fd = self._open()
+        finally:
+            self._lock.release()
+        self._map = mmap.mmap(self._fd, self._fileSize())
+
+    def _fileSize(self):
+        return self.HEADER_SIZE + self.slots * self.slotSize
+
+    def _open(self):
+        # the first process to get here lays out the file; later ones only
+        # check that the geometry matches
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0600)
+            try:
+                fcntl.lockf(fd, fcntl.LOCK_EX)
+                try:
+                    if self._check(fd):
+                        return fd
+                finally:
+                    fcntl.lockf(fd, fcntl.LOCK_UN)
+            except:
+                os.close(fd)
+                raise
+            # the file was replaced while we waited for the lock, or has
+            # just been replaced by us; look at the new one
+            os.close(fd)
+
+    def _check(self, fd):
+        st = os.fstat(fd)
+        try:
+            current = os.stat(self.path)
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            return False
+        if (st.st_dev, st.st_ino) != (current.st_dev, current.st_ino):
+            return False
+
+        expected = self.HEADER.pack(self.MAGIC, self.slots, self.slotSize)
+        if st.st_size == 0:
+            # nobody has laid this file out, so nobody has it mapped
+            self._layout(fd, expected)
+            return True
+
+        header = os.read(fd, self.HEADER.size)
+        if header == expected and st.st_size == self._fileSize():
+            return True
+
+        # other processes may have the file mapped, and shrinking it under
+        # them would crash them; put a new file in its place instead
+        newFd, newPath = util.mkstemp(dir = os.path.dirname(self.path),
+                                      prefix = '.shmcache-')
+        try:
+            self._layout(newFd, expected)
+            os.rename(newPath, self.path)
+        except:
+            os.unlink(newPath)
+            raise
+        finally:
+            os.close(newFd)
+        return False
+
+    def _layout(self, fd, header):
+        os.ftruncate(fd, self._fileSize())
+        os.lseek(fd, 0, 0)
+        os.write(fd, header)
+
+    def close(self):
+        _cachesLock.acquire()
+        try:
+            if _caches.get(self.path) is self:
+                del _caches[self.path]
+        finally:
+            _cachesLock.release()
+        if self._map is not None:
+            self._map.close()
+            os.close(self._fd)
+            self._map = None
+
+    def _acquire(self, exclusive):
+        self._lock.acquire()
+        try:
+            while True:
+                try:
+                    fcntl.lockf(self._fd,
+                        exclusive and fcntl.LOCK_EX or fcntl.LOCK_SH)
+                    break
+                except IOError, e:
+                    if e.errno != errno.EINTR:
+                        raise
+        except:
+            self._lock.release()
+            raise
+
+    def _release(self):
+        fcntl.lockf(self._fd, fcntl.LOCK_UN)
+        self._lock.release()
+
+    @staticmethod
+    def _hash(key, key_prefix):
+        return digestlib.sha1('%s\0%s' % (key_prefix or '', key)).digest()
+
+    def _probe(self, keyHash):
+        start = struct.unpack('>I', keyHash[:4])[0] % self.slots
+        for i in xrange(min(self.PROBES, self.slots)):
+            yield self.HEADER_SIZE + ((start + i) % self.slots) * self.slotSize
+
+    def _find(self, keyHash, now):
+        """Return (offset, length) of the live slot holding C{keyHash}."""
+        for offset in self._probe(keyHash):
+            (slotHash, expires, stored, length, used) = self.SLOT.unpack_from(
+                    self._map, offset)
+            if not used:
+                continue
+            if slotHash == keyHash:
+                if expires and now > expires:
+                    return None, None
+                return offset, length
+        return None, None
+
+    def _get(self, keyHash, now):
+        offset, length = self._find(keyHash, now)
+        if offset is None:
+            return None
+        start = offset + self.SLOT.size
+        return cPickle.loads(self._map[start:start + length])
+
+    def _set(self, keyHash, value, expires, now):
+        data = cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL)
+        if len(data) > self.slotSize - self.SLOT.size:
+            return False
+
+        # reuse the key's own slot, then a free or expired one, and finally
+        # evict the entry stored longest ago in the probe sequence
+        target = free = oldest = None
+        oldestStored = None
+        for offset in self._probe(keyHash):
+            (slotHash, slotExpires, stored, length, used) = \
+                    self.SLOT.unpack_from(self._map, offset)
+            if used and slotHash == keyHash:
+                target = offset
+                break
+            if not used or (slotExpires and now > slotExpires):
+                if free is None:
+                    free = offset
+            elif oldestStored is None or stored < oldestStored:
+                oldest, oldestStored = offset, stored
+        if target is None:
+            target = free is not None and free or oldest
+
+        self.SLOT.pack_into(self._map, target, keyHash, expires, now,
+                len(data), 1)
+        start = target + self.SLOT.size
+        self._map[start:start + len(data)] = data
+        return True
+
+    def get(self, key, key_prefix = None):
+        return self.get_multi([ key ], key_prefix = key_prefix).get(key)
+
+    def get_multi(self, keys, key_prefix = None):
+        r = {}
+        now = pytime.time()
+        hashes = [ self._hash(x, key_prefix) for x in keys ]
+        self._acquire(False)
+        try:
+            for key, keyHash in zip(keys, hashes):
+                val = self._get(keyHash, now)
+                if val is not None:
+                    r[key] = val
+        finally:
+            self._release()
+
+        return r
+
+    def set(self, key, value, time = 0, key_prefix = None):
+        self.set_multi({ key : value }, time = time, key_prefix = key_prefix)
+
+    def set_multi(self, items, time = 0, key_prefix = None):
+        now = pytime.time()
+        if time:
+            expires = now + time
+        else:
+            expires = 0
+        items = [ (self._hash(x[0], key_prefix), x[1])
+                  for x in items.iteritems() ]
+        self._acquire(True)
+        try:
+            for keyHash, value in items:
+                self._set(keyHash, value, expires, now)
+        finally:
+            self._release()
+
+    def incr(self, key, delta=1):
+        now = pytime.time()
+        keyHash = self._hash(key, None)
+        self._acquire(True)
+        try:
+            val = self._get(keyHash, now)
+            if val is None:
+                return None
+            try:
+                val = long(val)
+            except ValueError:
+                return None
+            val = str(val + delta)
+            self._set(keyHash, val, 0, now)
+            return val
+        finally:
+            self._release()
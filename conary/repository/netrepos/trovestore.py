@@ -104,6 +104,10 @@ class TroveAdder:
 
 
 class TroveStore:
+    # rows staged in memory by addTroveDone() before they are bulkloaded
+    # into the temporary tables; bounds memory use for huge commits
+    bulkRows = 50000
+
     def __init__(self, db, log = None):
         self.db = db
 
@@ -352,23 +356,19 @@ class TroveStore:
                              [ "fileId", "stream", "sha1" ] )
         self.db.analyze("tmpNewStreams")
 
-        # In the extreme case of binary shadowing this might require a
-        # bit of of memory for larger troves, but it is preferable to
-        # constant full table scans in the much more common cases
+        # fill in streams we only had the fileId for. tmpNewStreams has
+        # at most one row per fileId, so the subqueries are scalar
         cu.execute("""
-        SELECT tmpNewStreams.fileId, tmpNewStreams.stream, tmpNewStreams.sha1
-        FROM tmpNewStreams
-        JOIN FileStreams USING(fileId)
+        UPDATE FileStreams
+        SET stream = ( SELECT NS.stream FROM tmpNewStreams AS NS
+                       WHERE NS.fileId = FileStreams.fileId ),
+            sha1 = COALESCE(( SELECT NS.sha1 FROM tmpNewStreams AS NS
+                              WHERE NS.fileId = FileStreams.fileId ),
+                            FileStreams.sha1)
         WHERE FileStreams.stream IS NULL
-        AND tmpNewStreams.stream IS NOT NULL
+          AND FileStreams.fileId IN ( SELECT fileId FROM tmpNewStreams
+                                      WHERE stream IS NOT NULL )
         """)
-        for (fileId, stream, sha1) in cu.fetchall():
-            cu.execute("UPDATE FileStreams SET stream = ? WHERE fileId = ?",
-                       (cu.binary(stream), cu.binary(fileId)))
-            if sha1:
-                cu.execute("UPDATE FileStreams SET sha1 = ? "
-                           "WHERE fileId = ?",
-                           (cu.binary(sha1), cu.binary(fileId)))
 
         # select the new non-NULL streams out of tmpNewFiles and Insert
         # them in FileStreams
@@ -586,28 +586,17 @@ class TroveStore:
         else:
             oldInstanceId = None
 
-        cu.execute("""
-        INSERT INTO tmpNewTroves (itemId, branchId, flavorId,
-                                  instanceId, versionId,
-                                  finalTimeStamp, troveType,
-                                  oldInstanceId, hidden)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, troveItemId, troveBranchId, troveFlavorId,
-             troveInstanceId, troveVersionId,
+        self.newTrovesInsertList.append((troveItemId, troveBranchId,
+             troveFlavorId, troveInstanceId, troveVersionId,
              '%.3f' % trv.getVersion().timeStamps()[-1],
-             trv.getType(), oldInstanceId, int(hidden))
+             trv.getType(), oldInstanceId, int(hidden)))
 
-        # Fold tmpNewFiles into FileStreams
-        if len(newFilesInsertList):
-            self.db.bulkload("tmpNewFiles",
-                    [ x + (troveInstanceId,) for x in newFilesInsertList ],
-                    [ "pathId", "versionId", "fileId",
-                      "dirnameId", "basenameId", "pathChanged",
-                      "instanceId" ])
+        # the files are folded into FileStreams by addTroveSetDone()
+        self.newFilesInsertList.extend(x + (troveInstanceId,)
+                                       for x in newFilesInsertList)
 
         # iterate over both strong and weak troves, and set weakFlag to
         # indicate which kind we're looking at when
-        insertList = []
         for ((name, version, flavor), weakFlag) in itertools.chain(
                 itertools.izip(trv.iterTroveList(strongRefs = True,
                                                    weakRefs   = False),
@@ -624,7 +613,8 @@ class TroveStore:
             # version/flavor of the package
             assert(not isPackage or version == trv.getVersion())
             assert(not isPackage or flavor == trv.getFlavor())
-            insertList.append((name, str(version), version.freeze(),
+            self.includedTrovesInsertList.append((name, str(version),
+                               version.freeze(),
                                ":".join(["%.3f" % x for x in
                                             version.timeStamps()]),
                                '%.3f' %version.timeStamps()[-1],
@@ -633,15 +623,13 @@ class TroveStore:
                                flavor.freeze(), flags, troveInstanceId,
                                trv.getType()))
 
-        if len(insertList):
-            self.db.bulkload("tmpTroves", insertList, [
-                "item", "version", "frozenVersion", "timestamps",
-                "finalTimestamp",
-                "branch", "label", "flavor", "flags", "instanceId",
-                "troveType"])
-
         # process troveInfo and metadata...
-        self.troveInfoTable.addInfo(cu, trv, troveInstanceId)
+        self.troveInfoInsertList.extend(
+            self.troveInfoTable.freezeInfo(cu, trv, troveInstanceId))
+
+        if (len(self.newFilesInsertList) +
+                    len(self.includedTrovesInsertList) >= self.bulkRows):
+            self._flushTroveSet()
 
         if len(list(trv.iterRedirects())):
             # don't bother with any of this unless there actually are redirects
@@ -692,6 +680,36 @@ class TroveStore:
             LEFT JOIN Flavors ON tmpNewRedirects.flavor = Flavors.flavor
             """ % troveInstanceId)
 
+    def _flushTroveSet(self):
+        """
+        Bulkload the rows addTroveDone() collected for the troves added
+        since the last flush.
+        """
+        if self.newTrovesInsertList:
+            self.db.bulkload("tmpNewTroves", self.newTrovesInsertList,
+                    [ "itemId", "branchId", "flavorId", "instanceId",
+                      "versionId", "finalTimeStamp", "troveType",
+                      "oldInstanceId", "hidden" ])
+        if self.newFilesInsertList:
+            self.db.bulkload("tmpNewFiles", self.newFilesInsertList,
+                    [ "pathId", "versionId", "fileId",
+                      "dirnameId", "basenameId", "pathChanged",
+                      "instanceId" ])
+        if self.includedTrovesInsertList:
+            self.db.bulkload("tmpTroves", self.includedTrovesInsertList, [
+                "item", "version", "frozenVersion", "timestamps",
+                "finalTimestamp",
+                "branch", "label", "flavor", "flags", "instanceId",
+                "troveType"])
+        if self.troveInfoInsertList:
+            self.db.bulkload("TroveInfo", self.troveInfoInsertList,
+                             [ 'instanceId', 'infoType', 'data'] )
+
+        self.newTrovesInsertList = []
+        self.newFilesInsertList = []
+        self.includedTrovesInsertList = []
+        self.troveInfoInsertList = []
+
     def addTroveSetStart(self, oldTroveInfoList, dirNames, baseNames):
         cu = self.db.cursor()
         schema.resetTable(cu, 'tmpTroves')
@@ -701,6 +719,12 @@ class TroveStore:
         schema.resetTable(cu, 'tmpNewLatest')
         self.depAdder = deptable.BulkDependencyLoader(self.db, cu)
         self.newStreamsByFileId = dict()
+        # rows for the temporary tables are collected across all of the
+        # troves in the set and loaded in a few large batches
+        self.newTrovesInsertList = []
+        self.newFilesInsertList = []
+        self.includedTrovesInsertList = []
+        self.troveInfoInsertList = []
 
         schema.resetTable(cu, 'tmpNewPaths')
         l = [(cu.binary(x),) for x in dirNames]
@@ -785,6 +809,7 @@ class TroveStore:
             callback = callbacks.UpdateCallback()
         cu = self.db.cursor()
 
+        self._flushTroveSet()
         self._mergeIncludedTroves(cu)
         self._mergeTroveNewFiles(cu)
 
@@ -17,7 +17,7 @@
 
 from conary import versions
 from conary.dbstore import idtable
-from conary.dbstore import sqlerrors
+from conary.dbstore import sqlerrors, sqllib
 from conary.repository import trovesource
 from conary.repository.errors import DuplicateBranch, InvalidSourceNameError
 from conary.repository.netrepos import items
@@ -26,6 +26,9 @@ LATEST_TYPE_ANY     = trovesource.TROVE_QUERY_ALL     # redirects, removed, and
 LATEST_TYPE_PRESENT = trovesource.TROVE_QUERY_PRESENT # redirects and normal
 LATEST_TYPE_NORMAL  = trovesource.TROVE_QUERY_NORMAL  # hide branches which end in redirects
 
+# first schema with the Items.latestGeneration column
+GENERATION_SCHEMA = sqllib.DBversion(18, 2)
+
 class BranchTable(idtable.IdTable):
     def __init__(self, db):
         idtable.IdTable.__init__(self, db, "Branches", "branchId", "branch")
@@ -89,8 +92,75 @@ class LabelTable(idtable.IdTable):
 
 # class and methods for handling LatestCache operations
 class LatestTable:
+    """
+    Maintains the LatestCache table.
+
+    Every change to the LatestCache rows of an item bumps
+    Items.latestGeneration for that item, in the same transaction. Changes
+    which can touch the rows of any item bump the generation of the 'ALL'
+    item (itemId 0) instead. Servers use these counters to tell whether
+    leaf queries they cached are still current, and L{invalidateItems}
+    bumps them for other changes servers cache results of per item.
+    """
     def __init__(self, db):
         self.db = db
+        self.generations = db.getVersion() >= GENERATION_SCHEMA
+
+    def _bumpGenerations(self, cu, itemIds):
+        if not self.generations:
+            return
+        itemIds = sorted(itemIds)
+        while itemIds:
+            cu.execute("""
+            update Items set latestGeneration = latestGeneration + 1
+            where itemId in (%s)""" % ",".join("%d" % x for x in itemIds[:250]))
+            del itemIds[:250]
+
+    def invalidateAll(self, cu):
+        """
+        Mark the LatestCache rows of every item as changed.
+        """
+        self._bumpGenerations(cu, [ 0 ])
+
+    def invalidateItems(self, cu, names):
+        """
+        Mark the items with the given names as changed.
+        """
+        if not self.generations:
+            return
+        names = sorted(set(names))
+        while names:
+            chunk = names[:250]
+            del names[:250]
+            cu.execute("""
+            update Items set latestGeneration = latestGeneration + 1
+            where item in (%s)""" % ",".join("?" * len(chunk)),
+                       [ cu.encode(x) for x in chunk ])
+
+    def getGenerations(self, cu, names):
+        """
+        Return the generation of all items together with a dict mapping
+        each of the given item names to its own generation. Names which
+        are not in the Items table are left out of the dict. Returns
+        C{(None, {})} when the schema has no generations.
+        """
+        if not self.generations:
+            return None, {}
+        cu.execute("select latestGeneration from Items where itemId = 0")
+        allGeneration = cu.fetchone()[0]
+        names = list(names)
+        generations = {}
+        while names:
+            chunk = names[:250]
+            del names[:250]
+            cu.execute("""
+            select item, latestGeneration from Items
+            where item in (%s) and itemId != 0""" % ",".join("?" * len(chunk)),
+                       [ cu.encode(x) for x in chunk ])
+            for name, generation in cu:
+                generations[cu.decode(name)] = generation
+        return allGeneration, generations
+
     def rebuild(self, cu = None):
         if cu is None:
             cu = self.db.cursor()
@@ -120,6 +190,7 @@ class LatestTable:
         _insertView(cu, LATEST_TYPE_ANY)
         _insertView(cu, LATEST_TYPE_PRESENT)
         _insertView(cu, LATEST_TYPE_NORMAL)
+        self.invalidateAll(cu)
         self.db.analyze("LatestCache")
         return
 
@@ -141,6 +212,7 @@ class LatestTable:
         from LatestView
         where itemId = ? and branchId = ? and flavorId = ? %s""" % (cond,),
                    args)
+        self._bumpGenerations(cu, [ itemId ])
 
     def updateInstanceId(self, cu, instanceId):
         cu.execute("""
@@ -179,6 +251,7 @@ class LatestTable:
             select
                 latestType, userGroupId, itemId, branchId, flavorId, versionId
                 from LatestView where userGroupId = ? """, roleId)
+            self.invalidateAll(cu)
             return
         # we need to be more discriminate since we know what
         # instanceIds are new (they are provided in tmpInstances table)
@@ -203,9 +276,12 @@ class LatestTable:
         # Investigate that.
         cu = self.db.cursor()
         cu.execute("SELECT itemId, branchId, flavorId FROM %s" % table)
+        slots = cu.fetchall()
         pieces = ['(itemId = %d AND branchId = %d AND flavorId = %d)'
-                % tuple(x) for x in cu]
-        count = 1000
+                % tuple(x) for x in slots]
+        # sqlite limits expression trees to a depth of 1000, which a chain
+        # of 1000 ORs exceeds
+        count = 250
         while pieces:
             query = ' OR '.join(pieces[-count:])
             del pieces[-count:]
@@ -216,6 +292,7 @@ class LatestTable:
                 SELECT DISTINCT v.latestType, v.userGroupId, v.itemId, v.branchId,
                         v.flavorId, v.versionId
                 FROM LatestView v WHERE """ + query)
+        self._bumpGenerations(cu, set(x[0] for x in slots))
 
 
 class LabelMap(idtable.IdPairSet):
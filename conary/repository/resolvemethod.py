@@ -427,7 +427,7 @@ class DepResolutionByTroveListFast(DepResolutionMethod):
         allTups = sorted(allTups)
         allProvides = self.troveSource.getDepsForTroveList(allTups,
                 provides=True, requires=False)
-        self.matcher = deps.DependencyMatcher()
+        self.matcher = deps.CompactDependencyMatcher()
         for tup, (provSet, _) in zip(allTups, allProvides):
             self.matcher.add(provSet, tup)
 
@@ -21,6 +21,8 @@
 
 import base64
 import cgi
+import httplib
+import logging
 import socket
 import StringIO
 import sys
@@ -36,6 +38,8 @@ from conary.lib.http import opener
 from conary.lib.http import proxy_map
 from conary.repository import errors
 
+log = logging.getLogger(__name__)
+
 # For compatibility
 AbortError = http_error.AbortError
 BackoffTimer = timeutil.BackoffTimer
@@ -45,9 +49,10 @@ URLOpener = opener.URLOpener
 
 class ConaryConnector(connection.Connection):
 
-    def __init__(self, endpoint, proxy=None, caCerts=None, commonName=None):
+    def __init__(self, endpoint, proxy=None, caCerts=None, commonName=None,
+            pool=None):
         connection.Connection.__init__(self, endpoint, proxy, caCerts,
-                commonName)
+                commonName, pool)
         # Always talk to conary proxies using the protocol from the proxy URL.
         # In other words, a SSL connection through a non-SSL conary proxy
         # should be unencrypted.
@@ -66,14 +71,25 @@ class ConaryURLOpener(opener.URLOpener):
     connectionFactory = ConaryConnector
 
     def __init__(self, proxyMap=None, caCerts=None, proxies=None,
-            persist=False, connectAttempts=None):
+            persist=True, connectAttempts=None, connectionPool=None):
         if not proxyMap:
             if proxies:
                 proxyMap = proxy_map.ProxyMap.fromDict(proxies)
             else:
                 proxyMap = proxy_map.ProxyMap.fromEnvironment()
         opener.URLOpener.__init__(self, proxyMap=proxyMap, caCerts=caCerts,
-                persist=persist, connectAttempts=connectAttempts)
+                persist=persist, connectAttempts=connectAttempts,
+                connectionPool=connectionPool)
+
+    def openResumable(self, url, headers=(), forceProxy=False, attempts=3):
+        """
+        Open C{url} for a download that picks up where it left off if the
+        connection drops, by asking for the rest with a C{Range} request up
+        to C{attempts} times.
+        """
+        response = self.open(url, headers=headers, forceProxy=forceProxy)
+        return ResumableResponse(self, url, response, headers=headers,
+                forceProxy=forceProxy, attempts=attempts)
 
     def _requestOnce(self, req, proxy):
         if proxy and proxy.scheme in ('conary', 'conarys'):
@@ -86,6 +102,82 @@ class ConaryURLOpener(opener.URLOpener):
         return opener.URLOpener._requestOnce(self, req, proxy)
 
 
+class ResumableResponse(object):
+    """
+    File-like wrapper around a download from L{ConaryURLOpener}. If the
+    connection fails or ends before C{Content-Length} bytes arrived, the URL
+    is opened again asking for the remaining bytes, and reading continues as
+    if nothing happened. Servers that don't advertise C{Accept-Ranges} and
+    compressed responses are never resumed.
+    """
+
+    def __init__(self, opener, url, response, headers=(), forceProxy=False,
+            attempts=3):
+        self.opener = opener
+        self.url = url
+        self.response = response
+        self.extraHeaders = list(headers)
+        self.forceProxy = forceProxy
+        self.attempts = attempts
+        self.headers = response.headers
+        self.status = response.status
+        self.pos = 0
+        self.size = None
+        if (response.getheader('accept-ranges') == 'bytes'
+                and not response.getheader('content-encoding')):
+            try:
+                self.size = long(response.getheader('content-length'))
+            except (TypeError, ValueError):
+                pass
+
+    def read(self, count=None):
+        while True:
+            try:
+                data = self.response.read(count)
+            except httplib.IncompleteRead, err:
+                # keep what did arrive; the rest is fetched on the next read
+                data = err.partial
+            except (socket.error, httplib.HTTPException):
+                if not self._resume():
+                    raise
+                continue
+            if (not data and count != 0 and self.size is not None
+                    and self.pos < self.size and self._resume()):
+                continue
+            self.pos += len(data)
+            return data
+
+    def _resume(self):
+        if self.size is None or self.attempts <= 0:
+            return False
+        self.attempts -= 1
+        log.info("Download of %s was interrupted after %d of %d bytes; "
+                "resuming", self.url, self.pos, self.size)
+        try:
+            self.response.close()
+        except (socket.error, httplib.HTTPException):
+            pass
+        headers = self.extraHeaders + [('Range', 'bytes=%d-' % self.pos)]
+        try:
+            response = self.opener.open(self.url, headers=headers,
+                    forceProxy=self.forceProxy)
+        except (socket.error, EnvironmentError, http_error.TransportError), err:
+            log.warning("Could not resume download of %s: %s", self.url, err)
+            return False
+        expected = 'bytes %d-%d/%d' % (self.pos, self.size - 1, self.size)
+        if (response.status != 206
+                or response.getheader('content-range') != expected):
+            log.warning("Could not resume download of %s: server ignored "
+                    "the requested range", self.url)
+            response.close()
+            return False
+        self.response = response
+        return True
+
+    def close(self):
+        self.response.close()
+
+
 class XMLOpener(ConaryURLOpener):
     contentType = 'text/xml'
 
@@ -114,10 +206,10 @@ class Transport(xmlrpclib.Transport):
         self._proxyHost = None  # Can be a URL object
         self.proxyHost = None
         self.proxyProtocol = None
-        # More investigation about how persistent connections affect Conary
-        # operation is needed. For now, just close the cached connections.
+        # XML-RPC calls share the keep-alive connection pool with file
+        # downloads, see ConaryURLOpener.
         self.opener = self.openerFactory(proxyMap=proxyMap, caCerts=caCerts,
-                persist=False, connectAttempts=connectAttempts)
+                persist=True, connectAttempts=connectAttempts)
 
     def setEntitlements(self, entitlementList):
         self.entitlements = entitlementList
@@ -148,11 +240,16 @@ class Transport(xmlrpclib.Transport):
     def setAbortCheck(self, abortCheck):
         self.abortCheck = abortCheck
 
-    def request(self, url, body, verbose=0):
+    def request(self, url, body, verbose=0, contentType=None):
         self.verbose = verbose
 
         req = self.opener.newRequest(url, method='POST',
                 headers=self.extraHeaders)
+        if contentType:
+            req.headers['Content-Type'] = contentType
+            accept = [contentType]
+        else:
+            accept = self.contentTypes
 
         req.setAbortCheck(self.abortCheck)
         req.setData(body, compress=self.compress)
@@ -161,7 +258,7 @@ class Transport(xmlrpclib.Transport):
         if self.serverName:
             req.headers['X-Conary-Servername'] = self.serverName
         req.headers['User-agent'] = self.user_agent
-        req.headers['Accept'] = ','.join(self.contentTypes + [self.mixedType])
+        req.headers['Accept'] = ','.join(accept + [self.mixedType])
 
         # Make sure we capture some useful information from the
         # opener, even if we failed
@@ -211,6 +308,17 @@ class Transport(xmlrpclib.Transport):
     def getparser(self):
         return util.xmlrpcGetParser()
 
+    @staticmethod
+    def _parse_binary_response(response):
+        try:
+            params, methodname = util.binrpcLoad(response)
+        except ValueError, err:
+            raise xmlrpclib.ResponseError("Response body is corrupted: %s"
+                    % (err,))
+        if methodname is not None:
+            raise xmlrpclib.ResponseError("Response body is corrupted")
+        return params
+
     @staticmethod
     def _parse_multipart_header(response, boundary):
         if response.readline() != "--%s\r\n" % (boundary,):
@@ -234,6 +342,8 @@ class Transport(xmlrpclib.Transport):
         ctype, pdict = cgi.parse_header(ctype)
         if ctype in self.contentTypes:
             return xmlrpclib.Transport.parse_response(self, response)
+        elif ctype == util.BINRPC_CONTENT_TYPE:
+            return self._parse_binary_response(response)
         elif ctype != self.mixedType:
             raise xmlrpclib.ResponseError(
                     "Response has invalid or missing Content-Type")
@@ -241,12 +351,15 @@ class Transport(xmlrpclib.Transport):
 
         # Read XMLRPC response
         rpcHeaders, rpcBody = decoder.get()
-        if (cgi.parse_header(rpcHeaders.get('content-type'))[0]
-                not in self.contentTypes):
+        rpcType = cgi.parse_header(rpcHeaders.get('content-type'))[0]
+        rpcBody = StringIO.StringIO(rpcBody)
+        if rpcType in self.contentTypes:
+            result = xmlrpclib.Transport.parse_response(self, rpcBody)
+        elif rpcType == util.BINRPC_CONTENT_TYPE:
+            result = self._parse_binary_response(rpcBody)
+        else:
             raise xmlrpclib.ResponseError(
                     "Response has invalid or missing Content-Type")
-        rpcBody = StringIO.StringIO(rpcBody)
-        result = xmlrpclib.Transport.parse_response(self, rpcBody)
 
         # Replace the URL in the XMLRPC response with a file-like object that
         # reads out the second part of the multipart response
@@ -15,35 +15,285 @@
 #
 
 
-from itertools import izip
-import cPickle, os, tempfile
+from itertools import chain, izip
+import cPickle, cStringIO, fcntl, mmap, os, struct, tempfile, threading, zlib
 
 from conary import errors, trove, versions
 from conary.deps import deps
-from conary.lib import log, util
-from conary.repository import changeset, filecontainer, filecontents
+from conary.lib import log, sha1helper, util
+from conary.repository import changeset, filecontainer
 from conary.repository import netclient, trovesource
 
 
 class CacheDict(dict):
 
+    # called with a trove tuple which is not in the dict; it returns True
+    # after adding that trove from the on-disk cache
+    loader = None
+
     def has(self, troveTup, withFiles = False):
         if not withFiles or trove.troveIsCollection(troveTup[0]):
             return troveTup in self
 
         return self.get(troveTup, (None, False))[1] is True
 
+    def __contains__(self, troveTup):
+        return dict.__contains__(self, troveTup) or self._load(troveTup)
+
     def __setitem__(self, troveTup, trv):
         dict.__setitem__(self, troveTup, (False, trv))
 
     def __getitem__(self, troveTup):
+        if not dict.__contains__(self, troveTup):
+            self._load(troveTup)
         return dict.__getitem__(self, troveTup)[1]
 
+    def _load(self, troveTup):
+        return self.loader is not None and self.loader(troveTup)
+
     def add(self, troveTup, trv, withFiles=False):
         dict.__setitem__(self, troveTup, (withFiles, trv))
 
+class BadTroveCacheFile(Exception):
+    pass
+
+class TroveCacheFile(object):
+    """
+    Indexed, append-only file behind L{TroveCache.load} and
+    L{TroveCache.save}.
+
+    The file is a header, a run of records, an index and a footer. Each
+    record holds one cache entry as a kind and two strings, the key and
+    the zlib compressed value. The index is a sorted array of (key digest,
+    record offset) pairs, so an entry is found with a binary search on the
+    mapped file and nothing else is read until it is asked for.
+
+    Saving appends the new records, then a new index and footer. Bytes
+    before the old end of the file never change, so readers which mapped
+    it earlier keep a consistent view. The old index and any replaced
+    records are left behind as garbage; the whole file is rewritten once
+    that is more than half of it.
+    """
+
+    MAGIC = 'CNYTROVC'
+    VERSION = 1
+
+    TROVE = 1
+    DEPS = 2
+    TIMESTAMP = 3
+    DEP_SOLUTION = 4
+    FILE = 5
+
+    _header = struct.Struct('!8sI')
+    _record = struct.Struct('!BII')
+    _entry = struct.Struct('!8sQ')
+    # index offset, entry count, garbage bytes, magic
+    _footer = struct.Struct('!QQQ8s')
+
+    def __init__(self, path):
+        self.path = path
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            # keep append from changing the tail while it is mapped; the
+            # lock goes away with the descriptor
+            fcntl.lockf(fd, fcntl.LOCK_SH)
+            st = os.fstat(fd)
+            self.size = st.st_size
+            self._inode = (st.st_dev, st.st_ino)
+            if self.size < self._header.size + self._footer.size:
+                raise BadTroveCacheFile(path)
+            self._map = mmap.mmap(fd, self.size, access = mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+
+        magic, version = self._header.unpack_from(self._map, 0)
+        footerOffset = self.size - self._footer.size
+        (self._indexOffset, self._count, self.garbage,
+                endMagic) = self._footer.unpack_from(self._map, footerOffset)
+        if (magic != self.MAGIC or version != self.VERSION or
+                endMagic != self.MAGIC or
+                self._indexOffset + self._count * self._entry.size !=
+                                                            footerOffset):
+            self._map.close()
+            raise BadTroveCacheFile(path)
+
+    @classmethod
+    def isTroveCacheFile(cls, path):
+        f = open(path)
+        try:
+            return f.read(len(cls.MAGIC)) == cls.MAGIC
+        finally:
+            f.close()
+
+    @staticmethod
+    def _digest(kind, key):
+        return sha1helper.sha1String(chr(kind) + key)[:8]
+
+    def _recordAt(self, offset):
+        kind, keyLen, valueLen = self._record.unpack_from(self._map, offset)
+        start = offset + self._record.size
+        return (kind, self._map[start:start + keyLen],
+                self._map[start + keyLen:start + keyLen + valueLen])
+
+    def _iterStored(self):
+        for entry in self._entries():
+            yield self._recordAt(self._entry.unpack(entry)[1])
+
+    def _entries(self):
+        index = self._map[self._indexOffset:
+                          self._indexOffset + self._count * self._entry.size]
+        return [ index[i:i + self._entry.size]
+                 for i in xrange(0, len(index), self._entry.size) ]
+
+    def get(self, kind, key):
+        """
+        Return the value stored for C{key}, or None.
+        """
+        digest = self._digest(kind, key)
+        entrySize = self._entry.size
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            pos = self._indexOffset + mid * entrySize
+            if self._map[pos:pos + 8] < digest:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        while lo < self._count:
+            entryDigest, offset = self._entry.unpack_from(self._map,
+                                        self._indexOffset + lo * entrySize)
+            if entryDigest != digest:
+                break
+            recKind, recKey, value = self._recordAt(offset)
+            if recKind == kind and recKey == key:
+                return zlib.decompress(value)
+            lo += 1
+
+        return None
+
+    def iterRecords(self, kind = None):
+        """
+        Iterate over the (kind, key, value) records of every entry, or of
+        every entry of the given kind.
+        """
+        for recKind, key, value in self._iterStored():
+            if kind is None or recKind == kind:
+                yield recKind, key, zlib.decompress(value)
+
+    def close(self):
+        self._map.close()
+
+    @staticmethod
+    def _compress(records):
+        return [ (kind, key, zlib.compress(value))
+                 for kind, key, value in records ]
+
+    @classmethod
+    def _writeRecords(cls, f, offset, records):
+        entries = []
+        for kind, key, value in records:
+            entries.append(cls._entry.pack(cls._digest(kind, key), offset))
+            f.write(cls._record.pack(kind, len(key), len(value)))
+            f.write(key)
+            f.write(value)
+            offset += cls._record.size + len(key) + len(value)
+
+        return offset, entries
+
+    @classmethod
+    def _writeIndex(cls, f, offset, entries, garbage):
+        entries.sort()
+        f.write(''.join(entries))
+        f.write(cls._footer.pack(offset, len(entries), garbage, cls.MAGIC))
+
+    @classmethod
+    def write(cls, path, records, copyFrom = None):
+        """
+        Atomically replace C{path} with a file holding C{records}, an
+        iterable of (kind, key, value) tuples with unique keys. The entries
+        of the TroveCacheFile C{copyFrom} which C{records} does not replace
+        are copied over as they are.
+        """
+        records = cls._compress(records)
+        if copyFrom is not None:
+            newKeys = set((x[0], x[1]) for x in records)
+            records = chain(records,
+                            (x for x in copyFrom._iterStored()
+                             if (x[0], x[1]) not in newKeys))
+
+        fd, tmpPath = tempfile.mkstemp(prefix = os.path.basename(path) + '.',
+                                       dir = os.path.dirname(path))
+        try:
+            f = os.fdopen(fd, 'w')
+            f.write(cls._header.pack(cls.MAGIC, cls.VERSION))
+            offset, entries = cls._writeRecords(f, cls._header.size, records)
+            cls._writeIndex(f, offset, entries, 0)
+            f.close()
+            if util.exists(path):
+                os.chmod(tmpPath, os.stat(path).st_mode)
+            else:
+                os.chmod(tmpPath, 0644)
+            os.rename(tmpPath, path)
+        finally:
+            if os.path.exists(tmpPath):
+                os.remove(tmpPath)
+
+    def append(self, records):
+        """
+        Add C{records} to the end of the file, replacing the entries with
+        the same keys. Returns False without changing anything when the
+        file changed since it was mapped, or when it is due to be
+        rewritten.
+        """
+        f = open(self.path, 'r+b', 0)
+        try:
+            fcntl.lockf(f.fileno(), fcntl.LOCK_EX)
+            st = os.fstat(f.fileno())
+            if (st.st_dev, st.st_ino) != self._inode or st.st_size != self.size:
+                return False
+
+            records = self._compress(records)
+            newDigests = set(self._digest(x[0], x[1]) for x in records)
+            # the old index and footer become garbage, as do the records
+            # being replaced
+            garbage = self.garbage + self.size - self._indexOffset
+            entries = []
+            for entry in self._entries():
+                if entry[:8] in newDigests:
+                    kind, key, value = self._recordAt(
+                                            self._entry.unpack(entry)[1])
+                    garbage += self._record.size + len(key) + len(value)
+                else:
+                    entries.append(entry)
+            if garbage * 2 > self.size:
+                return False
+
+            out = cStringIO.StringIO()
+            offset, newEntries = self._writeRecords(out, self.size, records)
+            self._writeIndex(out, offset, entries + newEntries, garbage)
+            f.seek(self.size)
+            try:
+                f.write(out.getvalue())
+            except:
+                # a partial tail would leave the file unreadable
+                f.truncate(self.size)
+                raise
+            return True
+        finally:
+            f.close()
+
+def _troveKey(troveTup):
+    return '%s=%s[%s]' % (troveTup[0], troveTup[1].asString(),
+                          troveTup[2].freeze())
+
+def _timeStampKey(name, version):
+    return '%s=%s' % (name, version.asString())
+
 class TroveCache(trovesource.AbstractTroveSource):
 
+    # version of the changeset based format read by _loadChangeSet; newer
+    # caches are written as a TroveCacheFile
     VERSION = (4, 0)                    # (major, minor)
 
     _fileId = '\0' * 40
@@ -64,13 +314,19 @@ class TroveCache(trovesource.AbstractTroveSource):
         self.findCache = {}
         self.fileCache = {}
         self.callback = None
-        self._startingSizes = self._getSizeTuple()
         self._cs = None
+        self._file = None
+        # (kind, key) of the entries which are not in self._file yet
+        self._unsaved = set()
+        # troves may be cached from several threads while a system model
+        # is realized
+        self._lock = threading.RLock()
 
     def _addToCache(self, troveTupList, troves, _cached = None,
                     withFiles = False):
         for troveTup, trv in izip(troveTupList, troves):
             self.cache.add(troveTup, trv, withFiles = withFiles)
+            self._unsaved.add((TroveCacheFile.TROVE, troveTup))
 
         if _cached:
             _cached(troveTupList, troves)
@@ -83,28 +339,69 @@ class TroveCache(trovesource.AbstractTroveSource):
     def _cached(self, troveTupList, troveList):
         pass
 
-    def _getSizeTuple(self):
-        return ( len(self.cache),
-                 sum([ len([ x[0] for x in self.depCache.itervalues()
-                                 if x[0] is not None ]),
-                       len([ x[1] for x in self.depCache.itervalues()
-                                 if x[1] is not None ]) ] ),
-                 len(self.depSolutionCache), len(self.timeStampCache),
-                 len(self.findCache), len(self.fileCache) )
+    def _fromFile(self, kind, key):
+        if self._file is None:
+            return None
+        return self._file.get(kind, key)
 
-    def cacheTroves(self, troveTupList, _cached = None, withFiles = False):
-        troveTupList = [x for x in troveTupList
-                            if not self.cache.has(x, withFiles = withFiles) ]
-        if not troveTupList:
+    def _loadTrove(self, troveTup):
+        # the cache is read from several threads while a system model is
+        # realized; only one of them may fault a given trove in
+        self._lock.acquire()
+        try:
+            if dict.__contains__(self.cache, troveTup):
+                return True
+
+            frozen = self._fromFile(TroveCacheFile.TROVE,
+                                    _troveKey(troveTup))
+            if frozen is None:
+                return False
+
+            trv = trove.Trove(trove.ThawTroveChangeSet(frozen),
+                              skipIntegrityChecks = True)
+            self.cache.add(troveTup, trv)
+            self._cached([ troveTup ], [ trv ])
+            return True
+        finally:
+            self._lock.release()
+
+    def cacheModified(self):
+        return bool(self._unsaved)
+
+    def iterCachedTroves(self):
+        """
+        Iterate over every cached trove, including the ones which have
+        not been read from the cache file yet.
+        """
+        for withFiles, trv in self.cache.itervalues():
+            yield trv
+
+        if self._file is None:
             return
+        for kind, key, frozen in self._file.iterRecords(TroveCacheFile.TROVE):
+            trv = trove.Trove(trove.ThawTroveChangeSet(frozen),
+                              skipIntegrityChecks = True)
+            if not dict.__contains__(self.cache, trv.getNameVersionFlavor()):
+                yield trv
 
-        self._caching(troveTupList)
+    def cacheTroves(self, troveTupList, _cached = None, withFiles = False):
+        self._lock.acquire()
+        try:
+            troveTupList = [ x for x in troveTupList
+                             if not self.cache.has(x, withFiles = withFiles) ]
+            if not troveTupList:
+                return
 
-        troves = self.troveSource.getTroves(troveTupList, withFiles=withFiles,
-                                            callback = self.callback)
+            self._caching(troveTupList)
 
-        self._addToCache(troveTupList, troves, _cached = _cached,
-                         withFiles=withFiles)
+            troves = self.troveSource.getTroves(troveTupList,
+                                                withFiles=withFiles,
+                                                callback = self.callback)
+
+            self._addToCache(troveTupList, troves, _cached = _cached,
+                             withFiles=withFiles)
+        finally:
+            self._lock.release()
 
     def addFindResult(self, spec, result):
         self.findCache[(None, spec)] = result
@@ -114,14 +411,31 @@ class TroveCache(trovesource.AbstractTroveSource):
 
     def addDepSolution(self, sig, depSet, result):
         self.depSolutionCache[(sig, depSet)] = list(result)
+        self._unsaved.add((TroveCacheFile.DEP_SOLUTION, (sig, depSet)))
 
     def getDepSolution(self, sig, depSet):
-        return self.depSolutionCache.get( (sig, depSet), None )
+        result = self.depSolutionCache.get( (sig, depSet), None )
+        if result is not None:
+            return result
+
+        pickled = self._fromFile(TroveCacheFile.DEP_SOLUTION,
+                                 sig + depSet.freeze())
+        if pickled is None:
+            return None
+        result = [ [ (x[0], versions.ThawVersion(x[1]), deps.ThawFlavor(x[2]))
+                     for x in resultList ]
+                   for resultList in cPickle.loads(pickled) ]
+        self.depSolutionCache[(sig, depSet)] = result
+        return result
 
     def getDepCacheEntry(self, troveTup):
         result = self.depCache.get(troveTup)
         if result is None:
-            return None
+            pickled = self._fromFile(TroveCacheFile.DEPS, _troveKey(troveTup))
+            if pickled is None:
+                return None
+            result = cPickle.loads(pickled)
+            self.depCache[troveTup] = result
 
         origResult = result
         if type(result[0]) is str:
@@ -151,6 +465,7 @@ class TroveCache(trovesource.AbstractTroveSource):
             else:
                 self.depCache[troveTup] = (depTuple[0] or existing[0],
                                            depTuple[1] or existing[1])
+            self._unsaved.add((TroveCacheFile.DEPS, troveTup))
 
         # look in the dep cache and trove cache
         result = [ None ] * len(troveTupList)
@@ -215,7 +530,7 @@ class TroveCache(trovesource.AbstractTroveSource):
         # look in the dep cache and trove cache
         result = [ None ] * len(troveTupList)
         for i, tup in enumerate(troveTupList):
-            result[i] = self.timeStampCache.get(tup[0:2])
+            result[i] = self._getCachedTimestamp(tup[0:2])
             if result[i] is None and self.troveIsCached(tup):
                 trv = self.cache[tup]
                 result[i] = trv.getVersion()
@@ -242,6 +557,7 @@ class TroveCache(trovesource.AbstractTroveSource):
             # old servers
             if timeStampedVersion is not None:
                 self.timeStampCache[troveTup[0:2]] = timeStampedVersion
+                self._unsaved.add((TroveCacheFile.TIMESTAMP, troveTup[0:2]))
                 result[i] = timeStampedVersion
 
         # see if anything else is None; if so, we need to cache the complete
@@ -254,32 +570,61 @@ class TroveCache(trovesource.AbstractTroveSource):
 
         return result
 
+    def _getCachedTimestamp(self, key):
+        result = self.timeStampCache.get(key)
+        if result is None:
+            frozen = self._fromFile(TroveCacheFile.TIMESTAMP,
+                                    _timeStampKey(*key))
+            if frozen is not None:
+                result = versions.ThawVersion(frozen)
+                self.timeStampCache[key] = result
+        return result
 
     def getTroveInfo(self, infoType, troveTupList):
-        troveTupList = list(troveTupList)
-        infoCache = self.troveInfoCache.setdefault(infoType, {})
-
-        result = [ None ] * len(troveTupList)
-        for i, tup in enumerate(troveTupList):
-            result[i] = infoCache.get(tup)
-            if result[i] is None and self.troveIsCached(tup):
-                trv = self.cache[tup]
-                result[i] = getattr(trv.troveInfo,
-                                    trv.troveInfo.streamDict[infoType][2])
+        return self.getMultipleTroveInfo([ infoType ], troveTupList)[0]
 
-        needed = [ (i, troveTup) for i, (troveTup, depSet) in
-                            enumerate(izip(troveTupList, result))
-                            if depSet is None ]
-        if not needed:
-            return result
-
-        troveInfoList = self.troveSource.getTroveInfo(infoType,
-                                                [ x[1] for x in needed ])
-        for (i, troveTup), troveInfo in izip(needed, troveInfoList):
-            infoCache[troveTup] = troveInfo
-            result[i] = troveInfo
+    def getMultipleTroveInfo(self, infoTypes, troveTupList):
+        troveTupList = list(troveTupList)
 
-        return result
+        results = []
+        neededTypes = []
+        neededTups = set()
+        for infoType in infoTypes:
+            infoCache = self.troveInfoCache.setdefault(infoType, {})
+            result = [ None ] * len(troveTupList)
+            for i, tup in enumerate(troveTupList):
+                result[i] = infoCache.get(tup)
+                if result[i] is None and self.troveIsCached(tup):
+                    trv = self.cache[tup]
+                    result[i] = getattr(trv.troveInfo,
+                                        trv.troveInfo.streamDict[infoType][2])
+            results.append(result)
+
+            needed = [ troveTup for troveTup, ti in izip(troveTupList, result)
+                            if ti is None ]
+            if needed:
+                neededTypes.append((infoType, result))
+                neededTups.update(needed)
+
+        if not neededTypes:
+            return results
+
+        # every missing info type is fetched for every trove missing any of
+        # them, which lets the source look them all up at once
+        neededTups = list(neededTups)
+        troveInfoLists = self.troveSource.getMultipleTroveInfo(
+                                [ x[0] for x in neededTypes ], neededTups)
+        for (infoType, result), troveInfoList in izip(neededTypes,
+                                                      troveInfoLists):
+            infoCache = self.troveInfoCache[infoType]
+            fetched = dict(izip(neededTups, troveInfoList))
+            for troveTup, troveInfo in fetched.iteritems():
+                infoCache[troveTup] = troveInfo
+            for i, troveTup in enumerate(troveTupList):
+                if result[i] is None:
+                    result[i] = fetched[troveTup]
+
+        return results
 
     def getPackageComponents(self, troveTup):
         return [ x[0][0] for x in self.iterTroveListInfo(troveTup) ]
@@ -302,6 +647,23 @@ class TroveCache(trovesource.AbstractTroveSource):
 
     def load(self, path):
         assert(not self.cache and not self.depCache)
+        try:
+            if not TroveCacheFile.isTroveCacheFile(path):
+                self._loadChangeSet(path)
+                return
+            self._file = TroveCacheFile(path)
+        except BadTroveCacheFile:
+            log.warning('trove cache %s was corrupt, ignoring' %path)
+            return
+        except EnvironmentError:
+            return
+
+        # entries are read from the file as they are asked for
+        self.cache.loader = self._loadTrove
+
+    def _loadChangeSet(self, path):
+        # caches written by older versions of conary; everything is read
+        # up front, and written out again as a TroveCacheFile on save
         try:
             cs = changeset.ChangeSetFromFile(path)
         except filecontainer.BadContainer:
@@ -338,21 +700,20 @@ class TroveCache(trovesource.AbstractTroveSource):
         self._loadDeps()
         self._loadDepSolutions()
         self._loadFileCache()
-        self._startingSizes = self._getSizeTuple()
         self._cs = None
 
+        self._unsaved.update((TroveCacheFile.TROVE, x) for x in self.cache)
+        self._unsaved.update((TroveCacheFile.DEPS, x) for x in self.depCache)
+        self._unsaved.update((TroveCacheFile.TIMESTAMP, x)
+                             for x in self.timeStampCache)
+        self._unsaved.update((TroveCacheFile.FILE, x) for x in self.fileCache)
+
     def _loadPickle(self, pathId):
         self._cs.reset()
         contType, contents = self._cs.getFileContents(pathId, self._fileId)
         pickled = contents.get().read()
         return cPickle.loads(pickled)
 
-    def _savePickle(self, pathId, data):
-        pickled = cPickle.dumps(data, 2)
-        self._cs.addFileContents(pathId, self._fileId,
-                changeset.ChangedFileTypes.file,
-                filecontents.FromString(pickled), False)
-
     def _loadTimestamps(self):
         if self.version < (4, 0):
             return
@@ -361,12 +722,6 @@ class TroveCache(trovesource.AbstractTroveSource):
             thawed = versions.ThawVersion(frozenVersion)
             self.timeStampCache[(name, thawed)] = thawed
 
-    def _saveTimestamps(self):
-        timeStamps = []
-        for (name, baseVersion), version in self.timeStampCache.items():
-            timeStamps.append( (name, version.freeze()) )
-        self._savePickle(self._timeStampsPathId, timeStamps)
-
     def _loadDeps(self):
         depList = self._loadPickle(self._depCachePathId)
         for (name, thawedVersion, frzFlavor, prov, req) in depList:
@@ -374,18 +729,6 @@ class TroveCache(trovesource.AbstractTroveSource):
             flavor = deps.ThawFlavor(frzFlavor)
             self.depCache[ (name, version, flavor) ] = (prov, req)
 
-    def _saveDeps(self):
-        depList = []
-        for troveTup, (prov, req) in self.depCache.iteritems():
-            if type(prov) is not str and prov is not None:
-                prov = prov.freeze()
-            if type(req) is not str and req is not None:
-                req = req.freeze()
-
-            depList.append((troveTup[0], troveTup[1].asString(),
-                            troveTup[2].freeze(), prov, req))
-        self._savePickle(self._depCachePathId, depList)
-
     def _loadDepSolutions(self):
         if self.version < (3, 0):
             # Version 1 was missing timestamps, which interferes with dep
@@ -403,81 +746,64 @@ class TroveCache(trovesource.AbstractTroveSource):
                     for x in resultList])
             self.addDepSolution(sig, depSet, allResults)
 
-    def _saveDepSolutions(self):
-        depSolutions = []
-        for (sig, depSet), aResult in self.depSolutionCache.iteritems():
-            allResults = []
-            for resultList in aResult:
-                allResults.append([ (x[0], x[1].freeze(), x[2].freeze()) for
-                                     x in resultList ])
-
-            depSolutions.append( (sig, depSet.freeze(), allResults) )
-        self._savePickle(self._depSolutionsPathId, depSolutions)
-
     def _loadFindCache(self):
         self.findCache = self._loadPickle(self._findCachePathId)
 
-    def _saveFindCache(self):
-        self._savePickle(self._findCachePathId, self.findCache)
-
     def _loadFileCache(self):
         if self.version < (1, 0):
             return
         self.fileCache = self._loadPickle(self._includeFilePathId)
 
-    def _saveFileCache(self):
-        self._savePickle(self._includeFilePathId, self.fileCache)
+    def _iterUnsaved(self):
+        for kind, key in self._unsaved:
+            if kind == TroveCacheFile.TROVE:
+                # we just assume everything in the cache is w/o files. it's
+                # fine for system model, safe, and we don't need the cache
+                # anywhere else
+                trv = dict.__getitem__(self.cache, key)[1]
+                yield (kind, _troveKey(key),
+                       trv.diff(None, absolute = True)[0].freeze())
+            elif kind == TroveCacheFile.DEPS:
+                prov, req = self.depCache[key]
+                if type(prov) is not str and prov is not None:
+                    prov = prov.freeze()
+                if type(req) is not str and req is not None:
+                    req = req.freeze()
+                yield (kind, _troveKey(key), cPickle.dumps((prov, req), 2))
+            elif kind == TroveCacheFile.TIMESTAMP:
+                yield (kind, _timeStampKey(*key),
+                       self.timeStampCache[key].freeze())
+            elif kind == TroveCacheFile.DEP_SOLUTION:
+                sig, depSet = key
+                allResults = [ [ (x[0], x[1].freeze(), x[2].freeze())
+                                 for x in resultList ]
+                               for resultList in self.depSolutionCache[key] ]
+                yield (kind, sig + depSet.freeze(),
+                       cPickle.dumps(allResults, 2))
+            else:
+                assert(kind == TroveCacheFile.FILE)
+                yield (kind, key, cPickle.dumps(self.fileCache[key], 2))
 
     def save(self, path):
-        # return early if we aren't going to have permission to save
+        if self._file is not None and self._file.path == path and \
+                not self._unsaved:
+            return
+
+        records = list(self._iterUnsaved())
         try:
-            fd, cacheName = tempfile.mkstemp(
-                    prefix=os.path.basename(path) + '.',
-                    dir=os.path.dirname(path))
-            os.close(fd)
-        except (IOError, OSError):
+            if (self._file is None or self._file.path != path or
+                    not self._file.append(records)):
+                TroveCacheFile.write(path, records, copyFrom = self._file)
+            newFile = TroveCacheFile(path)
+        except (EnvironmentError, BadTroveCacheFile):
             # may not have permissions; say, not running as root
             return
 
-        cs = changeset.ChangeSet()
-        for withFiles, trv in self.cache.values():
-            # we just assume everything in the cache is w/o files. it's
-            # fine for system model, safe, and we don't need the cache
-            # anywhere else
-            cs.newTrove(trv.diff(None, absolute = True)[0])
-
-        # NB: "fileid" and pathid got reversed here by mistake, try not to
-        # think too hard about it.
-        cs.addFileContents(
-                           self._fileId,
-                           self._troveCacheVersionPathId,
-                           changeset.ChangedFileTypes.file,
-                           filecontents.FromString("%d %d" % self.VERSION),
-                           False)
-        self._cs = cs
-        self._saveTimestamps()
-        self._saveDeps()
-        self._saveDepSolutions()
-        self._saveFileCache()
-        self._cs = None
-
-        try:
-            try:
-                cs.writeToFile(cacheName)
-                if util.exists(path):
-                    os.chmod(cacheName, os.stat(path).st_mode)
-                else:
-                    os.chmod(cacheName, 0644)
-                os.rename(cacheName, path)
-            except (IOError, OSError):
-                # may not have permissions; say, not running as root
-                pass
-        finally:
-            try:
-                if os.path.exists(cacheName):
-                    os.remove(cacheName)
-            except OSError:
-                pass
+        if self._file is not None:
+            self._file.close()
+        self._file = newFile
+        self.cache.loader = self._loadTrove
+        self._unsaved = set()
 
     def troveIsCached(self, troveTup):
         return troveTup in self.cache
@@ -487,6 +813,13 @@ class TroveCache(trovesource.AbstractTroveSource):
 
     def cacheFile(self, key, contents):
         self.fileCache[key] = contents
+        self._unsaved.add((TroveCacheFile.FILE, key))
 
     def getCachedFile(self, key):
-        return self.fileCache.get(key)
+        contents = self.fileCache.get(key)
+        if contents is None:
+            pickled = self._fromFile(TroveCacheFile.FILE, key)
+            if pickled is not None:
+                contents = cPickle.loads(pickled)
+                self.fileCache[key] = contents
+        return contents
@@ -77,6 +77,13 @@ class AbstractTroveSource:
     def getTroveInfo(self, infoType, troveTupleList):
         raise NotImplementedError
 
+    def getMultipleTroveInfo(self, infoTypes, troveTupleList):
+        """
+        Returns the getTroveInfo() result for each of infoTypes, as a list
+        of lists. Sources which can look them up together override this.
+        """
+        return [ self.getTroveInfo(x, troveTupleList) for x in infoTypes ]
+
     def getTroveLeavesByLabel(self, query, bestFlavor=True,
                               troveTypes=TROVE_QUERY_PRESENT):
         raise NotImplementedError
@@ -1620,21 +1627,32 @@ class SourceStack(object):
         return results
 
     def getTroveInfo(self, infoType, troveTupList):
+        return self.getMultipleTroveInfo([ infoType ], troveTupList)[0]
+
+    def getMultipleTroveInfo(self, infoTypes, troveTupList):
         # -1 means "unknown trove" None means "troveinfo not in the trove"
-        results = [ -1 ] * len(troveTupList)
+        results = [ [ -1 ] * len(troveTupList) for x in infoTypes ]
+        need = range(len(troveTupList))
         for source in self.sources:
-            need = [ (i, troveTup) for i, (troveTup, ti) in
-                        enumerate(itertools.izip(troveTupList, results))
-                        if ti == -1]
             if not need:
                 break
 
-            tiList = source.getTroveInfo(infoType, [ x[1] for x in need] )
-            for (i, troveTup), troveInfo in itertools.izip(need, tiList):
-                if troveInfo == 0:
-                    results[0] = None
-                else:
-                    results[i] = troveInfo
+            tiLists = source.getMultipleTroveInfo(infoTypes,
+                                        [ troveTupList[i] for i in need ])
+            stillNeeded = set()
+            for result, tiList in itertools.izip(results, tiLists):
+                for i, troveInfo in itertools.izip(need, tiList):
+                    # streams don't compare with ints, only the markers do
+                    if not isinstance(result[i], int) or result[i] != -1:
+                        # an earlier source already answered this one
+                        continue
+                    if isinstance(troveInfo, int):
+                        if troveInfo == -1:
+                            stillNeeded.add(i)
+                            continue
+                        troveInfo = None
+                    result[i] = troveInfo
+            need = sorted(stillNeeded)
 
         return results
 
@@ -81,10 +81,11 @@ class NetworkConvertors(object):
             return 0
         return f.freeze()
 
-    def toFile(self, f):
-        pathId = f[:25]
-        return files.ThawFile(base64.decodestring(f[25:]),
-                              self.toPathId(pathId))
+    def toFile(self, f, rawStream = False):
+        pathId, stream = f[:25], f[25:]
+        if not rawStream:
+            stream = base64.decodestring(stream)
+        return files.ThawFile(stream, self.toPathId(pathId))
 
     def fromFile(self, f):
         s = base64.encodestring(f.freeze())
@@ -97,12 +98,14 @@ class NetworkConvertors(object):
 
         return pathId, base64.decodestring(stream)
 
-    def fromFileAsStream(self, pathId, stream, rawPathId = False):
-        s = base64.encodestring(stream)
+    def fromFileAsStream(self, pathId, stream, rawPathId = False,
+                         rawStream = False):
+        if not rawStream:
+            stream = base64.encodestring(stream)
         if not rawPathId:
             pathId = self.fromPathId(pathId)
 
-        return pathId + s
+        return pathId + stream
 
     def fromLabel(self, l):
         return l.asString()
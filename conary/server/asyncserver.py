@@ -0,0 +1,350 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Standalone repository server that multiplexes all of its connections in one
+process with non-blocking sockets and a poll() loop.
+
+Requests are read as the bytes arrive, so a slow client never holds up the
+others. Changeset uploads are streamed into their temporary file, and
+changeset downloads are written whenever the socket has room, with verbatim
+parts going through sendfile(). Once a request has been read completely it
+is dispatched to the regular L{HttpRequests<conary.server.server.HttpRequests>}
+handler, whose output is collected and sent by the loop. XML-RPC calls
+therefore still run one at a time, as they share the repository database
+connection, but they are no longer queued behind transfers.
+"""
+
+import errno
+import select
+import socket
+import StringIO
+
+from conary.lib import util
+from conary.server import server
+
+_WOULDBLOCK = (errno.EAGAIN, errno.EWOULDBLOCK)
+_READ_EVENTS = select.POLLIN | select.POLLPRI
+_CLOSE_EVENTS = select.POLLHUP | select.POLLERR | select.POLLNVAL
+
+
+class _AsyncRequestMixin:
+    """
+    Mixed into the server's request handler class so one request can be
+    processed at a time from a buffer instead of a blocking socket.
+    """
+
+    def __init__(self, sock, clientAddress, httpServer, head):
+        self.request = self.connection = sock
+        self.client_address = clientAddress
+        self.server = httpServer
+        self.rfile = StringIO.StringIO(head)
+        self.wfile = StringIO.StringIO()
+        self.producer = None
+
+    def sendProducer(self, producer):
+        # the event loop sends the body once the headers are written
+        self.producer = producer
+
+
+class _LengthReader(object):
+    """Splits off a request body of known length."""
+
+    def __init__(self, length):
+        self.remaining = length
+        self.done = not length
+
+    def feed(self, data):
+        data = data[:self.remaining]
+        self.remaining -= len(data)
+        self.done = not self.remaining
+        return [ data ]
+
+
+class _ChunkedReader(object):
+    """Decodes a request body sent with chunked transfer encoding."""
+
+    def __init__(self):
+        self.buf = ''
+        self.remaining = None
+        self.done = False
+
+    def feed(self, data):
+        self.buf += data
+        out = []
+        while not self.done:
+            if self.remaining is None:
+                # chunk size line
+                idx = self.buf.find('\r\n')
+                if idx < 0:
+                    break
+                self.remaining = int(self.buf[:idx].split(';')[0], 16)
+                self.buf = self.buf[idx + 2:]
+                if not self.remaining:
+                    # the trailer is ignored, like HttpRequests.do_PUT does
+                    self.done = True
+            elif self.remaining:
+                chunk = self.buf[:self.remaining]
+                self.buf = self.buf[len(chunk):]
+                self.remaining -= len(chunk)
+                out.append(chunk)
+                if self.remaining:
+                    break
+            elif len(self.buf) >= 2:
+                # the CRLF after the chunk data
+                self.buf = self.buf[2:]
+                self.remaining = None
+            else:
+                break
+        return out
+
+
+class Connection(object):
+    """One client connection, serving a single request."""
+
+    maxHeaderSize = 65536
+
+    def __init__(self, httpServer, sock, clientAddress):
+        self.server = httpServer
+        self.sock = sock
+        self.fd = sock.fileno()
+        self.clientAddress = clientAddress
+        self.head = ''
+        self.handler = None
+        self.reader = None
+        self.body = None
+        self.upload = None
+        self.responding = False
+        self.outbuf = ''
+        self.segments = None
+        self.fileRange = None
+
+    def handleRead(self):
+        try:
+            data = self.sock.recv(self.server.bufSize)
+        except socket.error, err:
+            if err.args[0] in _WOULDBLOCK:
+                return
+            raise
+        if not data:
+            self.close()
+            return
+        if self.responding:
+            # nothing more is read once the response has started
+            return
+
+        if self.handler is None:
+            self.head += data
+            idx = self.head.find('\r\n\r\n')
+            if idx < 0:
+                if len(self.head) > self.maxHeaderSize:
+                    self.close()
+                return
+            head, data = self.head[:idx + 4], self.head[idx + 4:]
+            self.head = ''
+            if not self._startRequest(head):
+                self._respond()
+                return
+
+        for chunk in self.reader.feed(data):
+            if chunk:
+                self.body.write(chunk)
+        if self.reader.done:
+            self._finishRequest()
+
+    def _startRequest(self, head):
+        handler = self.server.RequestHandlerClass(self.sock,
+                self.clientAddress, self.server, head)
+        self.handler = handler
+        handler.raw_requestline = handler.rfile.readline()
+        if not handler.parse_request():
+            return False
+
+        headers = handler.headers
+        chunked = 'chunked' in headers.get('Transfer-encoding', '')
+        if chunked:
+            self.reader = _ChunkedReader()
+        else:
+            self.reader = _LengthReader(int(headers.get('Content-Length', 0)))
+
+        if (handler.command == 'PUT' and not handler.cfg.proxyContentsDir
+                and (chunked or 'Content-Length' in headers)):
+            # changeset uploads go straight to their file
+            self.upload = handler.openUpload()
+            if self.upload is None:
+                return False
+            self.body = self.upload
+        else:
+            self.body = util.BoundedStringIO()
+        return True
+
+    def _finishRequest(self):
+        handler = self.handler
+        if self.upload is not None:
+            self.upload.close()
+            self.upload = None
+            handler.send_response(200)
+            handler.end_headers()
+        else:
+            self.body.seek(0)
+            handler.rfile = self.body
+            method = getattr(handler, 'do_' + handler.command, None)
+            if method is None:
+                handler.send_error(501,
+                        "Unsupported method (%r)" % handler.command)
+            else:
+                method()
+        self._respond()
+
+    def _respond(self):
+        self.responding = True
+        self.outbuf = self.handler.wfile.getvalue()
+        if self.handler.producer is not None:
+            self.segments = self.handler.producer.iterSegments()
+        self.server.setEvents(self, select.POLLOUT)
+
+    def handleWrite(self):
+        bufSize = self.server.bufSize
+        while True:
+            if self.outbuf:
+                try:
+                    sent = self.sock.send(self.outbuf[:bufSize])
+                except socket.error, err:
+                    if err.args[0] in _WOULDBLOCK:
+                        return
+                    raise
+                self.outbuf = self.outbuf[sent:]
+            elif self.fileRange is not None:
+                fileRange = self.fileRange
+                try:
+                    sent = util.sendfile(self.fd, fileRange.fd,
+                            fileRange.offset, min(fileRange.size, 16 * bufSize))
+                except OSError, err:
+                    if err.errno in _WOULDBLOCK:
+                        return
+                    raise socket.error(err.errno, err.strerror)
+                if not sent:
+                    raise IOError(errno.EIO,
+                            "file is shorter than the requested range")
+                fileRange = fileRange.skip(sent)
+                if fileRange.size:
+                    self.fileRange = fileRange
+                else:
+                    self.fileRange = None
+            elif self.segments is not None:
+                try:
+                    data = self.segments.next()
+                except StopIteration:
+                    self.segments = None
+                    continue
+                if isinstance(data, util.FileRange):
+                    self.fileRange = data
+                else:
+                    self.outbuf = data
+            else:
+                self.close()
+                return
+
+    def close(self):
+        self.server.removeConnection(self)
+        if self.upload is not None:
+            self.upload.close()
+            self.upload = None
+        if self.segments is not None:
+            # an unfinished download keeps its files for a Range request
+            self.segments.close()
+            self.segments = None
+        # Drain whatever the client still sent so closing doesn't reset the
+        # connection before it read the response
+        try:
+            while self.sock.recv(self.server.bufSize):
+                pass
+        except socket.error:
+            pass
+        self.sock.close()
+
+
+class AsyncHTTPServer(server.HTTPServer):
+    """
+    Serve many connections at once from a single process. Call
+    L{handleEvents} in a loop instead of C{handle_request}.
+    """
+
+    eventLoop = True
+    bufSize = 65536
+    request_queue_size = 128
+    connectionFactory = Connection
+
+    def __init__(self, server_address, RequestHandlerClass):
+        class AsyncRequests(_AsyncRequestMixin, RequestHandlerClass):
+            pass
+        AsyncRequests.__name__ = RequestHandlerClass.__name__
+        server.HTTPServer.__init__(self, server_address, AsyncRequests)
+        self.socket.setblocking(0)
+        self.connections = {}
+        self.poller = select.poll()
+        self.poller.register(self.socket.fileno(), select.POLLIN)
+
+    def handleEvents(self, timeout=None):
+        """Wait for activity on any connection and process it."""
+        listenFd = self.socket.fileno()
+        for fd, events in self.poller.poll(timeout):
+            if fd == listenFd:
+                self._accept()
+                continue
+            conn = self.connections.get(fd)
+            if conn is None:
+                continue
+            try:
+                if events & select.POLLOUT:
+                    conn.handleWrite()
+                elif events & (_READ_EVENTS | _CLOSE_EVENTS):
+                    conn.handleRead()
+            except socket.error:
+                # the client went away
+                if fd in self.connections:
+                    conn.close()
+            except:
+                self.handle_error(conn.sock, conn.clientAddress)
+                if fd in self.connections:
+                    conn.close()
+
+    def _accept(self):
+        while True:
+            try:
+                sock, clientAddress = self.socket.accept()
+            except socket.error, err:
+                if err.args[0] in _WOULDBLOCK:
+                    return
+                elif err.args[0] in (errno.ECONNABORTED, errno.EINTR):
+                    continue
+                raise
+            sock.setblocking(0)
+            conn = self.connectionFactory(self, sock, clientAddress)
+            self.connections[conn.fd] = conn
+            self.poller.register(conn.fd, _READ_EVENTS)
+
+    def setEvents(self, conn, events):
+        self.poller.modify(conn.fd, events)
+
+    def removeConnection(self, conn):
+        if self.connections.pop(conn.fd, None) is not None:
+            self.poller.unregister(conn.fd)
+
+    def server_close(self):
+        for conn in self.connections.values():
+            conn.close()
+        server.HTTPServer.server_close(self)
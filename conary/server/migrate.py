@@ -781,7 +781,7 @@ class MigrateTo_17(SchemaMigration):
         return True
 
 class MigrateTo_18(SchemaMigration):
-    Version = 18
+    Version = (18, 2)
     def migrate(self):
         cu = self.db.cursor()
         cu.execute("alter table instances add column "
@@ -799,12 +799,17 @@ class MigrateTo_18(SchemaMigration):
                 % self.db.keywords)
         return True
 
+    # dropping the unused Prefixes and CheckTroveCache tables was never
+    # enabled here, and moving to 18.2 for the generation counters
+    # shouldn't start doing it; leave it to a migration of its own
     def migrate1(self):
+        return True
+
+    # add the LatestCache generation counters
+    def migrate2(self):
         cu = self.db.cursor()
-        if 'Prefixes' in self.db.tables:
-            cu.execute("DROP TABLE Prefixes")
-        if 'CheckTroveCache' in self.db.tables:
-            cu.execute("DROP TABLE CheckTroveCache")
+        cu.execute("ALTER TABLE Items ADD COLUMN "
+                   "latestGeneration INTEGER NOT NULL DEFAULT 0")
         return True
 
 def _getMigration(major):
@@ -611,6 +611,7 @@ def createTroves(db, createIndex = True):
     if createIndex:
         db.createIndex("FilePaths", "FilesPathDirnameIdx", "dirnameId")
         db.createIndex("FilePaths", "FilesPathBasenameIdx", "basenameId")
+        db.createIndex("FilePaths", "FilesPathPathIdIdx", "pathId")
         if createTrigger(db, "FilePaths"):
             commit = True
 
@@ -858,7 +859,8 @@ def createIdTables(db):
         CREATE TABLE Items(
             itemId      %(PRIMARYKEY)s,
             item        VARCHAR(254),
-            hasTrove    INTEGER NOT NULL DEFAULT 0
+            hasTrove    INTEGER NOT NULL DEFAULT 0,
+            latestGeneration INTEGER NOT NULL DEFAULT 0
         ) %(TABLEOPTS)s""" % db.keywords)
         db.tables["Items"] = []
         cu.execute("INSERT INTO Items (itemId, item) VALUES (0, 'ALL')")
@@ -124,17 +124,42 @@ class HttpRequests(SimpleHTTPRequestHandler):
                     return None
                 raise
 
-            self.send_response(200)
+            contentRange = producer.setRange(self.headers.get('Range'))
+            if contentRange:
+                self.send_response(206)
+                self.send_header("Content-Range", contentRange)
+            else:
+                self.send_response(200)
             self.send_header("Content-type", "application/octet-stream")
             self.send_header("Content-Length", str(producer.getSize()))
+            self.send_header("Accept-Ranges", "bytes")
             self.end_headers()
+            self.sendProducer(producer)
+        else:
+            self.send_error(501)
+
+    def sendProducer(self, producer):
+        """Write the body of a changeset download."""
+        if self.server.isSecure:
             for data in producer:
                 self.wfile.write(data)
         else:
-            self.send_error(501)
+            self._sendSegments(producer)
+
+    def _sendSegments(self, producer):
+        # verbatim parts of the changeset go straight from the file to the
+        # socket without being read into the interpreter
+        outFd = self.connection.fileno()
+        for data in producer.iterSegments():
+            if isinstance(data, util.FileRange):
+                self.wfile.flush()
+                data.sendTo(outFd)
+            else:
+                self.wfile.write(data)
 
     def do_POST(self):
-        if self.headers.get('Content-Type', '') == 'text/xml':
+        if self.headers.get('Content-Type', '') in ('text/xml',
+                util.BINRPC_CONTENT_TYPE):
             authToken = self.getAuth()
             if authToken is None:
                 return
@@ -205,7 +230,15 @@ class HttpRequests(SimpleHTTPRequestHandler):
             sio = util.decompressStream(sio)
             sio.seek(0)
 
-        (params, method) = util.xmlrpcLoad(sio)
+        binary = self.headers['Content-Type'] == util.BINRPC_CONTENT_TYPE
+        if binary:
+            try:
+                (params, method) = util.binrpcLoad(sio)
+            except (TypeError, ValueError, IndexError):
+                self.send_error(400)
+                return None
+        else:
+            (params, method) = util.xmlrpcLoad(sio)
         logMe(3, "decoded xml-rpc call %s from %d bytes request" %(method, contentLength))
 
         if self.netProxy:
@@ -218,6 +251,10 @@ class HttpRequests(SimpleHTTPRequestHandler):
             localHost = '[%s]' % localHost
         localAddr = '%s:%s' % (localHost, localPort)
         request = xmlshims.RequestArgs.fromWire(params)
+        if not binary and request.version >= netclient.BINARY_RPC_VERSION:
+            # results can hold raw byte strings from this version on
+            self.send_error(400)
+            return None
 
         if repos is not None:
             try:
@@ -251,7 +288,10 @@ class HttpRequests(SimpleHTTPRequestHandler):
         rawResponse, headers = response.toWire(request.version)
 
         sio = util.BoundedStringIO()
-        util.xmlrpcDump((rawResponse,), stream = sio, methodresponse=1)
+        if binary:
+            sio.write(util.binrpcDump((rawResponse,)))
+        else:
+            util.xmlrpcDump((rawResponse,), stream = sio, methodresponse=1)
         respLen = sio.tell()
         logMe(3, "encoded xml-rpc response to %d bytes" % respLen)
 
@@ -262,7 +302,10 @@ class HttpRequests(SimpleHTTPRequestHandler):
             sio = util.compressStream(sio, level = 5)
             respLen = sio.tell()
             self.send_header('Content-encoding', 'deflate')
-        self.send_header("Content-type", "text/xml")
+        if binary:
+            self.send_header("Content-type", util.BINRPC_CONTENT_TYPE)
+        else:
+            self.send_header("Content-type", "text/xml")
         self.send_header("Content-length", str(respLen))
         for key, value in sorted(headers.items()):
             self.send_header(key, value)
@@ -297,19 +340,9 @@ class HttpRequests(SimpleHTTPRequestHandler):
             self.send_response(status)
             return
 
-        path = self.path.split("?")[-1]
-
-        if '/' in path:
-            self.send_error(403)
-
-        path = self.tmpDir + '/' + path + "-in"
-
-        size = os.stat(path).st_size
-        if size != 0:
-            self.send_error(410)
+        out = self.openUpload()
+        if out is None:
             return
-
-        out = open(path, "w")
         try:
             if chunked:
                 while 1:
@@ -328,8 +361,29 @@ class HttpRequests(SimpleHTTPRequestHandler):
         self.send_response(200)
         self.end_headers()
 
+    def openUpload(self):
+        """
+        Open the file a changeset upload is stored in, or send an error and
+        return C{None} if the upload is not allowed.
+        """
+        path = self.path.split("?")[-1]
+
+        if '/' in path:
+            self.send_error(403)
+            return None
+
+        path = self.tmpDir + '/' + path + "-in"
+
+        size = os.stat(path).st_size
+        if size != 0:
+            self.send_error(410)
+            return None
+
+        return open(path, "w")
+
 class HTTPServer(BaseHTTPServer.HTTPServer):
     isSecure = False
+    eventLoop = False
 
     def __init__(self, server_address, *args, **kwargs):
         # Override to support arbitrary IPv4 or IPv6 binds, and especially so
@@ -407,6 +461,7 @@ if SSL:
 
 class ServerConfig(netserver.ServerConfig):
 
+    asyncServer             = CfgBool
     port                    = (CfgInt,  8000)
     sslCert                 = CfgPath
     sslKey                  = CfgPath
@@ -560,6 +615,9 @@ def getServer(argv = sys.argv, reqClass = HttpRequests):
             if not os.path.exists(f):
                 print errmsg + " %s does not exist" % f
                 sys.exit(1)
+        if cfg.asyncServer:
+            print errmsg + " The asyncServer mode does not support SSL."
+            sys.exit(1)
 
     if cfg.proxyContentsDir:
         if len(otherArgs) > 1:
@@ -645,6 +703,9 @@ def getServer(argv = sys.argv, reqClass = HttpRequests):
     if cfg.useSSL:
         ctx = createSSLContext(cfg)
         httpServer = SecureHTTPServer(("", cfg.port), reqClass, ctx)
+    elif cfg.asyncServer:
+        from conary.server import asyncserver
+        httpServer = asyncserver.AsyncHTTPServer(("", cfg.port), reqClass)
     else:
         httpServer = HTTPServer(("", cfg.port), reqClass)
     return httpServer, profiler
@@ -661,6 +722,10 @@ def serve(httpServer, profiler=None):
 
     while True:
         try:
+            if httpServer.eventLoop:
+                # the server multiplexes its connections itself
+                httpServer.handleEvents()
+                continue
             events = p.poll()
             for (fd, event) in events:
                 fds[fd].handle_request()
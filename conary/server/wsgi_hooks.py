@@ -410,7 +410,8 @@ class ConaryHandler(object):
         elif self.request.method == 'POST':
             # Only check content-type because of proxying considerations; as
             # above, the full URL will vary.
-            if self.request.content_type == 'text/xml':
+            if self.request.content_type in ('text/xml',
+                    util.BINRPC_CONTENT_TYPE):
                 return self.postRpc()
             # Fall through to web handler
         elif self.request.method == 'PUT':
@@ -430,7 +431,9 @@ class ConaryHandler(object):
         return web._handleRequest(request)
 
     def postRpc(self):
-        if self.request.content_type != 'text/xml':
+        contentType = self.request.content_type
+        binary = contentType == util.BINRPC_CONTENT_TYPE
+        if contentType != 'text/xml' and not binary:
             return self._makeError('400 Bad Request',
                     "Unrecognized Content-Type")
         stream = self.request.body_file
@@ -443,7 +446,10 @@ class ConaryHandler(object):
                     "Unrecognized Content-Encoding")
 
         try:
-            params, method = util.xmlrpcLoad(stream)
+            if binary:
+                params, method = util.binrpcLoad(stream)
+            else:
+                params, method = util.xmlrpcLoad(stream)
         except:
             return self._makeError('400 Bad Request',
                     "Malformed XMLRPC request")
@@ -454,6 +460,11 @@ class ConaryHandler(object):
         except (TypeError, ValueError, IndexError):
             return self._makeError('400 Bad Request',
                     "Malformed XMLRPC arguments")
+        if not binary and request.version >= netclient.BINARY_RPC_VERSION:
+            # results can hold raw byte strings from this version on
+            return self._makeError('400 Bad Request',
+                    "Protocol version %d requires the binary RPC encoding"
+                    % request.version)
 
         rawUrl = self.request.url
         scheme = self.request.headers.get('X-Conary-Proxy-Target-Scheme')
@@ -482,10 +493,14 @@ class ConaryHandler(object):
             headers['Via'] = proxy.formatViaHeader(localAddr,
                     self.request.http_version, prefix=extraInfo.getVia())
         response = self.responseFactory(headerlist=headers.items())
-        response.content_type = 'text/xml'
 
         # Output phase -- serialize and write the response
-        body = util.xmlrpcDump((rawResponse,), methodresponse=1)
+        if binary:
+            response.content_type = util.BINRPC_CONTENT_TYPE
+            body = util.binrpcDump((rawResponse,))
+        else:
+            response.content_type = 'text/xml'
+            body = util.xmlrpcDump((rawResponse,), methodresponse=1)
         accept = self.request.accept_encoding
         if len(body) > 200 and 'deflate' in accept:
             response.content_encoding = 'deflate'
@@ -516,12 +531,31 @@ class ConaryHandler(object):
             if err.args[0] == errno.ENOENT:
                 return self._makeError('404 Not Found', "Changeset not found")
             raise
-        return self.responseFactory(
-                status='200 OK',
-                app_iter=producer,
+        status = '200 OK'
+        contentRange = None
+        if filename is None:
+            # Direct download, possibly resuming an interrupted one
+            contentRange = producer.setRange(self.request.headers.get('Range'))
+            if contentRange:
+                status = '206 Partial Content'
+        size = producer.getSize()
+        appIter = producer
+        # Let the server send a single verbatim file with sendfile()
+        fileWrapper = self.request.environ.get('wsgi.file_wrapper')
+        if fileWrapper is not None:
+            fobj = producer.getFileObject()
+            if fobj is not None:
+                appIter = fileWrapper(fobj, 65536)
+        response = self.responseFactory(
+                status=status,
+                app_iter=appIter,
                 content_type='application/x-conary-change-set',
-                content_length=str(producer.getSize()),
+                content_length=str(size),
                 )
+        response.headers['Accept-Ranges'] = 'bytes'
+        if contentRange:
+            response.headers['Content-Range'] = contentRange
+        return response
 
     def inlineChangeset(self, rpcResponse, responseArgs, headers):
         filename = responseArgs.result[0].split('?')[-1]
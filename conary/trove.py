@@ -19,6 +19,7 @@
 Implements troves (packages, components, etc.) for the repository
 """
 
+import cPickle
 import itertools, os
 import re
 import struct
@@ -31,7 +32,7 @@ from conary import streams
 from conary import trovetup
 from conary import versions
 from conary.deps import deps
-from conary.lib import sha1helper, api
+from conary.lib import sha1helper, api, util
 from conary.lib.openpgpfile import KeyNotFound, TRUST_UNTRUSTED, TRUST_TRUSTED
 from conary.lib import openpgpkey
 from conary.lib.ext import pack
@@ -2312,7 +2313,8 @@ class Trove(streams.StreamSet):
         return not self == them
 
     @api.publicApi
-    def diff(self, them, absolute = 0, getPathHashes = None):
+    def diff(self, them, absolute = 0, getPathHashes = None,
+             scoreCache = None):
         """
         Generates a change set between them (considered the old
         version) and this instance. We return the change set, a list
@@ -2332,6 +2334,9 @@ class Trove(streams.StreamSet):
         @param absolute: tells if this is a new group or an absolute change
         when them is None
         @type absolute: boolean
+        @param scoreCache: cache of flavor scores used to match up troves
+        which changed flavor
+        @type scoreCache: FlavorScoreCache
         @rtype: (TroveChangeSet, fileChangeList, troveChangeList)
         """
 
@@ -2499,10 +2504,12 @@ class Trove(streams.StreamSet):
                                         True))
 
             else:
-                trvList = self._diffPackages(added, removed, getPathHashes)
+                trvList = self._diffPackages(added, removed, getPathHashes,
+                                             scoreCache)
         return (chgSet, filesNeeded, trvList)
 
-    def _diffPackages(self, addedDict, removedDict, getPathHashes):
+    def _diffPackages(self, addedDict, removedDict, getPathHashes,
+                      scoreCache = None):
         """
             Matches up the list of troves that have been added to those
             that were removed.  Matches are done by name first,
@@ -3017,7 +3024,8 @@ class Trove(streams.StreamSet):
         (addedByPackage,
          removedByPackage) = _getCompsByPackage(addedDict, removedDict)
 
-        scoreCache = FlavorScoreCache()
+        if scoreCache is None:
+            scoreCache = FlavorScoreCache()
 
         # match packages/groups first, then components that are not
         # matched as part of that.
@@ -4062,10 +4070,76 @@ class ThawTroveChangeSet(AbstractTroveChangeSet):
 
 
 class FlavorScoreCache(object):
-    def __init__(self):
-        self.cache = {}
+    """
+    Caches the result of scoring pairs of flavors against each other.
+
+    Entries are keyed by the pair of flavors, which hash on their frozen
+    form. At most C{limit} recent entries are kept in memory (plus the
+    generation before them). If C{path} is given, entries are read from
+    that file the first time the cache is used, and L{save} writes them
+    back (frozen) so later processes can skip scoring the same pairs
+    again. Nothing is written until L{save} is called.
+    """
+
+    FORMAT = 1
+
+    def __init__(self, path = None, limit = 20000):
         self.NEG_INF = -9999
         self.POS_INF = 9999
+        self.path = path
+        self.limit = limit
+        self.cache = {}
+        self.old = {}
+        self.loaded = (path is None)
+        self.dirty = False
+
+    def _load(self):
+        self.loaded = True
+        try:
+            f = open(self.path, 'rb')
+        except (IOError, OSError):
+            return
+        try:
+            try:
+                version, entries = cPickle.load(f)
+            except Exception:
+                # the cache is only an optimization; a damaged file is
+                # simply ignored and rewritten by the next save
+                return
+        finally:
+            f.close()
+        if version == self.FORMAT and isinstance(entries, dict):
+            self.old.update(((deps.ThawFlavor(x[0][0]),
+                              deps.ThawFlavor(x[0][1])), x[1])
+                            for x in entries.iteritems())
+
+    def _store(self, key, score):
+        if len(self.cache) >= self.limit:
+            self.old = self.cache
+            self.cache = {}
+        self.cache[key] = score
+
+    def save(self):
+        """
+        Write the cached scores to C{path}. Errors writing the file are
+        ignored, as the cache can always be rebuilt.
+        """
+        if self.path is None or not self.dirty:
+            return
+        entries = dict(((x[0][0].freeze(), x[0][1].freeze()), x[1])
+                       for x in itertools.chain(self.old.iteritems(),
+                                                self.cache.iteritems()))
+        try:
+            f = util.AtomicFile(self.path, chmod = 0644)
+            try:
+                cPickle.dump((self.FORMAT, entries), f,
+                             cPickle.HIGHEST_PROTOCOL)
+                f.commit()
+            finally:
+                f.close()
+        except (IOError, OSError):
+            return
+        self.dirty = False
 
     def matches(self, oldFlavor, newFlavor):
         return (self[oldFlavor, newFlavor] > self.NEG_INF)
@@ -4080,18 +4154,25 @@ class FlavorScoreCache(object):
         # If we do that, we should consider adding
         # heuristic to prefer strongly satisfied
         # flavors most of all.
-        if not (oldFlavor, newFlavor) in self.cache:
+        key = (oldFlavor, newFlavor)
+        myMax = self.cache.get(key)
+        if myMax is not None:
+            return myMax
+
+        if not self.loaded:
+            self._load()
+        myMax = self.old.get(key)
+        if myMax is None:
             if oldFlavor.isEmpty() and newFlavor.isEmpty():
                 myMax = self.POS_INF
             else:
                 scores = (self.NEG_INF, newFlavor.score(oldFlavor),
                           oldFlavor.score(newFlavor))
                 myMax = max(x for x in scores if x is not False)
-            self.cache[oldFlavor, newFlavor] = myMax
-            self.cache[newFlavor, oldFlavor] = myMax
-            return myMax
-        else:
-            return self.cache[oldFlavor, newFlavor]
+            self.dirty = True
+        self._store(key, myMax)
+        self._store((newFlavor, oldFlavor), myMax)
+        return myMax
 
 class TroveError(errors.ConaryError):
 
@@ -617,6 +617,17 @@ The following dependencies would not be met after this update:
         overlappingNames = sorted([ sorted([y[0] for y in x]) for x in  overlapping])
         assert(overlappingNames == [['bam:run', 'foo:run', 'test:run'], ['baz2:run', 'baz3:run', 'baz4:run', 'baz:run']])
 
+        # path hashes in the cache are not looked up again
+        pathHashCache = {}
+        cl._findOverlappingJobs(job, uJob.getTroveSource(),
+                                pathHashCache = pathHashCache)
+        self.assertEqual(len(pathHashCache), 9)
+        uJob = database.UpdateJob(cl.db)
+        overlapping = cl._findOverlappingJobs(job, uJob.getTroveSource(),
+                                              pathHashCache = pathHashCache)
+        self.assertEqual(sorted(sorted(y[0] for y in x) for x in overlapping),
+                         overlappingNames)
+
     def testDisconnectRepos(self):
         flv = parseFlavor('is: x86')
         self.addComponent('foo:run', '1', flv, fileContents='foo 1\n')
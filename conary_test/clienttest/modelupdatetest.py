@@ -154,6 +154,36 @@ class ModelUpdateTest(rephelp.RepositoryHelper):
                           'install another'],
                           addSearchLabel=False)
 
+    @testhelp.context('sysmodel')
+    def testParallelSearches(self):
+        for i in range(4):
+            self.addComponent('foo%d:runtime=1.0' % i,
+                              fileContents = [ ('/foo%d' % i, '1.0') ])
+            self.addCollection('foo%d=1.0' % i, [ ':runtime' ])
+            self.addComponent('foo%d:runtime=2.0' % i,
+                              fileContents = [ ('/foo%d' % i, '2.0') ])
+            self.addCollection('foo%d=2.0' % i, [ ':runtime' ])
+        self.addCollection('group-foo=1.0',
+                           [ 'foo%d' % i for i in range(4) ],
+                           weakRefList = [ 'foo%d:runtime' % i
+                                           for i in range(4) ])
+
+        oldThreads = self.cfg.modelSearchThreads
+        self.cfg.modelSearchThreads = 4
+        try:
+            self._applyModel([ 'search group-foo=localhost@rpl:linux/1.0',
+                               'install foo0 foo1',
+                               'search localhost@rpl:linux',
+                               'install foo2=2.0 foo3=1.0' ],
+                             addSearchLabel=False)
+        finally:
+            self.cfg.modelSearchThreads = oldThreads
+
+        self.verifyFile(self.rootDir + '/foo0', '1.0')
+        self.verifyFile(self.rootDir + '/foo1', '1.0')
+        self.verifyFile(self.rootDir + '/foo2', '2.0')
+        self.verifyFile(self.rootDir + '/foo3', '1.0')
+
     @testhelp.context('sysmodel')
     def testInstallWinsOverSearchPath(self):
         self.addComponent('foo:runtime=1.0', fileContents = [ ('/foo', '1.0') ])
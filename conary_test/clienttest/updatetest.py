@@ -3385,6 +3385,51 @@ conary erase 'test:runtime=/localhost@rpl:linux/2.0-1-1[]'
 #
 ######################################################
 
+    def testConcurrentJobSetDownloads(self):
+        names = [ 'foo%d:run' % i for i in range(6) ]
+        for i, name in enumerate(names):
+            self.addComponent(name, '1', filePrimer = i)
+        self.cfg.updateThreshold = 1
+        self.cfg.downloadJobSets = 3
+        # only the next job set to be applied fits in the buffer
+        self.cfg.downloadBufferSize = 1
+        # (job set applied, job sets started downloading by then)
+        applied = []
+        started = []
+        applyCs = update.ClientUpdate._applyCs
+        createLocalCs = update.ClientUpdate._createLocalCs
+        def _applyCs(client, cs, uJob, **kwargs):
+            applied.append((kwargs['jobIdx'], len(started)))
+            return applyCs(client, cs, uJob, **kwargs)
+        def _createLocalCs(client, jobSet, uJob):
+            started.append(jobSet)
+            return createLocalCs(client, jobSet, uJob)
+        self.mock(update.ClientUpdate, '_applyCs', _applyCs)
+        self.mock(update.ClientUpdate, '_createLocalCs', _createLocalCs)
+        self.updatePkg(names)
+        self.unmock()
+        db = self.openDatabase()
+        self.assertEqual(sorted(db.iterAllTroveNames()), names)
+        # job sets are applied in order; the buffer only lets a job set
+        # start ahead while no downloaded one is waiting, so no more than
+        # one per worker gets ahead of the one being applied
+        self.assertEqual([ x[0] for x in applied ], range(len(names)))
+        for jobIdx, startedCount in applied:
+            self.assertTrue(startedCount <= jobIdx + 3)
+
+        # download failures in any worker stop the update
+        self.resetRoot()
+        self.cfg.downloadBufferSize = 0
+        try:
+            self.updatePkg(names,
+                       callback = FailureUpdateCallback('downloadingChangeSet'))
+        except Exception, e:
+            self.assertEqual(e.args[0], 'downloadingChangeSet')
+        else:
+            self.fail("Exception expected but not raised")
+        db = self.openDatabase()
+        assert(len([ x for x in db.iterAllTroveNames() ]) == 0)
+
     def testCallbackFailure(self):
         self.addComponent('foo:run', '1', filePrimer = 0)
         self.addComponent('bar:run', '1', filePrimer = 1)
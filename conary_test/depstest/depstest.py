@@ -54,6 +54,7 @@ from conary.deps.deps import (
         InstructionSetDependency,
         flavorDifferences,
         DependencyMatcher,
+        CompactDependencyMatcher,
         )
 
 class DepsTest(unittest.TestCase):
@@ -946,7 +947,39 @@ class DepsTest(unittest.TestCase):
             self.assertEqual(actual, expected)
 
     def testDependencyMatcher(self):
-        m = DependencyMatcher(ignoreDepClasses=[AbiDependency])
+        self._testMatcher(DependencyMatcher)
+
+    def testCompactDependencyMatcher(self):
+        self._testMatcher(CompactDependencyMatcher)
+
+        m = CompactDependencyMatcher()
+        m.add(parseDep('soname: ELF64/libc.so.6(GLIBC_2.2.5 GLIBC_2.3 SysV)'), 'glibc')
+        m.add(parseDep('soname: ELF64/libc.so.6(GLIBC_2.2.5 SysV)'), 'oldglibc')
+        self.assertEqual(m.find(parseDep('soname: ELF64/libc.so.6(SysV)')),
+                [['glibc', 'oldglibc']])
+        self.assertEqual(m.find(parseDep('soname: ELF64/libc.so.6(GLIBC_2.3 SysV)')),
+                [['glibc']])
+        self.assertEqual(m.find(parseDep('soname: ELF64/libc.so.6(GLIBC_2.4)')),
+                [[]])
+        ok = parseDep('soname: ELF64/libc.so.6(GLIBC_2.3)')
+        bad = parseDep('soname: ELF64/libc.so.6(GLIBC_2.4)')
+        both = parseDep('soname: ELF64/libc.so.6(GLIBC_2.3)')
+        both.union(bad)
+        self.assertEqual(m.checkMany([ok, bad, both, ok]),
+                [None, bad, both, None])
+        # flags are numbered separately for each dependency name
+        m.add(parseDep('soname: ELF64/libm.so.6(GLIBC_2.4 SysV)'), 'libm')
+        self.assertEqual(m.check(bad), bad)
+        self.assertEqual(m.find(parseDep('soname: ELF64/libm.so.6(SysV)')),
+                [['libm']])
+        flagIds = m.depMap[(bad.iterRawDeps().next()[0],
+                            'ELF64/libm.so.6')][0]
+        self.assertEqual(sorted(flagIds.values()), [0, 1])
+        m.clear()
+        self.assertEqual(m.check(ok), ok)
+
+    def _testMatcher(self, matcherClass):
+        m = matcherClass(ignoreDepClasses=[AbiDependency])
         m.add(ThawDependencySet('0#ignored|4#foobar::java|10#ham|10#spam'), 'foobar')
         m.add(ThawDependencySet('0#ignored|11#ham:2.6:lib|11#spam:2.6:lib'), 'hamspam32')
         m.add(ThawDependencySet('0#ignored|11#ham:2.6:lib64|11#spam:2.6:lib64'), 'hamspam64')
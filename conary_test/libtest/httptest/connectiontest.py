@@ -0,0 +1,151 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from testrunner import testhelp
+
+import BaseHTTPServer
+import SocketServer
+import threading
+from conary.lib.http import connection as conn_mod
+from conary.lib.http import opener as opener_mod
+
+
+class KeepAliveHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Send each response in one write
+    wbufsize = -1
+
+    def do_GET(self):
+        if self.path == '/close':
+            self.close_connection = 1
+        body = 'x' * 1000
+        self.send_response(200)
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class KeepAliveServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0),
+                KeepAliveHandler)
+        self.accepted = 0
+
+    def get_request(self):
+        self.accepted += 1
+        return BaseHTTPServer.HTTPServer.get_request(self)
+
+    def handle_error(self, request, client_address):
+        # Clients hang up on purpose in some of the tests
+        pass
+
+
+class ConnectionPoolTest(testhelp.TestCase):
+
+    def setUp(self):
+        testhelp.TestCase.setUp(self)
+        self.server = KeepAliveServer()
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                kwargs=dict(poll_interval=0.05))
+        self.thread.setDaemon(True)
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self.pool = conn_mod.ConnectionPool()
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+        testhelp.TestCase.tearDown(self)
+
+    def _opener(self):
+        return opener_mod.URLOpener(persist=True, connectionPool=self.pool)
+
+    def testReuse(self):
+        """Requests reuse idle connections from the pool."""
+        opener = self._opener()
+        for i in range(5):
+            fobj = opener.open(self.url + '/')
+            self.assertEqual(fobj.read(), 'x' * 1000)
+            fobj.close()
+            fobj = opener.open(self.url + '/', data='hello')
+            self.assertEqual(fobj.read(), 'hello')
+            fobj.close()
+        # The pool is shared with other openers
+        fobj = self._opener().open(self.url + '/')
+        fobj.read()
+        fobj.close()
+        self.assertEqual(self.server.accepted, 1)
+
+    def testNoPersist(self):
+        """Openers without a pool ask the server to close."""
+        opener = opener_mod.URLOpener()
+        for i in range(3):
+            fobj = opener.open(self.url + '/')
+            fobj.read()
+            fobj.close()
+        self.assertEqual(self.server.accepted, 3)
+
+    def testPartialRead(self):
+        """Connections with an unread response body are not reused."""
+        opener = self._opener()
+        fobj = opener.open(self.url + '/')
+        self.assertEqual(fobj.read(10), 'x' * 10)
+        fobj.close()
+        fobj = opener.open(self.url + '/')
+        self.assertEqual(fobj.read(), 'x' * 1000)
+        fobj.close()
+        self.assertEqual(self.server.accepted, 2)
+        self.assertEqual(len(self.pool.idle.values()[0]), 1)
+
+    def testServerClose(self):
+        """Connections closed by the server are not kept or reused."""
+        opener = self._opener()
+        fobj = opener.open(self.url + '/close')
+        fobj.read()
+        fobj.close()
+        self.assertEqual(self.pool.idle, {})
+        fobj = opener.open(self.url + '/')
+        fobj.read()
+        fobj.close()
+        self.assertEqual(self.server.accepted, 2)
+
+    def testStaleConnection(self):
+        """Idle connections are dropped once they expire."""
+        opener = self._opener()
+        fobj = opener.open(self.url + '/')
+        fobj.read()
+        fobj.close()
+        self.pool.idleTimeout = 0
+        fobj = opener.open(self.url + '/')
+        fobj.read()
+        fobj.close()
+        self.assertEqual(self.server.accepted, 2)
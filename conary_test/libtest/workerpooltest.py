@@ -0,0 +1,87 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+from testrunner import testhelp
+
+import threading
+import time
+
+from conary.lib import workerpool
+
+
+class WorkerPoolTest(testhelp.TestCase):
+
+    def testParallelMap(self):
+        self.assertEqual(workerpool.parallelMap(lambda x: x * 2, range(10), 4),
+                [ x * 2 for x in range(10) ])
+        # serial fallback
+        self.assertEqual(workerpool.parallelMap(str, [1, 2], 1), ['1', '2'])
+
+    def testConcurrency(self):
+        lock = threading.Lock()
+        state = dict(running = 0, peak = 0)
+
+        def work(x):
+            lock.acquire()
+            state['running'] += 1
+            state['peak'] = max(state['peak'], state['running'])
+            lock.release()
+            time.sleep(0.05)
+            lock.acquire()
+            state['running'] -= 1
+            lock.release()
+            return x
+
+        self.assertEqual(workerpool.parallelMap(work, range(12), 3),
+                range(12))
+        self.assertEqual(state['peak'], 3)
+
+    def testErrors(self):
+        def work(x):
+            if x in (3, 5):
+                raise ValueError(x)
+            return x
+
+        try:
+            workerpool.parallelMap(work, range(8), 4)
+        except ValueError, e:
+            self.assertEqual(e.args, (3,))
+        else:
+            self.fail('expected ValueError')
+
+        pool = workerpool.WorkerPool(2)
+        good = pool.submit(work, 1)
+        bad = pool.submit(work, 5)
+        self.assertEqual(good.get(), 1)
+        self.assertRaises(ValueError, bad.get)
+        pool.close()
+        self.assertRaises(RuntimeError, pool.submit, work, 1)
+
+    def testSerializedProxy(self):
+        class Counter(object):
+            value = 0
+            label = 'counter'
+            def add(self, n):
+                v = self.value
+                time.sleep(0.001)
+                self.value = v + n
+
+        c = Counter()
+        proxy = workerpool.SerializedProxy(c)
+        workerpool.parallelMap(lambda x: proxy.add(1), range(20), 5)
+        self.assertEqual(c.value, 20)
+        self.assertEqual(proxy.label, 'counter')
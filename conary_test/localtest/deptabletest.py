@@ -34,6 +34,7 @@ class DepTableTest(testhelp.TestCase):
 
     new = versions.NewVersion()
     flv = Flavor()
+    inMemory = False
 
     def _fixupVersion(self, version):
         if version is None:
@@ -102,7 +103,8 @@ class DepTableTest(testhelp.TestCase):
         return dt, db, cu
 
     def check(self, db, jobSet, troveSource, findOrdering=False):
-        checker = db.dependencyChecker(troveSource, findOrdering=findOrdering)
+        checker = db.dependencyChecker(troveSource, findOrdering=findOrdering,
+                                       inMemory=self.inMemory)
         checker.addJobs(jobSet)
         result = checker.check()
 
@@ -208,7 +210,8 @@ class DepTableTest(testhelp.TestCase):
         # is complete.
         src.addChangeSets(src3.csList)
 
-        checker = db.db.dependencyChecker(src, findOrdering=True)
+        checker = db.db.dependencyChecker(src, findOrdering=True,
+                                          inMemory=self.inMemory)
         # First pass: missing one dep
         checker.addJobs(job12)
         result = checker.check()
@@ -273,6 +276,70 @@ class DepTableTest(testhelp.TestCase):
         assert(not broken and not byErase)
         assert(len(order) == 1)
 
+    def testGetBulk(self):
+        dt, db, cu = self.init()
+        prv = parseDep("soname: ELF32/libtest.so.1(flag) trove: test")
+        req = parseDep("soname: ELF32/libc.so.6(GLIBC_2.0 GLIBC_2.1)")
+        dt.add(cu, self.prvReqTrove("test", prv, req), 1)
+        dt.add(cu, self.prvTrove("test-prov", req), 2)
+
+        cu.execute("CREATE TEMPORARY TABLE idTbl(idx INTEGER, "
+                   "instanceId INTEGER)")
+        cu.executemany("INSERT INTO idTbl VALUES (?, ?)",
+                       [ (0, 2), (1, 1), (2, 3) ])
+        troveList = [ self.reqTrove(x, deps.DependencySet())
+                      for x in ('test-prov', 'test', 'other') ]
+        dt.getBulk(cu, 'idTbl', troveList)
+
+        for trv, instanceId in zip(troveList, (2, 1, 3)):
+            expected = self.reqTrove(trv.getName(), deps.DependencySet())
+            dt.get(cu, expected, instanceId)
+            self.assertEqual(trv.getProvides(), expected.getProvides())
+            self.assertEqual(trv.getRequires(), expected.getRequires())
+        self.assertEqual(troveList[1].getProvides(), prv)
+        self.assertEqual(troveList[1].getRequires(), req)
+        self.assertEqual(troveList[0].getProvides(), req)
+        assert(troveList[2].getProvides().isEmpty())
+
+    def testBrokenByErase(self):
+        dt, db, cu = self.init()
+        dep = parseDep("soname: ELF32/libtest.so.1(flag)")
+        reqTrv = self.reqTrove("test-req", dep, version="1.0-1-1")
+        prvTrv = self.prvTrove("test-prov", dep, version="1.0-1-1")
+        otherTrv = self.prvTrove("test-other", dep, version="1.0-1-1")
+
+        for trv in (prvTrv, reqTrv, otherTrv):
+            troveInfo = db.addTrove(trv)
+            db.addTroveDone(troveInfo)
+        db.commit()
+
+        # removing both providers breaks test-req
+        dbTroveSource, jobs, src = self.createJobInfo(db, (prvTrv, None),
+                                                      (otherTrv, None))
+        (broken, byErase, order) = self.check(dbTroveSource, jobs, src,
+                                              findOrdering=True)
+        self.assertEqual(broken, [])
+        self.assertEqual([ (x[0], x[1], sorted(x[2])) for x in byErase ],
+            [ (reqTrv.getNameVersionFlavor(), dep,
+               sorted([ otherTrv.getNameVersionFlavor(),
+                        prvTrv.getNameVersionFlavor() ])) ])
+
+        # putting one of them back fixes it again
+        checker = dbTroveSource.dependencyChecker(src, findOrdering=False,
+                                                  inMemory=self.inMemory)
+        checker.addJobs(jobs)
+        assert(checker.check().unresolveableList)
+        checker.restoreTrove(otherTrv.getNameVersionFlavor())
+        result = checker.check()
+        self.assertEqual(result.unresolveableList, [])
+        self.assertEqual(result.unsatisfiedList, [])
+        checker.done()
+
+
+class MemoryDepTableTest(DepTableTest):
+
+    inMemory = True
+
 
 class DepTableTestWithHelper(rephelp.RepositoryHelper):
     def testGetLocalProvides(self):
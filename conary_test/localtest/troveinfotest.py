@@ -74,3 +74,36 @@ class TroveInfoTest(testhelp.TestCase):
         tiTable.getInfo(cu, MockTrove(returned), 1)
 
         assert(full.freeze() == returned.freeze())
+
+    def testGetInfoBulk(self):
+        class MockTrove:
+
+            def getName(self):
+                return 'sometrove'
+
+            def __init__(self, troveInfo = None):
+                self.troveInfo = troveInfo
+
+        db = sqldb.Database(':memory:')
+        cu = db.db.cursor()
+        tiTable = db.troveInfoTable
+
+        infoList = []
+        for i in range(3):
+            ti = trove.TroveInfo()
+            ti.size.set(10 + i)
+            ti.sourceName.set('foo%d:source' % i)
+            tiTable.addInfo(cu, MockTrove(ti), i + 1)
+            infoList.append(ti)
+
+        cu.execute("CREATE TEMPORARY TABLE idTbl(idx INTEGER, "
+                   "instanceId INTEGER)")
+        # instance 4 has no trove info at all
+        cu.executemany("INSERT INTO idTbl VALUES (?, ?)",
+                       [ (0, 3), (1, 1), (2, 4), (3, 2) ])
+        troveList = [ MockTrove(trove.TroveInfo()) for x in range(4) ]
+        tiTable.getInfoBulk(cu, 'idTbl', troveList)
+
+        self.assertEqual([ x.troveInfo.freeze() for x in troveList ],
+                         [ infoList[2].freeze(), infoList[0].freeze(),
+                           trove.TroveInfo().freeze(), infoList[1].freeze() ])
@@ -1080,6 +1080,49 @@ class Foo(PackageRecipe):
         assert(os.stat(self.rootDir + '/b').st_ino ==
                os.stat(self.rootDir + '/d').st_ino)
 
+    @testhelp.context('rollback')
+    def testParallelRestore(self):
+        # files written by the restore pipeline have to land next to hard
+        # links, shared contents and ptr files exactly as the serial
+        # restore leaves them, and be journaled for the rollback
+        fileContents = [ ('/usr/share/foo/%d' % i, 'contents %d\n' % i)
+                         for i in range(40) ]
+        fileContents += [
+            ( '/usr/bin/a', rephelp.RegularFile(contents = 'shared\n',
+                                pathId = '1') ),
+            ( '/usr/bin/b', rephelp.RegularFile(contents = 'shared\n',
+                                pathId = '2') ),
+            ( '/usr/lib/c', rephelp.RegularFile(contents = 'linked\n',
+                                pathId = '3', linkGroup = '\1' * 16) ),
+            ( '/usr/lib/d', rephelp.RegularFile(contents = 'linked\n',
+                                pathId = '4', linkGroup = '\1' * 16) ),
+            ( '/etc/foo.conf', rephelp.RegularFile(contents = 'config\n',
+                                pathId = '5', config = True) ) ]
+        self.addComponent('foo:runtime', '1.0', fileContents = fileContents)
+
+        repos = self.openRepository()
+        csPath = self.workDir + '/foo.ccs'
+        self.changeset(repos, [ 'foo:runtime' ], csPath)
+
+        oldThreads = self.cfg.restoreThreads
+        self.cfg.restoreThreads = 4
+        try:
+            self.updatePkg(self.rootDir, csPath)
+            for i in range(40):
+                self.verifyFile(self.rootDir + '/usr/share/foo/%d' % i,
+                                'contents %d\n' % i)
+            self.verifyFile(self.rootDir + '/usr/bin/a', 'shared\n')
+            self.verifyFile(self.rootDir + '/usr/bin/b', 'shared\n')
+            self.verifyFile(self.rootDir + '/etc/foo.conf', 'config\n')
+            assert(os.stat(self.rootDir + '/usr/lib/c').st_ino ==
+                   os.stat(self.rootDir + '/usr/lib/d').st_ino)
+
+            self.rollback(self.rootDir, 0)
+            assert(not os.path.exists(self.rootDir + '/usr/share/foo/0'))
+            assert(not os.path.exists(self.rootDir + '/usr/bin/a'))
+        finally:
+            self.cfg.restoreThreads = oldThreads
+
     @testhelp.context('rollback')
     def testConfigFilesWithoutNewline(self):
         # CNY-1979
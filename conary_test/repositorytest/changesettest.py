@@ -94,6 +94,36 @@ class ChangesetTest(rephelp.RepositoryHelper):
         ctype, contents = cs3.getFileContents(pathId, f.fileId())
         assert(ctype == changeset.ChangedFileTypes.file)
 
+    def testIndexedChangeSet(self):
+        cs = changeset.ChangeSet()
+        keys = []
+        for i in range(5):
+            pathId = ('%d' % i) * 16
+            fileId = ('%d' % i) * 20
+            cs.addFileContents(pathId, fileId,
+                               changeset.ChangedFileTypes.file,
+                               filecontents.FromString('contents %d' % i),
+                               cfgFile = False)
+            keys.append((pathId, fileId))
+
+        path = os.path.join(self.workDir, 'indexed.ccs')
+        cs.writeToFile(path,
+                versionOverride = filecontainer.FILE_CONTAINER_VERSION_TOC)
+        cs2 = changeset.ChangeSetFromFile(path)
+        assert(cs2.fileContainers[0].hasIndex())
+
+        # any order works without reading the whole changeset
+        for i in (3, 0, 4, 3):
+            ctype, contents = cs2.getFileContents(*keys[i])
+            self.assertEqual(ctype, changeset.ChangedFileTypes.file)
+            self.assertEqual(contents.get().read(), 'contents %d' % i)
+        assert(not cs2.filesRead)
+        ctype, contents = cs2.getFileContents(compressed = True, *keys[1])
+        self.assertEqual(gzip.GzipFile(None, 'r',
+                                       fileobj = contents.get()).read(),
+                         'contents 1')
+        self.assertRaises(KeyError, cs2.getFileContents, '9' * 16, '9' * 20)
+
     def testIndexByPathIdConversion(self):
         def _testCs(repos, troves, idxLength, fileCount):
             job = [ (x.getName(), (None, None),
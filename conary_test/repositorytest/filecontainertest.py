@@ -52,6 +52,53 @@ def checkFiles(c, names, data, tags):
     if names:
         raise AssertionError, "files not found: %s" % " ".join(names)
 
+class SparseFile(util.ExtendedFile):
+    # replaces the write call with one which handles sparsity
+
+    def __init__(self, *args, **kwargs):
+        self.needsWrite = False
+        util.ExtendedFile.__init__(self, *args, **kwargs)
+
+    def write(self, s):
+        if len(s) > 100 and s[0] == '\0' and s[-1] == '\0':
+            self.seek(len(s) - 1, 2)
+            self.needsWrite = True
+            return len(s)
+
+        return util.ExtendedFile.write(self, s)
+
+    def close(self):
+        if self.needsWrite:
+            self.write('\0')
+            self.needsWrite = False
+
+    def seek(self, *args):
+        if self.needsWrite:
+            self.write('\0')
+            self.needsWrite = False
+
+        return util.ExtendedFile.seek(self, *args)
+
+class FalseFile:
+
+    def __init__(self, size):
+        self.size = size
+        self.offset = 0
+
+    def seek(self, offset, whence = 0):
+        assert(whence == 0)
+        self.offset = offset
+
+    def read(self, bytes):
+        self.offset += bytes
+        if self.offset > self.size:
+            self.offset -= bytes
+            bytes = self.size - self.offset
+            self.offset = self.size
+
+        return "\0" * bytes
+
+
 class FilecontainerTest(unittest.TestCase):
     def setUp(self):
         fd, self.fn = tempfile.mkstemp()
@@ -120,53 +167,7 @@ class FilecontainerTest(unittest.TestCase):
         assert(name == names[0])
 
     def testLargeFiles(self):
-        # test adding files > 4gig to a filecontainer. we replace the write
-        # call with one which handles sparsity
-        class SparseFile(util.ExtendedFile):
-
-            def __init__(self, *args, **kwargs):
-                self.needsWrite = False
-                util.ExtendedFile.__init__(self, *args, **kwargs)
-
-            def write(self, s):
-                if len(s) > 100 and s[0] == '\0' and s[-1] == '\0':
-                    self.seek(len(s) - 1, 2)
-                    self.needsWrite = True
-                    return len(s)
-
-                return util.ExtendedFile.write(self, s)
-
-            def close(self):
-                if self.needsWrite:
-                    self.write('\0')
-                    self.needsWrite = False
-
-            def seek(self, *args):
-                if self.needsWrite:
-                    self.write('\0')
-                    self.needsWrite = False
-
-                return util.ExtendedFile.seek(self, *args)
-
-        class FalseFile:
-
-            def __init__(self, size):
-                self.size = size
-                self.offset = 0
-
-            def seek(self, offset, whence = 0):
-                assert(whence == 0)
-                self.offset = offset
-
-            def read(self, bytes):
-                self.offset += bytes
-                if self.offset > self.size:
-                    self.offset -= bytes
-                    bytes = self.size - self.offset
-                    self.offset = self.size
-
-                return "\0" * bytes
-
+        # test adding files > 4gig to a filecontainer
         f = SparseFile(self.fn, "w+", buffering = False)
         c = FileContainer(f)
         totalSize = 0x100001000
@@ -188,5 +189,150 @@ class FilecontainerTest(unittest.TestCase):
         s = f.read()
         assert(s == 'endcontents')
 
+    def testIndex(self):
+        names = [ 'file%02d' % i for i in range(20) ]
+        data = [ 'contents of %s' % x for x in names ]
+        tags = [ 'tag %d' % i for i in range(20) ]
+
+        f = util.ExtendedFile(self.fn, "w+", buffering = False)
+        # write something in front of the container to make sure offsets
+        # are relative to the start of the container
+        f.write('prefix')
+        c = FileContainer(f, append = True,
+                version = filecontainer.FILE_CONTAINER_VERSION_TOC)
+        for i in reversed(range(20)):
+            c.addFile(names[i], FromString(data[i]), tags[i])
+        c.close()
+
+        size = f.tell() - len('prefix')
+        nested = util.SeekableNestedFile(f, size, start = len('prefix'))
+        c = FileContainer(nested)
+        assert(c.hasIndex())
+        for i in (7, 0, 19):
+            name, tag, fobj = c.getFile(names[i])
+            self.assertEqual(name, names[i])
+            self.assertEqual(tag, tags[i])
+            self.assertEqual(gzip.GzipFile(None, "r", fileobj = fobj).read(),
+                             data[i])
+        self.assertEqual(c.getFile('missing'), None)
+        self.assertEqual(c.getFile(filecontainer.INDEX_NAME), None)
+
+        # sequential access ignores the index
+        checkFiles(c, list(reversed(names)), list(reversed(data)),
+                   list(reversed(tags)))
+
+        # dumped containers don't have an index and use the older version
+        c.reset()
+        dumped = ''.join(c.dumpIter(lambda name, tag, size, f: (tag, size, f)))
+        d = FileContainer(util.ExtendedStringIO(dumped))
+        self.assertEqual(d.version,
+                         filecontainer.FILE_CONTAINER_VERSION_FILEID_IDX)
+        assert(not d.hasIndex())
+        checkFiles(d, list(reversed(names)), list(reversed(data)),
+                   list(reversed(tags)))
+        # lookups without an index scan the container
+        name, tag, fobj = d.getFile(names[3])
+        self.assertEqual(tag, tags[3])
+        self.assertEqual(d.getFile('missing'), None)
+
+    def testLargeFileIndex(self):
+        # the index has to point at the contents of > 4gig entries, whose
+        # headers are rewritten once their size is known
+        f = SparseFile(self.fn, "w+", buffering = False)
+        f.write('prefix')
+        c = FileContainer(f, append = True,
+                version = filecontainer.FILE_CONTAINER_VERSION_TOC)
+        totalSize = 0x100001000
+        c.addFile('big', FromFile(FalseFile(totalSize)), 'bigdata',
+                  precompressed = True)
+        c.addFile('end', FromString('endcontents'), 'enddata',
+                  precompressed = True)
+        c.close()
+        f.close()
+
+        f = util.ExtendedFile(self.fn, 'r', buffering = False)
+        size = os.fstat(f.fileno()).st_size - len('prefix')
+        c = FileContainer(util.SeekableNestedFile(f, size,
+                                                  start = len('prefix')))
+        assert(c.hasIndex())
+        name, tag, fobj = c.getFile('big')
+        self.assertEqual(tag, 'bigdata')
+        self.assertEqual(fobj.seek(0, 2), totalSize)
+        name, tag, fobj = c.getFile('end')
+        self.assertEqual(tag, 'enddata')
+        self.assertEqual(fobj.read(), 'endcontents')
+
+        name, tag, fobj = c.getNextFile()
+        self.assertEqual((name, tag), ('big', 'bigdata'))
+        name, tag, fobj = c.getNextFile()
+        self.assertEqual(fobj.read(), 'endcontents')
+        self.assertEqual(c.getNextFile(), None)
+
+    def testDumpFileRanges(self):
+        names = [ 'file%02d' % i for i in range(5) ]
+        data = [ 'contents of %s' % x * (i + 1) for i, x in enumerate(names) ]
+
+        f = util.ExtendedFile(self.fn, "w+", buffering = False)
+        f.write('prefix')
+        c = FileContainer(f, append = True)
+        for name, contents in zip(names, data):
+            c.addFile(name, FromString(contents), 'tag')
+        c.close()
+
+        size = f.tell() - len('prefix')
+        nested = util.SeekableNestedFile(f, size, start = len('prefix'))
+        c = FileContainer(nested)
+        noop = lambda name, tag, size, f: (tag, size, f)
+        expected = ''.join(c.dumpIter(noop))
+        for offset in range(0, len(expected) + 1, 7):
+            c.reset()
+            parts = []
+            ranges = 0
+            for item in c.dumpIter(noop, offset = offset, fileRanges = True):
+                if isinstance(item, util.FileRange):
+                    # contents are never read into the dump itself
+                    self.assertEqual(item.fd, f.fileno())
+                    ranges += 1
+                    item = ''.join(item.iterChunks(chunkSize = 5))
+                parts.append(item)
+            self.assertEqual(''.join(parts), expected[offset:])
+            assert(ranges)
+        f.close()
+
+    def testCompressThreads(self):
+        class Contents(FromString):
+            # make sure the reads are split into several chunks
+            def get(self):
+                return util.ExtendedStringIO(self.str)
+
+        data = [ os.urandom(1000) * (i * 97 % 700 + 1) for i in range(40) ]
+        data[5] = ''
+        outputs = []
+        for threads in (1, 4):
+            f = util.ExtendedFile(self.fn, "w+", buffering = False)
+            c = FileContainer(f, compressThreads = threads)
+            for i, contents in enumerate(data):
+                if i % 10 == 3:
+                    c.addFile('pre%d' % i, FromString(contents), 'p',
+                              precompressed = True)
+                else:
+                    c.addFile('file%d' % i, Contents(contents), 'tag%d' % i)
+            c.close()
+            f.seek(0)
+            outputs.append(f.read())
+            f.close()
+            os.unlink(self.fn)
+
+        self.assertEqual(outputs[0], outputs[1])
+        c = FileContainer(util.ExtendedStringIO(outputs[1]))
+        name, tag, fobj = c.getFile('file7')
+        self.assertEqual(gzip.GzipFile(None, "r", fileobj = fobj).read(),
+                         data[7])
+        name, tag, fobj = c.getFile('pre13')
+        self.assertEqual(fobj.read(), data[13])
+
+        # make sure tearDown has something to remove
+        open(self.fn, "w").close()
+
     def tearDown(self):
         os.unlink(self.fn)
@@ -827,6 +827,32 @@ class NetclientTest(rephelp.RepositoryHelper):
         assert did_truncate[0]
         self.assertEqual(open(clean).read(), open(retry).read())
 
+    def testConcurrentChangesetDownload(self):
+        repos = self.openRepository(serverName = [ 'localhost', 'localhost1' ])
+        t1 = self.addComponent('foo:runtime', '/localhost@rpl:linux/1-1-1',
+                fileContents = [ ('/foo', 'foo\n') ])
+        t2 = self.addComponent('bar:runtime', '/localhost1@rpl:linux/1-1-1',
+                fileContents = [ ('/bar', 'bar\n') ])
+        job = [ t1.getNameVersionFlavor().asJob(),
+                t2.getNameVersionFlavor().asJob() ]
+
+        results = []
+        for concurrency in (1, 2):
+            self.cfg.downloadConcurrency = concurrency
+            path = os.path.join(self.workDir, '%d.ccs' % concurrency)
+            repos.createChangeSetFile(job, path)
+            cs = changeset.ChangeSetFromFile(path)
+            results.append(sorted(x.getNewNameVersionFlavor()
+                                  for x in cs.iterNewTroveList()))
+            contents = repos.getFileContents(
+                    [ x[2:] for x in itertools.chain(t1.iterFileList(),
+                                                     t2.iterFileList()) ])
+            self.assertEqual([ x.get().read() for x in contents ],
+                    [ 'foo\n', 'bar\n' ])
+
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(len(results[1]), 2)
+
 
 class ServerProxyTest(rephelp.RepositoryHelper):
     def testBadProtocol(self):
@@ -0,0 +1,189 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import shutil
+import tempfile
+
+from testrunner import testhelp
+
+from conary.repository.netrepos import cache, shmcache
+
+
+class LRUCacheTest(testhelp.TestCase):
+
+    def testLRUOrder(self):
+        c = cache.LRUCache(limit = 3)
+        c.set('a', '1')
+        c.set('b', '2')
+        c.set('c', '3')
+        # touch 'a' so 'b' becomes the oldest entry
+        self.assertEqual(c.get('a'), '1')
+        c.set('d', '4')
+        self.assertEqual(len(c), 3)
+        self.assertEqual(c.get('b'), None)
+        self.assertEqual(c.get_multi(['a', 'c', 'd']),
+                dict(a = '1', c = '3', d = '4'))
+        stats = c.getStats()
+        self.assertEqual(stats['evictions'], 1)
+        self.assertEqual(stats['hits'], 4)
+        self.assertEqual(stats['misses'], 1)
+
+    def testPrefixes(self):
+        c = cache.LRUCache(limit = 10)
+        c.set('a', 'fp', key_prefix = 'FPRINT')
+        c.set('a', 'deps', key_prefix = 'DEPS')
+        self.assertEqual(c.get('a', key_prefix = 'FPRINT'), 'fp')
+        self.assertEqual(c.get('a', key_prefix = 'DEPS'), 'deps')
+        self.assertEqual(c.get('a'), None)
+        c.set('a', 'deps2', key_prefix = 'DEPS')
+        self.assertEqual(len(c), 2)
+        self.assertEqual(c.get('a', key_prefix = 'DEPS'), 'deps2')
+
+    def testQuota(self):
+        entrySize = cache._sizeOf(('DEPS', 'k0')) + cache._sizeOf('x' * 100)
+        c = cache.LRUCache(limit = 100,
+                quotas = dict(DEPS = entrySize * 2))
+        c.set('k0', 'x' * 100, key_prefix = 'FPRINT')
+        for i in range(5):
+            c.set('k%d' % i, 'x' * 100, key_prefix = 'DEPS')
+        # only the two newest DEPS entries fit; FPRINT is untouched
+        self.assertEqual(sorted(c.get_multi(
+                    ['k%d' % i for i in range(5)], key_prefix = 'DEPS')),
+                ['k3', 'k4'])
+        self.assertEqual(c.get('k0', key_prefix = 'FPRINT'), 'x' * 100)
+
+    def testSizeLimit(self):
+        c = cache.LRUCache(limit = 100, sizeLimit = 1000)
+        for i in range(20):
+            c.set(str(i), 'x' * 100)
+        self.assertTrue(c.size <= 1000)
+        self.assertEqual(c.get('19'), 'x' * 100)
+        self.assertEqual(c.get('0'), None)
+
+    def testExpiration(self):
+        c = cache.LRUCache()
+        now = [ 1000.0 ]
+        self.mock(cache.pytime, 'time', lambda: now[0])
+        c.set('a', '1', time = 10)
+        c.set('b', '2')
+        self.assertEqual(c.get('a'), '1')
+        now[0] += 11
+        self.assertEqual(c.get('a'), None)
+        self.assertEqual(c.get('b'), '2')
+        self.assertEqual(c.getStats()['expirations'], 1)
+        self.assertEqual(len(c), 1)
+
+    def testIncr(self):
+        c = cache.getCache(None)
+        self.assertEqual(c.incr('counter', 5), None)
+        c.set('counter', '1')
+        self.assertEqual(c.incr('counter', 5), '6')
+        self.assertEqual(c.get('counter'), '6')
+
+
+class SharedMemoryCacheTest(testhelp.TestCase):
+
+    def setUp(self):
+        testhelp.TestCase.setUp(self)
+        self.workDir = tempfile.mkdtemp()
+        self.path = os.path.join(self.workDir, 'memcache')
+
+    def tearDown(self):
+        shutil.rmtree(self.workDir)
+        testhelp.TestCase.tearDown(self)
+
+    def testGetSet(self):
+        c = cache.getCache('shm:' + self.path, limit = 64,
+                sizeLimit = 64 * 1024)
+        self.assertTrue(isinstance(c, shmcache.SharedMemoryCache))
+        c.set('a', 'fp', key_prefix = 'FPRINT')
+        c.set_multi({ 'a' : [ 'dep', 1 ], 'b' : ('x', None) },
+                key_prefix = 'DEPS')
+        self.assertEqual(c.get('a', key_prefix = 'FPRINT'), 'fp')
+        self.assertEqual(c.get_multi(['a', 'b', 'c'], key_prefix = 'DEPS'),
+                { 'a' : [ 'dep', 1 ], 'b' : ('x', None) })
+        self.assertEqual(c.get('a'), None)
+
+        # values which do not fit in a slot are not cached
+        c.set('big', 'x' * 2048)
+        self.assertEqual(c.get('big'), None)
+
+        self.assertEqual(c.incr('counter', 5), None)
+        c.set('counter', '1')
+        self.assertEqual(c.incr('counter', 5), '6')
+        c.close()
+
+    def testExpiration(self):
+        c = shmcache.SharedMemoryCache(self.path, slots = 16, slotSize = 1024)
+        now = [ 1000.0 ]
+        self.mock(shmcache.pytime, 'time', lambda: now[0])
+        c.set('a', '1', time = 10)
+        self.assertEqual(c.get('a'), '1')
+        now[0] += 11
+        self.assertEqual(c.get('a'), None)
+
+    def testCollisions(self):
+        c = shmcache.SharedMemoryCache(self.path, slots = 4, slotSize = 1024)
+        for i in range(20):
+            c.set(str(i), i)
+        self.assertEqual(c.get('19'), 19)
+        self.assertEqual(len(c.get_multi([ str(x) for x in range(20) ])), 4)
+
+    def testShared(self):
+        c = shmcache.SharedMemoryCache(self.path, slots = 16, slotSize = 1024)
+        pid = os.fork()
+        if not pid:
+            try:
+                child = shmcache.SharedMemoryCache(self.path, slots = 16,
+                        slotSize = 1024)
+                child.set('fromChild', 'value', key_prefix = 'FPRINT')
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        self.assertEqual(c.get('fromChild', key_prefix = 'FPRINT'), 'value')
+
+        # changing the geometry puts a new file in place; the old one is
+        # left alone for whoever still has it mapped
+        c2 = shmcache.SharedMemoryCache(self.path, slots = 8, slotSize = 1024)
+        self.assertEqual(c2.get('fromChild', key_prefix = 'FPRINT'), None)
+        c2.set('new', 'value')
+        self.assertEqual(c.get('fromChild', key_prefix = 'FPRINT'), 'value')
+        self.assertEqual(c.get('new'), None)
+        self.assertEqual(os.stat(self.path).st_size, c2._fileSize())
+        self.assertEqual(os.listdir(self.workDir), [ 'memcache' ])
+        c.close()
+        c2.close()
+
+    def testOneInstancePerPath(self):
+        fds = len(os.listdir('/proc/self/fd'))
+        first = cache.getCache('shm:' + self.path, limit = 64,
+                               sizeLimit = 64 * 1024)
+        opened = len(os.listdir('/proc/self/fd'))
+        self.assertTrue(opened > fds)
+        caches = [ cache.getCache('shm:' + self.path, limit = 64,
+                                  sizeLimit = 64 * 1024)
+                   for x in range(10) ]
+        self.assertEqual(set(id(x) for x in caches), set([ id(first) ]))
+        self.assertEqual(len(os.listdir('/proc/self/fd')), opened)
+        self.assertRaises(ValueError, shmcache.getSharedMemoryCache,
+                          self.path, slots = 32, slotSize = 1024)
+        first.close()
+        self.assertEqual(len(os.listdir('/proc/self/fd')), fds)
+        c = cache.getCache('shm:' + self.path, limit = 64,
+                           sizeLimit = 64 * 1024)
+        self.assertFalse(c is first)
+        c.close()
@@ -21,7 +21,7 @@ from conary_test import rephelp
 from conary_test import dbstoretest
 
 from conary.repository import errors
-from conary.repository.netrepos import netauth
+from conary.repository.netrepos import accessmap, netauth
 from conary.repository.netrepos.auth_tokens import AuthToken
 from conary.repository.netrepos.trovestore import TroveStore
 from conary.server import schema
@@ -563,3 +563,63 @@ class NetAuthTest2(rephelp.RepositoryHelper):
         self.assertEqual(na.batchCheck(rw, troveList, write=True), [True,True])
         self.assertEqual(na.batchCheck(mixed, troveList), [True,True])
         self.assertEqual(na.batchCheck(mixed, troveList, write=True), [True,False])
+
+    def testBatchCheckCache(self):
+        if sqlite3.sqlite_version_info() < (3,7,0):
+            raise testhelp.SkipTestException("buggy sqlite; use embedded sqlite")
+        self.openRepository()
+        db = self._setupDB()
+        self.mock(netauth.NetworkAuthorization, 'checkCache', None)
+        na = netauth.NetworkAuthorization(db, "localhost", cacheTimeout = 60)
+
+        db.transaction()
+        self._addUserRole(na, "ro", "ro")
+        na.addAcl("ro", "foo:.*", label=None, write=False)
+        ro = ("ro", "ro", [ (None, None) ], None )
+        db.commit()
+
+        fr = self.addComponent("foo:runtime")
+        troveList = [ (fr.getName(), fr.getVersion().asString(),
+                       fr.getFlavor().freeze()),
+                      ('foo:devel', fr.getVersion().asString(),
+                       fr.getFlavor().freeze()) ]
+        self.assertEqual(na.batchCheck(ro, troveList), [True,False])
+
+        # granted access is served from the cache, without looking at the
+        # database
+        cu = db.cursor()
+        cu.execute("delete from UserGroupInstancesCache")
+        self.assertEqual(na.batchCheck(ro, troveList), [True,False])
+        # getTroveInfo() and friends read the list back from tmpNVF
+        cu.execute("select count(*) from tmpNVF")
+        self.assertEqual(cu.fetchall()[0][0], 2)
+        self.assertEqual(na.batchCheck(ro, troveList, write=True),
+                         [False,False])
+        db.rollback()
+
+        # missing troves are not cached, so they show up once committed
+        self.addComponent("foo:devel")
+        self.assertEqual(na.batchCheck(ro, troveList), [True,True])
+
+        # access taken away by another process is noticed through the
+        # generation it bumps in the database
+        cu = db.cursor()
+        cu.execute("""
+        delete from UserGroupInstancesCache where instanceId in (
+            select instanceId from Instances join Items using (itemId)
+            where item = 'foo:devel')""")
+        accessmap.RoleInstances(db).invalidate(cu)
+        db.commit()
+        self.assertEqual(na.batchCheck(ro, troveList), [True,False])
+
+        # so are changes to role filters
+        generation = na.ri.getGeneration(cu)
+        na.setRoleFilters({ 'ro' : (None, None) })
+        assert(na.ri.getGeneration(cu) != generation)
+
+        # taking access away empties the cache
+        generation = netauth.NetworkAuthorization.checkCacheGeneration
+        na.deleteAcl("ro", None, "foo:.*")
+        self.assertEqual(na.batchCheck(ro, troveList), [False,False])
+        assert(netauth.NetworkAuthorization.checkCacheGeneration !=
+               generation)
@@ -34,6 +34,7 @@ from conary.deps import deps
 from conary.lib import util, openpgpfile
 from conary.lib.http import request
 from conary.repository import changeset, errors, filecontainer, netclient, transport
+from conary.repository import shimclient
 from conary.repository import datastore
 from conary.repository import xmlshims
 from conary.repository.netrepos import reposlog, netserver
@@ -111,7 +112,8 @@ class NetServerTest(rephelp.RepositoryHelper):
             # the defaults.
             if startswithany(fname, ['get', 'list', 'has', 'check']):
                 self.assertEqual(meth._accessType, 'readOnly', fname)
-            elif fname in ['troveNames', 'prepareChangeSet', 'commitCheck']:
+            elif fname in ['troveNames', 'prepareChangeSet', 'commitCheck',
+                    'multiCall']:
                 self.assertEqual(meth._accessType, 'readOnly', fname)
             elif startswithany(fname, ['add', 'change', 'commit', 'delete',
                     'edit', 'set', 'update', 'presentHidden']):
@@ -837,6 +839,111 @@ class NetServerTest(rephelp.RepositoryHelper):
                 False, False)
         self.assertNotEqual(fpList2, fpList)
 
+    def testFingerprintCache(self):
+        repos = self.openRepository()
+        testserver = self.servers.getServer()
+        cfg = netserver.ServerConfig()
+        cfg.serverName = testserver.getName()
+        cfg.tmpDir = self.tmpDir
+        cfg.contentsDir = ('legacy', [testserver.contents.getPath()])
+        cfg.configLine('repositoryDB %s' % testserver.reposDB.getDriver())
+        cfg.memCacheTimeout = 0
+        self.mock(netserver.NetworkRepositoryServer, 'fingerprintCache', None)
+        server = shimclient.NetworkRepositoryServer(cfg,
+                self.cfg.repositoryMap['localhost'])
+        shim = shimclient.ShimNetClient(server, 'http', 80,
+                ('test', 'foo', None, None), self.cfg)
+
+        trv = self.addComponent('foo:runtime', '1')
+        self.addCollection('foo', '1', [ ':runtime' ])
+        grp = self.addCollection('group-foo', '1', [ 'foo' ])
+        chL = [ (grp.getName(), (None, None),
+                 (grp.getVersion(), grp.getFlavor()), True) ]
+
+        fpList = repos.getChangeSetFingerprints(chL, True, False, False,
+                False, False)
+        # the first call fills the cache, the second is answered from it
+        self.assertEqual(shim.getChangeSetFingerprints(chL, True, False,
+                False, False, False), fpList)
+        self.assertEqual(shim.getChangeSetFingerprints(chL, True, False,
+                False, False, False), fpList)
+        fpCache = netserver.NetworkRepositoryServer.fingerprintCache
+        self.assertTrue(fpCache.troveFps.get(
+                (trv.getName(), trv.getVersion().asString(),
+                 trv.getFlavor().freeze())))
+
+        # changing metadata through the server drops the cached digest
+        mi = trove.MetadataItem()
+        mi.shortDesc.set('short description')
+        shim.addMetadataItems([(trv.getNameVersionFlavor(), mi)])
+        fpList2 = repos.getChangeSetFingerprints(chL, True, False, False,
+                False, False)
+        self.assertNotEqual(fpList2, fpList)
+        self.assertEqual(shim.getChangeSetFingerprints(chL, True, False,
+                False, False, False), fpList2)
+
+        # so does changing it through another server process, which bumps
+        # the generation stored in the database
+        mi = trove.MetadataItem()
+        mi.shortDesc.set('another description')
+        repos.addMetadataItems([(trv.getNameVersionFlavor(), mi)])
+        fpList3 = repos.getChangeSetFingerprints(chL, True, False, False,
+                False, False)
+        self.assertNotEqual(fpList3, fpList2)
+        self.assertEqual(shim.getChangeSetFingerprints(chL, True, False,
+                False, False, False), fpList3)
+
+        # a commit invalidates the cached job expansions
+        self.addComponent('foo:lib', '1')
+        self.addCollection('foo', '1', [ ':runtime', ':lib' ])
+        self.addCollection('group-foo', '1', [ 'foo' ])
+        fpList4 = repos.getChangeSetFingerprints(chL, True, False, False,
+                False, False)
+        self.assertNotEqual(fpList4, fpList3)
+
+    def testLeafCache(self):
+        repos = self.openRepository()
+        testserver = self.servers.getServer()
+        cfg = netserver.ServerConfig()
+        cfg.serverName = testserver.getName()
+        cfg.tmpDir = self.tmpDir
+        cfg.contentsDir = ('legacy', [testserver.contents.getPath()])
+        cfg.configLine('repositoryDB %s' % testserver.reposDB.getDriver())
+        self.mock(netserver.NetworkRepositoryServer, 'leafCache', None)
+        server = shimclient.NetworkRepositoryServer(cfg,
+                self.cfg.repositoryMap['localhost'])
+        shim = shimclient.ShimNetClient(server, 'http', 80,
+                ('test', 'foo', None, None), self.cfg)
+
+        label = versions.Label('localhost@rpl:linux')
+        branchLabel = versions.Label('localhost@rpl:branch')
+        self.addComponent('foo:runtime', '1')
+        self.addComponent('foo:runtime', '/localhost@rpl:branch/1-1-1')
+        spec = { 'foo:runtime' : { label : None, branchLabel : None } }
+
+        # the first call fills the cache, the second is answered from it
+        leaves = repos.getTroveLeavesByLabel(spec)
+        self.assertEqual(shim.getTroveLeavesByLabel(spec), leaves)
+        leafCache = netserver.NetworkRepositoryServer.leafCache
+        self.assertEqual(len(leafCache), 2)
+        hits = leafCache.hits
+        self.assertEqual(shim.getTroveLeavesByLabel(spec), leaves)
+        self.assertEqual(leafCache.hits, hits + 2)
+
+        # commits made through another server invalidate the entries
+        self.addComponent('foo:runtime', '2')
+        leaves2 = shim.getTroveLeavesByLabel(spec)
+        self.assertNotEqual(leaves2, leaves)
+        self.assertEqual(leaves2, repos.getTroveLeavesByLabel(spec))
+
+        allSpec = { 'foo:runtime' : None }
+        allLeaves = shim.getAllTroveLeaves('localhost', allSpec)
+        self.assertEqual(shim.getAllTroveLeaves('localhost', allSpec),
+                         allLeaves)
+        self.addComponent('foo:runtime', '/localhost@rpl:branch/2-1-1')
+        self.assertEqual(shim.getAllTroveLeaves('localhost', allSpec),
+                         repos.getAllTroveLeaves('localhost', allSpec))
+
     def testCreateChangesetOptimizations(self):
         # ensure that if you call createChangeSet on a trove with
         # distributed file contents, the client doesn't have to
@@ -1254,6 +1361,47 @@ foo:runtime
                     [ (trv.getName(), repos.fromVersion(trv.getVersion()),
                        repos.fromFlavor(trv.getFlavor())) ])
 
+    def testMultiCall(self):
+        repos = self.openRepository()
+        trv = self.addComponent('foo:runtime', '1.0')
+        tup = trv.getNameVersionFlavor()
+        wireTup = (tup[0], repos.fromVersion(tup[1]),
+                   repos.fromFlavor(tup[2]))
+        infoTypes = [ trove._TROVEINFO_TAG_SIZE,
+                      trove._TROVEINFO_TAG_SOURCENAME ]
+
+        calls = []
+        def _marshalCall(method, request):
+            calls.append(method)
+            return origMarshalCall(method, request)
+        r = repos.c['localhost']
+        origMarshalCall = r._marshalCall
+        self.mock(r, '_marshalCall', _marshalCall)
+
+        for version in (netclient.MULTICALL_VERSION - 1,
+                        netclient.MULTICALL_VERSION):
+            r.setProtocolVersion(version)
+            del calls[:]
+            size, sourceName = repos.getMultipleTroveInfo(infoTypes, [ tup ])
+            self.assertEqual(size[0](), trv.getSize())
+            self.assertEqual(sourceName[0](), 'foo:source')
+            if version < netclient.MULTICALL_VERSION:
+                self.assertEqual(calls, [ 'getTroveInfo', 'getTroveInfo' ])
+            else:
+                self.assertEqual(calls, [ 'multiCall' ])
+
+        # exceptions are passed back for the call which raised them
+        batch = r.batch()
+        batch.getTroveSigs([ wireTup ])
+        batch.getTroveSigs([ ('bar:runtime',) + wireTup[1:] ])
+        self.assertRaises(errors.TroveMissing, batch)
+
+        # only read-only calls can be batched
+        batch = r.batch()
+        batch.getTroveSigs([ wireTup ])
+        batch.addUser('user', 'password')
+        self.assertRaises(errors.MethodNotSupported, batch)
+
     def testExtendedMetadata(self):
         repos = self.openRepository()
         repos.setRoleCanMirror(self.cfg.buildLabel, 'test', True)
@@ -19,7 +19,9 @@ from testrunner import testcase, testhelp
 from testutils import mock
 from testutils.servers import memcache_server
 import copy
+import errno
 import os
+import time
 
 from conary_test import rephelp
 
@@ -150,7 +152,7 @@ class ProxyUnitTest(testcase.TestCaseWithWorkDir):
         uo = mock.MockObject()
         self.mock(netreposproxy.transport, 'ConaryURLOpener', urlOpener)
         urlOpener._mock.setDefaultReturn(uo)
-        uo.open._mock.appendReturn(
+        uo.openResumable._mock.appendReturn(
             csFileObj,
             'http://repos.example.com/my-changeset-url',
             forceProxy=caller._lastProxy,
@@ -181,6 +183,117 @@ class ProxyUnitTest(testcase.TestCaseWithWorkDir):
         # We're not releasing locks we didn't close
         self.assertEqual(len(contents), 2 * len(fingerprints))
 
+    def testChangesetProducerRange(self):
+        kept = os.path.join(self.workDir, 'kept')
+        temp = os.path.join(self.workDir, 'temp')
+        file(kept, 'w').write('0123456789')
+        file(temp, 'w').write('abcdefghij')
+        manifest = netserver.ManifestWriter(self.workDir)
+        manifest.append(kept, 10, False, True, 0)
+        manifest.append(temp, 8, False, False, 2)
+        path = os.path.join(self.workDir, manifest.close() + '-out')
+
+        producer = netreposproxy.ChangesetProducer(path, None)
+        self.assertEqual(producer.getSize(), 18)
+        # only a single range running to the end is honored
+        self.assertEqual(producer.setRange('bytes=0-4'), None)
+        self.assertEqual(producer.setRange('bytes=0-3,5-'), None)
+        self.assertEqual(producer.setRange('bytes=18-'), None)
+        self.assertEqual(producer.setRange('bytes=12-17'), 'bytes 12-17/18')
+        self.assertEqual(producer.getSize(), 6)
+        # an interrupted download keeps everything around for a retry
+        output = iter(producer)
+        self.assertEqual(output.next(), 'efghij')
+        output.close()
+        self.assertTrue(os.path.exists(path))
+        self.assertTrue(os.path.exists(temp))
+
+        producer = netreposproxy.ChangesetProducer(path, None)
+        self.assertEqual(producer.setRange('bytes=8-'), 'bytes 8-17/18')
+        self.assertEqual(''.join(producer), '89cdefghij')
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(os.path.exists(temp))
+        self.assertTrue(os.path.exists(kept))
+
+        # the same goes for a file handed to wsgi.file_wrapper
+        manifest = netserver.ManifestWriter(self.workDir)
+        manifest.append(kept, 10, False, True, 0)
+        path = os.path.join(self.workDir, manifest.close() + '-out')
+        producer = netreposproxy.ChangesetProducer(path, None)
+        producer.setRange('bytes=4-')
+        fobj = producer.getFileObject()
+        self.assertEqual(fobj.read(3), '456')
+        fobj.close()
+        self.assertTrue(os.path.exists(path))
+        producer = netreposproxy.ChangesetProducer(path, None)
+        fobj = producer.getFileObject()
+        self.assertEqual(fobj.read(), '0123456789')
+        fobj.close()
+        self.assertFalse(os.path.exists(path))
+        self.assertTrue(os.path.exists(kept))
+
+    def testChangesetProducerExpiry(self):
+        def write(name, contents, age=0):
+            path = os.path.join(self.workDir, name)
+            file(path, 'w').write(contents)
+            if age:
+                os.utime(path, (now - age, now - age))
+            return path
+        def writeManifest(items, age=0):
+            manifest = netserver.ManifestWriter(self.workDir)
+            for path, preserveFile in items:
+                manifest.append(path, 10, False, preserveFile, 0)
+            path = os.path.join(self.workDir, manifest.close() + '-out')
+            if age:
+                os.utime(path, (now - age, now - age))
+            return path
+        now = time.time()
+        keepTime = netreposproxy.ChangesetProducer.keepTime
+        old = keepTime + 60
+
+        # an abandoned download can't be resumed once it has expired, and
+        # what it left behind goes away
+        kept = write('kept', '0123456789')
+        temp = write('temp.ccs-out', 'abcdefghij', old)
+        path = writeManifest([(kept, True), (temp, False)], old)
+        try:
+            netreposproxy.ChangesetProducer(path, None)
+        except IOError, err:
+            self.assertEqual(err.errno, errno.ENOENT)
+        else:
+            self.fail("expired manifest was resumed")
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(os.path.exists(temp))
+        self.assertTrue(os.path.exists(kept))
+
+        # a download which is still resumable keeps its files, even ones
+        # which are older than the manifest
+        temp = write('temp.ccs-out', 'abcdefghij', old)
+        live = writeManifest([(kept, True), (temp, False)], keepTime - 60)
+        orphan = write('orphan.ccs-out', 'abcdefghij', old)
+        fresh = write('fresh.ccs-out', 'abcdefghij')
+        expired = writeManifest([(kept, True)], old)
+        netreposproxy.ChangesetProducer.sweep(self.workDir, now)
+        self.assertTrue(os.path.exists(live))
+        self.assertTrue(os.path.exists(temp))
+        self.assertTrue(os.path.exists(fresh))
+        self.assertTrue(os.path.exists(kept))
+        self.assertFalse(os.path.exists(orphan))
+        self.assertFalse(os.path.exists(expired))
+
+        # resuming starts the clock again
+        producer = netreposproxy.ChangesetProducer(live, None)
+        self.assertTrue(os.stat(live).st_mtime >= now)
+        self.assertEqual(''.join(producer), '0123456789abcdefghij')
+        self.assertFalse(os.path.exists(live))
+        self.assertFalse(os.path.exists(temp))
+
+        # a single prepared changeset expires the same way
+        temp = write('single.ccs-out', 'abcdefghij', old)
+        self.assertRaises(IOError, netreposproxy.ChangesetProducer, temp,
+                None)
+        self.assertFalse(os.path.exists(temp))
+
 class ProxyTest(rephelp.RepositoryHelper):
 
     def _getRepos(self, proxyRepos):
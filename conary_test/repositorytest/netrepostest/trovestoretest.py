@@ -520,6 +520,66 @@ Some changes just are.
         store.db.commit()
 
 
+    def testBulkTroveSet(self):
+        store = self._connect()
+        # flush the staged rows after every trove
+        store.bulkRows = 1
+        flavor = deps.Flavor()
+
+        v10 = ThawVersion("/conary.rpath.com@test:trunk/10:1.2-10")
+        v20 = ThawVersion("/conary.rpath.com@test:trunk/20:1.2-20")
+
+        dirNames = set(['/bin'])
+        baseNames = set(['1', '2'])
+
+        f1 = files.FileFromFilesystem("/etc/passwd", self.id1)
+        f2 = files.FileFromFilesystem("/etc/services", self.id2)
+
+        def _commit(version, withStreams):
+            store.db.transaction()
+            store.addTroveSetStart([], dirNames, baseNames)
+            for name in ('foo:runtime', 'bar:runtime', 'baz:runtime'):
+                trv = trove.Trove(name, version, flavor, None)
+                trv.addFile(f1.pathId(), "/bin/1", version, f1.fileId())
+                trv.addFile(f2.pathId(), "/bin/2", version, f2.fileId())
+                trv.troveInfo.size.set(1234)
+                trv.computeDigests()
+                troveInfo = store.addTrove(trv, trv.diff(None)[0])
+                for fileObj, path in ((f1, "/bin/1"), (f2, "/bin/2")):
+                    stream = withStreams and fileObj.freeze() or None
+                    troveInfo.addFile(fileObj.pathId(), path,
+                                      fileObj.fileId(), version,
+                                      fileStream = stream)
+                store.addTroveDone(troveInfo)
+            store.addTroveSetDone()
+            store.db.commit()
+
+        # the first commit only references the files
+        _commit(v10, False)
+        cu = store.db.cursor()
+        cu.execute("SELECT count(*) FROM TroveFiles")
+        self.assertEqual(cu.next()[0], 6)
+        cu.execute("SELECT count(*) FROM FileStreams WHERE stream IS NULL")
+        self.assertEqual(cu.next()[0], 2)
+
+        # the second one fills in the missing streams and sha1s
+        _commit(v20, True)
+        cu.execute("SELECT count(*) FROM TroveFiles")
+        self.assertEqual(cu.next()[0], 12)
+        cu.execute("SELECT fileId, stream, sha1 FROM FileStreams")
+        streams = dict((cu.frombinary(x[0]), (cu.frombinary(x[1]),
+                                              cu.frombinary(x[2])))
+                       for x in cu)
+        self.assertEqual(streams, {
+            f1.fileId() : (f1.freeze(), f1.contents.sha1()),
+            f2.fileId() : (f2.freeze(), f2.contents.sha1()) })
+
+        for name in ('foo:runtime', 'bar:runtime', 'baz:runtime'):
+            trv = store.getTrove(name, v20, flavor)
+            self.assertEqual(trv.troveInfo.size(), 1234)
+            self.assertEqual(sorted(x[1] for x in trv.iterFileList()),
+                             [ '/bin/1', '/bin/2' ])
+
     def testRemoval(self):
         threshold = 60 * 5;         # 5 minutes
 
@@ -160,3 +160,33 @@ class VersionsSqlTest(dbstoretest.DBStoreTestBase):
         sv.nodes.updateSourceItemId(nodeId, srcId)
         cu.execute("select sourceItemId from Nodes where nodeId = ?", nodeId)
         self.assertEqual(cu.fetchall()[0][0], srcId)
+
+    def testLatestGenerations(self):
+        db = self.getDB()
+        schema.createSchema(db)
+        i = items.Items(db)
+        fooId = i.getOrAddId("foo:runtime")
+        i.getOrAddId("bar:runtime")
+        cu = db.cursor()
+
+        # schemas without the counters are left alone
+        db.setVersion((18, 1))
+        latest = versionops.LatestTable(db)
+        latest.update(cu, fooId, 1, 0)
+        self.assertEqual(latest.getGenerations(cu, ['foo:runtime']),
+                         (None, {}))
+
+        db.setVersion(versionops.GENERATION_SCHEMA)
+        latest = versionops.LatestTable(db)
+        self.assertEqual(latest.getGenerations(cu, ['foo:runtime', 'baz']),
+                         (0, { 'foo:runtime' : 0 }))
+        # updating the slots of an item only changes its own generation
+        latest.update(cu, fooId, 1, 0)
+        latest.update(cu, fooId, 2, 0)
+        self.assertEqual(latest.getGenerations(cu,
+                                ['foo:runtime', 'bar:runtime']),
+                         (0, { 'foo:runtime' : 2, 'bar:runtime' : 0 }))
+        # rebuilding the rows of a role changes everything
+        latest.updateRoleId(cu, 1)
+        self.assertEqual(latest.getGenerations(cu, ['bar:runtime']),
+                         (1, { 'bar:runtime' : 0 }))
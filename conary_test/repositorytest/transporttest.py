@@ -18,6 +18,7 @@
 import os
 import SimpleHTTPServer
 import socket
+import StringIO
 import time
 import httplib
 from SimpleHTTPServer import SimpleHTTPRequestHandler
@@ -751,6 +752,28 @@ class TransportTest(rephelp.RepositoryHelper):
         self.assertRaises(SSL.SSLError, self._testSSLCertCheck,
                 ('ssl-self-signed.pem', 'ssl-self-signed.pem'))
 
+    def testResumableDownload(self):
+        httpServer = rephelp.HTTPServerController(RequestHandlerRange)
+        try:
+            url = "http://localhost:%s/someurl" % httpServer.port
+            body = RequestHandlerRange.body
+            opener = transport.ConaryURLOpener()
+
+            inF = opener.openResumable(url)
+            outF = StringIO.StringIO()
+            self.assertEqual(util.copyfileobj(inF, outF), len(body))
+            self.assertEqual(outF.getvalue(), body)
+            self.assertEqual(inF.headers['content-length'], str(len(body)))
+            inF.close()
+
+            # without retries the truncated body is all there is
+            inF = opener.openResumable(url, attempts=0)
+            outF = StringIO.StringIO()
+            self.assertEqual(util.copyfileobj(inF, outF), len(body) // 2)
+            inF.close()
+        finally:
+            httpServer.kill()
+
 
 class SimpleXMLRPCServer6(SimpleXMLRPCServer):
     address_family = socket.AF_INET6
@@ -798,3 +821,26 @@ class RequestHandler404(SimpleHTTPServer.SimpleHTTPRequestHandler):
 
 class RequestHandler200(RequestHandler404):
     code = 200
+
+
+class RequestHandlerRange(RequestHandler404):
+    # Hangs up halfway through the body unless a range was asked for
+    body = ''.join(chr(x % 251) for x in range(300000))
+
+    def do_GET(self):
+        rangeHeader = self.headers.get('Range')
+        size = len(self.body)
+        if rangeHeader:
+            start = int(rangeHeader[len('bytes='):-1])
+            data = self.body[start:]
+            self.send_response(206)
+            self.send_header('Content-Range',
+                    'bytes %d-%d/%d' % (start, size - 1, size))
+        else:
+            start = 0
+            data = self.body[:size // 2]
+            self.send_response(200)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(size - start))
+        self.end_headers()
+        self.wfile.write(data)
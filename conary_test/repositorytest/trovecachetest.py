@@ -0,0 +1,263 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+from testrunner import testhelp
+
+import cPickle
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from conary import trove
+from conary.deps import deps
+from conary.repository import changeset, filecontents, trovecache
+from conary.versions import ThawVersion
+
+
+class TroveSource(object):
+
+    def __init__(self, troves):
+        self.troves = dict((x.getNameVersionFlavor(), x) for x in troves)
+        self.fetched = []
+
+    def getTroves(self, troveTupList, withFiles = False, callback = None):
+        self.fetched.extend(troveTupList)
+        return [ self.troves[x] for x in troveTupList ]
+
+    def getTimestamps(self, troveTupList):
+        return [ self.troves[x].getVersion() for x in troveTupList ]
+
+
+class TroveCacheTest(testhelp.TestCase):
+
+    def setUp(self):
+        testhelp.TestCase.setUp(self)
+        self.workDir = tempfile.mkdtemp()
+        self.path = os.path.join(self.workDir, 'modelcache')
+        self.troves = self._makeTroves(20)
+        self.tups = [ x.getNameVersionFlavor() for x in self.troves ]
+
+    def tearDown(self):
+        shutil.rmtree(self.workDir)
+        testhelp.TestCase.tearDown(self)
+
+    def _makeTroves(self, count):
+        troves = []
+        for i in range(count):
+            trv = trove.Trove('foo%d:runtime' % i,
+                    ThawVersion('/localhost@rpl:linux/%d.000:1.0-1-1' % (i + 1)),
+                    deps.parseFlavor('is: x86'), None)
+            trv.setProvides(deps.parseDep('trove: foo%d:runtime' % i))
+            trv.computeDigests()
+            troves.append(trv)
+        return troves
+
+    def _newCache(self, troves = None):
+        return trovecache.TroveCache(TroveSource(troves or []))
+
+    def _fillCache(self, tups):
+        cache = self._newCache(self.troves)
+        cache.cacheTroves(tups)
+        cache.getTimestamps(tups[:2])
+        cache.addDepSolution('\0' * 20, deps.parseDep('trove: bar:runtime'),
+                             [ [ tups[0] ] ])
+        cache.cacheFile('key', [ 'line\n' ])
+        return cache
+
+    def testSaveLoad(self):
+        cache = self._fillCache(self.tups[:10])
+        self.assertTrue(cache.cacheModified())
+        cache.save(self.path)
+        self.assertFalse(cache.cacheModified())
+
+        cache = self._newCache()
+        cache.load(self.path)
+        # nothing is read until it is asked for
+        self.assertEqual(dict.__len__(cache.cache), 0)
+        self.assertTrue(cache.troveIsCached(self.tups[3]))
+        self.assertEqual(dict.__len__(cache.cache), 1)
+        self.assertEqual(cache.getTrove(withFiles = False, *self.tups[3]),
+                         self.troves[3])
+        self.assertFalse(cache.troveIsCached(self.tups[15]))
+        self.assertEqual(cache.getTimestamps(self.tups[:2]),
+                         [ x[1] for x in self.tups[:2] ])
+        self.assertEqual(cache.getDepSolution('\0' * 20,
+                                deps.parseDep('trove: bar:runtime')),
+                         [ [ self.tups[0] ] ])
+        self.assertEqual(cache.getCachedFile('key'), [ 'line\n' ])
+        self.assertEqual(cache.getDepsForTroveList(self.tups[5:6]),
+                [ (self.troves[5].getProvides(),
+                   self.troves[5].getRequires()) ])
+        self.assertEqual(sorted(x.getName() for x in
+                                cache.iterCachedTroves()),
+                         sorted(x[0] for x in self.tups[:10]))
+        self.assertFalse(cache.cacheModified())
+
+    def testAppend(self):
+        cache = self._fillCache(self.tups[:10])
+        cache.save(self.path)
+        before = open(self.path).read()
+
+        cache = self._newCache(self.troves)
+        cache.load(self.path)
+        cache.cacheTroves(self.tups[:12])
+        # only the troves missing from the file are fetched, and only
+        # they are written
+        self.assertEqual(cache.troveSource.fetched, self.tups[10:12])
+        cache.save(self.path)
+        after = open(self.path).read()
+        self.assertEqual(after[:len(before)], before)
+
+        cache = self._newCache()
+        cache.load(self.path)
+        self.assertEqual(cache.getTroves(self.tups[:12]), self.troves[:12])
+
+    def testFailedAppend(self):
+        cache = self._fillCache(self.tups[:5])
+        cache.save(self.path)
+        before = open(self.path).read()
+
+        class ShortFile(object):
+            # writes half of what it is given, then fails
+            def __init__(self, f):
+                self.f = f
+            def write(self, data):
+                self.f.write(data[:len(data) / 2])
+                raise IOError(28, 'No space left on device')
+            def __getattr__(self, name):
+                return getattr(self.f, name)
+
+        cache = self._newCache(self.troves)
+        cache.load(self.path)
+        cache.cacheTroves(self.tups[5:8])
+        trovecache.open = lambda *args: ShortFile(open(*args))
+        try:
+            cache.save(self.path)
+        finally:
+            del trovecache.open
+        # the file is left as it was, and the entries are still unsaved
+        self.assertEqual(open(self.path).read(), before)
+        self.assertTrue(cache.cacheModified())
+        cache.save(self.path)
+        self.assertEqual(open(self.path).read()[:len(before)], before)
+
+        cache = self._newCache()
+        cache.load(self.path)
+        self.assertEqual(cache.getTroves(self.tups[:8]), self.troves[:8])
+
+    def testConcurrentLoad(self):
+        cache = self._fillCache(self.tups[:5])
+        cache.save(self.path)
+
+        loaded = []
+        class SlowCache(trovecache.TroveCache):
+            def _fromFile(self, kind, key):
+                time.sleep(0.1)
+                return trovecache.TroveCache._fromFile(self, kind, key)
+            def _cached(self, troveTupList, troveList):
+                loaded.extend(troveTupList)
+
+        cache = SlowCache(TroveSource([]))
+        cache.load(self.path)
+        threads = [ threading.Thread(target = cache.cache.__getitem__,
+                                     args = (self.tups[0], ))
+                    for x in range(2) ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # the trove was faulted in once
+        self.assertEqual(loaded, self.tups[:1])
+        self.assertEqual(cache.getTroves(self.tups[:1]), self.troves[:1])
+
+    def testCompaction(self):
+        troves = self._makeTroves(100)
+        tups = [ x.getNameVersionFlavor() for x in troves ]
+        cache = self._newCache(troves)
+        cache.cacheTroves(tups[:1])
+        cache.save(self.path)
+        sizes = []
+        for tup in tups[1:]:
+            cache = self._newCache(troves)
+            cache.load(self.path)
+            cache.cacheTroves([ tup ])
+            cache.save(self.path)
+            sizes.append(os.stat(self.path).st_size)
+        # the old indexes pile up until the file gets rewritten
+        self.assertTrue([ x for x in range(1, len(sizes))
+                          if sizes[x] < sizes[x - 1] ])
+        cacheFile = trovecache.TroveCacheFile(self.path)
+        self.assertTrue(cacheFile.garbage * 2 <= cacheFile.size)
+        cacheFile.close()
+        cache = self._newCache()
+        cache.load(self.path)
+        self.assertEqual(cache.getTroves(tups), troves)
+
+    def testLegacyFormat(self):
+        cs = changeset.ChangeSet()
+        for trv in self.troves[:5]:
+            cs.newTrove(trv.diff(None, absolute = True)[0])
+        fileId = trovecache.TroveCache._fileId
+        for pathId, contents in [
+                (trovecache.TroveCache._troveCacheVersionPathId, '4 0'),
+                (trovecache.TroveCache._timeStampsPathId,
+                        cPickle.dumps([])),
+                (trovecache.TroveCache._depCachePathId, cPickle.dumps([])),
+                (trovecache.TroveCache._depSolutionsPathId,
+                        cPickle.dumps([])),
+                (trovecache.TroveCache._includeFilePathId,
+                        cPickle.dumps({ 'key' : [ 'line\n' ] })) ]:
+            if pathId == trovecache.TroveCache._troveCacheVersionPathId:
+                # the version is stored with pathId and fileId swapped
+                pathId, fileIdArg = fileId, pathId
+            else:
+                fileIdArg = fileId
+            cs.addFileContents(pathId, fileIdArg,
+                               changeset.ChangedFileTypes.file,
+                               filecontents.FromString(contents), False)
+        cs.writeToFile(self.path)
+
+        cache = self._newCache()
+        cache.load(self.path)
+        self.assertEqual(dict.__len__(cache.cache), 5)
+        # old caches are written out again in the new format
+        self.assertTrue(cache.cacheModified())
+        cache.save(self.path)
+        self.assertTrue(trovecache.TroveCacheFile.isTroveCacheFile(self.path))
+
+        cache = self._newCache()
+        cache.load(self.path)
+        self.assertEqual(cache.getTroves(self.tups[:5]), self.troves[:5])
+        self.assertEqual(cache.getCachedFile('key'), [ 'line\n' ])
+
+    def testCorruptFile(self):
+        cache = self._fillCache(self.tups[:5])
+        cache.save(self.path)
+        contents = open(self.path).read()
+        open(self.path, 'w').write(contents[:-10])
+
+        cache = self._newCache(self.troves)
+        cache.load(self.path)
+        self.assertFalse(cache.troveIsCached(self.tups[0]))
+        cache.cacheTroves(self.tups[:1])
+        cache.save(self.path)
+
+        cache = self._newCache()
+        cache.load(self.path)
+        self.assertEqual(cache.getTroves(self.tups[:1]), self.troves[:1])
@@ -540,6 +540,27 @@ class ChangesetFilesTest(rephelp.RepositoryHelper):
         for s in ts8.iterSources():
             self.assertFalse(isinstance(s, TroveSourceStack))
 
+    def testSourceStackMultipleTroveInfo(self):
+        class InfoSource(SimplestFindTroveSource):
+            def __init__(self, info):
+                SimplestFindTroveSource.__init__(self)
+                self.info = info
+            def getMultipleTroveInfo(self, infoTypes, troveTupList):
+                return [ [ self.info.get((infoType, x), -1)
+                           for x in troveTupList ]
+                         for infoType in infoTypes ]
+
+        nodeps = deps.parseFlavor('')
+        tup1 = ('foo', VFS('/localhost@rpl:devel/1.0-1-1'), nodeps)
+        tup2 = ('bar', VFS('/localhost@rpl:devel/1.0-1-1'), nodeps)
+        # the first source knows only some of the info for tup1
+        s1 = InfoSource({ (1, tup1) : 'size1' })
+        s2 = InfoSource({ (1, tup1) : 'size2', (2, tup1) : 'source2',
+                          (1, tup2) : 'size3', (2, tup2) : -2 })
+        ts = stack(s1, s2)
+        self.assertEqual(ts.getMultipleTroveInfo([ 1, 2 ], [ tup1, tup2 ]),
+                         [ [ 'size1', 'size3' ], [ 'source2', None ] ])
+
     def testUnreachableSource(self):
         """createChangeSet must not mask network errors without a good reason
 
@@ -655,6 +655,36 @@ class MirrorTest(rephelp.RepositoryHelper):
         mirror.mirrorRepository(src, dst, cfg)
         self.compareRepositories(src, dst)
 
+    @skipproxy
+    def testPrefetchBundles(self):
+        src, dst = self.createRepositories()
+        cfg = mirror.MirrorFileConfiguration()
+        cfg.host = "localhost"
+        cfg.useHiddenCommits = False
+        cfg.prefetchBundles = 3
+        # each version of the troves gets its own bundle
+        cfg.splitNodes = True
+        for i in range(5):
+            self.createTroves(src, 10, 3, "%d.0" % (i + 1))
+
+        # the mirror mark follows the bundles as they are committed
+        marks = []
+        setMirrorMark = dst.setMirrorMark
+        def _setMirrorMark(host, mark):
+            marks.append(long(mark))
+            if len(marks) == 2:
+                raise RuntimeError('interrupted')
+            return setMirrorMark(host, mark)
+        self.mock(dst, 'setMirrorMark', _setMirrorMark)
+        self.assertRaises(RuntimeError, mirror.mirrorRepository, src, dst,
+                          cfg)
+        self.unmock()
+        self.assertTrue(marks[1] > marks[0])
+        self.assertRaises(AssertionError, self.compareRepositories, src, dst)
+
+        self._runMirrorCfg(src, dst, cfg)
+        self.compareRepositories(src, dst)
+
     @skipproxy
     def testMirrorPublish(self):
         # tests publish by group access
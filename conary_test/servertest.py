@@ -19,8 +19,11 @@ from testrunner import testhelp
 from testutils import sock_utils
 import os
 import signal
+import socket
 import sys
+import threading
 import urllib2
+import xmlrpclib
 
 import conary_test
 
@@ -31,8 +34,10 @@ from conary import conarycfg
 from conary import conaryclient
 from conary import dbstore
 from conary.lib import util
+from conary.repository import xmlshims
 from conary.repository.netrepos import netserver, proxy
 from conary.repository.netrepos import netauth
+from conary.server import asyncserver
 from conary.server import server
 from conary.server import schema
 
@@ -142,6 +147,92 @@ class ServerTest(rephelp.RepositoryHelper):
             os.kill(pid, signal.SIGTERM)
             os.waitpid(pid, 0)
 
+    def testAsyncServer(self):
+        # Transfers that stall must not hold up XML-RPC calls
+        tmpDir = os.path.join(self.workDir, 'tmp')
+        util.mkdirChain(tmpDir)
+        big = os.path.join(self.workDir, 'big')
+        bigData = os.urandom(1024) * 16384
+        file(big, 'w').write(bigData)
+        manifest = netserver.ManifestWriter(tmpDir)
+        manifest.append(big, len(bigData), False, True, 0)
+        downloadName = manifest.close()
+        uploadName = 'upload.ccs'
+        file(os.path.join(tmpDir, uploadName + '-in'), 'w').close()
+        uploadData = os.urandom(1024) * 1024
+
+        class Repository(object):
+            def callWrapper(self, methodname, request, **kwargs):
+                return xmlshims.ResponseArgs.newResult(
+                        [methodname] + list(request.args)), None
+
+            def getContentsStore(self):
+                return None
+
+        class HttpRequestsSubclass(server.HttpRequests):
+            netRepos = Repository()
+            restHandler = None
+        HttpRequestsSubclass.tmpDir = tmpDir
+        HttpRequestsSubclass.cfg = server.ServerConfig()
+
+        port = testhelp.findPorts(1)[0]
+        pid = os.fork()
+        if not pid:
+            try:
+                httpServer = asyncserver.AsyncHTTPServer(("", port),
+                        HttpRequestsSubclass)
+                self.captureOutput(server.serve, httpServer)
+            finally:
+                os._exit(0)
+        try:
+            sock_utils.tryConnect("127.0.0.1", port)
+            oldTimeout = socket.getdefaulttimeout()
+            socket.setdefaulttimeout(30)
+
+            download = socket.create_connection(('127.0.0.1', port))
+            download.sendall('GET /changeset?%s HTTP/1.0\r\n\r\n'
+                    % downloadName)
+            downloadF = download.makefile('rb')
+            self.assertEqual(downloadF.readline(), 'HTTP/1.0 200 OK\r\n')
+
+            upload = socket.create_connection(('127.0.0.1', port))
+            upload.sendall('PUT /changeset?%s HTTP/1.0\r\n'
+                    'Content-Length: %d\r\n\r\n'
+                    % (uploadName, len(uploadData)))
+            upload.sendall(uploadData[:len(uploadData) // 2])
+
+            # many short calls while both transfers are stalled
+            url = 'http://127.0.0.1:%d/conary/' % port
+            results = {}
+            def call(idx):
+                sp = xmlrpclib.ServerProxy(url)
+                results[idx] = sp.checkVersion(60, [idx], {})
+            threads = [ threading.Thread(target=call, args=(x,))
+                        for x in range(50) ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(results, dict(
+                (x, [['checkVersion', x]]) for x in range(50)))
+
+            upload.sendall(uploadData[len(uploadData) // 2:])
+            self.assertEqual(upload.makefile('rb').readline(),
+                    'HTTP/1.0 200 OK\r\n')
+            upload.close()
+            self.assertEqual(
+                    file(os.path.join(tmpDir, uploadName + '-in')).read(),
+                    uploadData)
+
+            while downloadF.readline() != '\r\n':
+                pass
+            self.assertEqual(downloadF.read(), bigData)
+            download.close()
+            socket.setdefaulttimeout(oldTimeout)
+        finally:
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+
     def testSecureHTTPServer(self):
         # Checks that the secure SSL server works
         if not server.SSL:
@@ -18,6 +18,8 @@
 from testrunner import testhelp
 from testrunner import testcase
 import itertools
+import os
+import tempfile
 import time
 from conary import changelog, streams, trove, trovetup
 from conary.trove import Trove
@@ -31,6 +33,7 @@ from conary.deps.deps import DependencySet, Flavor
 from conary.deps.deps import Dependency
 from conary.deps.deps import FileDependencies
 from conary.deps.deps import parseFlavor
+from conary.lib import util
 from conary.lib.openpgpkey import getKeyCache
 from conary.lib.sha1helper import md5FromString, md5String
 from conary.lib.sha1helper import sha1FromString, sha1ToString, sha1String
@@ -1442,6 +1445,55 @@ Some changes just are.
         p.removeAllFiles()
         assert(len(p.idMap) == 0)
 
+    def testFlavorScoreCache(self):
+        x86 = parseFlavor('is: x86')
+        x86_64 = parseFlavor('is: x86_64')
+        ssl = parseFlavor('ssl is: x86')
+        empty = Flavor()
+
+        tdir = tempfile.mkdtemp()
+        try:
+            path = tdir + '/flavorscores'
+            cache = trove.FlavorScoreCache(path, limit = 4)
+            score = cache[x86, ssl]
+            assert(score > cache.NEG_INF)
+            self.assertEqual(cache[ssl, x86], score)
+            self.assertEqual(cache[empty, empty], cache.POS_INF)
+            assert(not cache.matches(x86, x86_64))
+            # only the two most recent generations are kept in memory
+            assert(len(cache.cache) + len(cache.old) <= 8)
+            # nothing is written until the cache is saved
+            assert(not os.path.exists(path))
+            cache.save()
+            assert(not cache.dirty)
+
+            # a new cache loads the scores on first use, without
+            # computing them again
+            cache = trove.FlavorScoreCache(path, limit = 4)
+            assert(not cache.loaded)
+            self.mock(Flavor, 'score', lambda *args: self.fail())
+            self.assertEqual(cache[ssl, x86], score)
+            assert(cache.loaded)
+            assert(not cache.dirty)
+            self.unmock()
+
+            # damaged files are ignored
+            open(path, 'w').write('garbage')
+            cache = trove.FlavorScoreCache(path)
+            self.assertEqual(cache[x86, ssl], score)
+            cache.save()
+            cache = trove.FlavorScoreCache(path)
+            cache._load()
+            assert(cache.old)
+
+            # so are files which can't be written
+            cache = trove.FlavorScoreCache(tdir + '/missing/flavorscores')
+            cache[x86, ssl]
+            cache.save()
+            assert(cache.dirty)
+        finally:
+            util.rmtree(tdir)
+
 from conary_test import rephelp
 class TroveTest2(rephelp.RepositoryHelper):
 